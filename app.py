@@ -7,10 +7,11 @@ import sqlalchemy as sa
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from core.config import get_config
-from core.db_utils import engine, next_id  # Inicializa DB y proxys al importar
+from core.db_utils import engine, next_id, reserve_ids  # Inicializa DB y proxys al importar
 from core.extensions import init_extensions
 from services.email_service import (
     enviar_actualizacion_pedido,
+    enviar_actualizaciones_pedido_lote,
     enviar_codigo_verificacion,
     enviar_notificacion_pago_personalizado_admin,
     enviar_notificacion_transferencia_admin,
@@ -53,18 +54,25 @@ from routes.checkout import register_checkout_legacy_routes
 from routes.custom_orders import register_custom_orders_legacy_routes
 from routes.main import healthcheck
 from routes.user import register_user_legacy_routes
+from services import activity_log_service as app_activity_log_service
+from services import admin_orders_query_service as app_admin_orders_query_service
 from services import auth_service as app_auth_service
+from services import charts_service as app_charts_service
 from services import dashboard_service as app_dashboard_service
+from services import export_service as app_export_service
 from services import image_service as app_image_service
 from services import mail_service as app_mail_service
 from services import order_service
 from services import promo_service as app_promo_service
 from services import receipt_service as app_receipt_service
+from services import repository_service as app_repository_service
+from services import sales_export_service as app_sales_export_service
 from services import storage_service as app_storage_service
 from services import user_orders_service
 from services.auth_image_facade import build_auth_image_legacy_bindings
 from services.cart_facade import build_cart_legacy_bindings
 from services.receipt_facade import build_receipt_legacy_bindings
+from services.registro_pendiente_store import crear_almacen_registros_pendientes
 from services.runtime_facade import build_runtime_bindings
 from services.workflow_facade import build_workflow_legacy_bindings
 from services.stripe_service import (
@@ -87,9 +95,20 @@ if not app.secret_key:
 init_extensions(app)
 app.add_url_rule("/health", endpoint="healthcheck", view_func=healthcheck)
 
-PENDING_REGISTRATIONS = {}
+PENDING_REGISTRATIONS = crear_almacen_registros_pendientes(app.config.get("PENDING_REGISTRATION_BACKEND"), engine)
+bitacora_actividad = app_activity_log_service.BitacoraActividad(
+    espera_ms=app.config.get("ACTIVITY_LOG_BUFFER_MS", 0),
+    max_lote=app.config.get("ACTIVITY_LOG_MAX_LOTE", 200),
+    max_pendientes=app.config.get("ACTIVITY_LOG_MAX_PENDIENTES", 10000),
+)
+trabajos_exportacion = app_export_service.TrabajosExportacion(
+    os.path.join(app.root_path, app.config.get("EXPORT_CACHE_DIR", "cache/exportes")),
+    max_workers=app.config.get("EXPORT_WORKERS", 2),
+    ttl_segundos=app.config.get("EXPORT_CACHE_TTL_SEGUNDOS", 600),
+)
 
 # DB init y proxys se hacen al importar db_utils
+app_image_service.construir_indice_galeria()
 
 normalizar_intendencia = app_storage_service.normalizar_intendencia
 producto_requiere_talla = app_storage_service.producto_requiere_talla
@@ -116,8 +135,23 @@ cargar_detalle_pedido_df = app_storage_service.cargar_detalle_pedido_df
 guardar_detalle_pedido_df = app_storage_service.guardar_detalle_pedido_df
 cargar_pagos_df = app_storage_service.cargar_pagos_df
 guardar_pagos_df = app_storage_service.guardar_pagos_df
+anexar_filas_df = order_service.anexar_filas_df
 cargar_productos_por_fuerza = app_storage_service.cargar_productos_por_fuerza
 cargar_productos_por_intendencia = app_storage_service.cargar_productos_por_intendencia
+obtener_usuario_por_email = app_repository_service.obtener_usuario_por_email
+registrar_inicio_sesion_usuario = app_repository_service.registrar_inicio_sesion_usuario
+obtener_producto = app_repository_service.obtener_producto
+obtener_pedido_con_detalle = app_repository_service.obtener_pedido_con_detalle
+ultimo_pago_de_pedido = app_repository_service.ultimo_pago_de_pedido
+obtener_datos_recibo_pedido = app_repository_service.obtener_datos_recibo_pedido
+consultar_registros_actividad = app_activity_log_service.consultar_registros
+contar_registros_actividad = app_activity_log_service.contar_registros
+ultimo_id_registro_actividad = app_activity_log_service.ultimo_id_registro
+exportar_registros_excel = app_activity_log_service.exportar_registros_excel
+obtener_datos_charts = app_charts_service.obtener_datos_charts
+marca_datos_charts = app_charts_service.marca_datos_charts
+escribir_excel_charts = app_charts_service.escribir_excel_charts
+generar_csv_ventas = app_sales_export_service.generar_csv_ventas
 
 globals().update(
     build_auth_image_legacy_bindings(
@@ -137,14 +171,24 @@ parsear_fecha_promocion = app_promo_service.parsear_fecha_promocion
 estado_vigencia_promocion = app_promo_service.estado_vigencia_promocion
 promocion_esta_aplicable = app_promo_service.promocion_esta_aplicable
 calcular_descuento_promocion = app_promo_service.calcular_descuento_promocion
-obtener_mejor_promocion_por_producto = app_promo_service.obtener_mejor_promocion_por_producto
-buscar_promocion_por_codigo = app_promo_service.buscar_promocion_por_codigo
+evaluar_promociones_lote = app_promo_service.evaluar_promociones_lote
+obtener_mejor_promocion_por_producto = partial(
+    app_promo_service.obtener_mejor_promocion_por_producto_indexada,
+    cargar_productos_df_fn=cargar_productos_df,
+    cargar_promociones_df_fn=cargar_promociones_df,
+    version_catalogo_df_fn=app_storage_service.version_catalogo_df,
+)
+buscar_promocion_por_codigo = partial(
+    app_promo_service.buscar_promocion_por_codigo_indexada,
+    cargar_productos_df_fn=cargar_productos_df,
+    cargar_promociones_df_fn=cargar_promociones_df,
+    version_catalogo_df_fn=app_storage_service.version_catalogo_df,
+)
 
 globals().update(
     build_runtime_bindings(
         session_obj=session,
-        cargar_registros_df_fn=cargar_registros_df,
-        guardar_registros_df_fn=guardar_registros_df,
+        anexar_actividad_fn=bitacora_actividad.registrar,
         cargar_usuarios_df_fn=cargar_usuarios_df,
         currency_code=CURRENCY_CODE,
         currency_name=CURRENCY_NAME,
@@ -155,15 +199,16 @@ globals().update(
     build_receipt_legacy_bindings(
         app_receipt_service=app_receipt_service,
         session_obj=session,
-        cargar_detalle_pedido_df_fn=cargar_detalle_pedido_df,
-        cargar_productos_df_fn=cargar_productos_df,
-        cargar_pagos_df_fn=cargar_pagos_df,
-        cargar_pedidos_df_fn=cargar_pedidos_df,
+        obtener_datos_recibo_pedido_fn=obtener_datos_recibo_pedido,
         tallas_opciones=TALLAS_OPCIONES,
         formatear_cop_fn=formatear_cop,
         app_root_path=app.root_path,
         render_template_fn=render_template,
         edge_path_env=os.environ.get('EDGE_PATH', ''),
+        pdf_navegadores_max=app.config.get("RECIBO_PDF_NAVEGADORES", 2),
+        pdf_motor=app.config.get("RECIBO_PDF_MOTOR", "nativo"),
+        cache_recibos_dir=os.path.join(app.root_path, app.config.get("RECIBO_CACHE_DIR", "cache/recibos")),
+        cache_recibos_max_mb=app.config.get("RECIBO_CACHE_MAX_MB", 64),
     )
 )
 
@@ -197,6 +242,7 @@ globals().update(
         app_dashboard_service=app_dashboard_service,
         app_mail_service=app_mail_service,
         order_service=order_service,
+        admin_orders_query_service=app_admin_orders_query_service,
         request_obj=request,
         session_obj=session,
         app_obj=app,
@@ -206,6 +252,7 @@ globals().update(
         cargar_promociones_df_fn=cargar_promociones_df,
         obtener_mejor_promocion_por_producto_fn=obtener_mejor_promocion_por_producto,
         calcular_descuento_promocion_fn=calcular_descuento_promocion,
+        evaluar_promociones_lote_fn=evaluar_promociones_lote,
         formatear_cop_fn=formatear_cop,
         obtener_galeria_producto_fn=obtener_galeria_producto,
         cargar_productos_df_fn=cargar_productos_df,
@@ -226,9 +273,11 @@ globals().update(
         normalizar_email_fn=normalizar_email,
         email_es_valido_fn=email_es_valido,
         enviar_actualizacion_pedido_fn=enviar_actualizacion_pedido,
+        enviar_actualizaciones_pedido_lote_fn=enviar_actualizaciones_pedido_lote,
         enviar_notificacion_pago_personalizado_admin_fn=enviar_notificacion_pago_personalizado_admin,
         enviar_notificacion_transferencia_admin_fn=enviar_notificacion_transferencia_admin,
         next_id_fn=next_id,
+        reserve_ids_fn=reserve_ids,
         guardar_pagos_df_fn=guardar_pagos_df,
         guardar_detalle_pedido_df_fn=guardar_detalle_pedido_df,
         guardar_pedidos_df_fn=guardar_pedidos_df,
@@ -240,6 +289,8 @@ globals().update(
         stripe_checkout_guardar_creado_fn=_stripe_checkout_guardar_creado,
         logger_obj=app.logger,
         obtener_items_personalizados_carrito_fn=app_mail_service.obtener_items_personalizados_carrito,
+        engine=engine,
+        sa_module=sa,
     )
 )
 
@@ -35,8 +35,38 @@ class BaseConfig:
     MAIL_USERNAME = os.getenv("MAIL_USERNAME", MAIL_USERNAME_DEFAULT)
     MAIL_PASSWORD = os.getenv("MAIL_PASSWORD", MAIL_PASSWORD_DEFAULT)
     MAIL_DEFAULT_SENDER = os.getenv("MAIL_DEFAULT_SENDER", MAIL_DEFAULT_SENDER_DEFAULT)
+    MAIL_OUTBOX_ENABLED = str(os.getenv("MAIL_OUTBOX_ENABLED", "true")).strip().lower() in {
+        "1",
+        "true",
+        "yes",
+        "on",
+    }
+    MAIL_OUTBOX_WORKERS = int(os.getenv("MAIL_OUTBOX_WORKERS", "1"))
+    MAIL_OUTBOX_MAX_INTENTOS = int(os.getenv("MAIL_OUTBOX_MAX_INTENTOS", "5"))
+    MAIL_SMTP_POOL_SIZE = int(os.getenv("MAIL_SMTP_POOL_SIZE", "2"))
+    MAIL_SMTP_KEEPALIVE_SEGUNDOS = int(os.getenv("MAIL_SMTP_KEEPALIVE_SEGUNDOS", "60"))
+
+    # 0 = cada accion se inserta al momento; > 0 agrupa las acciones y las inserta juntas cada N ms.
+    ACTIVITY_LOG_BUFFER_MS = int(os.getenv("ACTIVITY_LOG_BUFFER_MS", "0"))
+    ACTIVITY_LOG_MAX_LOTE = int(os.getenv("ACTIVITY_LOG_MAX_LOTE", "200"))
+    ACTIVITY_LOG_MAX_PENDIENTES = int(os.getenv("ACTIVITY_LOG_MAX_PENDIENTES", "10000"))
+
+    # "postgres" comparte los codigos de registro entre workers; "memoria" los deja en el proceso.
+    PENDING_REGISTRATION_BACKEND = os.getenv("PENDING_REGISTRATION_BACKEND", "postgres").strip().lower() or "postgres"
 
     PROJECT_NAME = os.getenv("PROJECT_NAME", "NACHOHERS").strip() or "NACHOHERS"
+    # "nativo" dibuja el recibo sin navegador; "navegador" usa Edge/Chromium (pool DevTools o msedge).
+    RECIBO_PDF_MOTOR = os.getenv("RECIBO_PDF_MOTOR", "nativo").strip().lower() or "nativo"
+    RECIBO_PDF_NAVEGADORES = int(os.getenv("RECIBO_PDF_NAVEGADORES", "2"))
+    # Recibos ya generados (PDF/HTML) para reimpresiones; relativo a la raiz de la app.
+    RECIBO_CACHE_DIR = os.getenv("RECIBO_CACHE_DIR", "cache/recibos").strip() or "cache/recibos"
+    RECIBO_CACHE_MAX_MB = float(os.getenv("RECIBO_CACHE_MAX_MB", "64"))
+    # Exportaciones .xlsx terminadas (se reutilizan durante EXPORT_CACHE_TTL_SEGUNDOS); relativo a la raiz de la app.
+    EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", "cache/exportes").strip() or "cache/exportes"
+    EXPORT_CACHE_TTL_SEGUNDOS = int(os.getenv("EXPORT_CACHE_TTL_SEGUNDOS", "600"))
+    EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+    # Por encima de este numero de filas la exportacion se genera en segundo plano.
+    EXPORT_SINCRONO_MAX_FILAS = int(os.getenv("EXPORT_SINCRONO_MAX_FILAS", "20000"))
     TRANSFER_QR_IMAGE = os.getenv("TRANSFER_QR_IMAGE", "img/Pagina/qr.jpeg").strip() or "img/Pagina/qr.jpeg"
     TRANSFER_SUPPORT_EMAIL = os.getenv("TRANSFER_SUPPORT_EMAIL", MAIL_DEFAULT_SENDER).strip()
     TRANSFER_SUPPORT_WHATSAPP = os.getenv("TRANSFER_SUPPORT_WHATSAPP", "").strip()
@@ -1,3 +1,4 @@
+from datetime import datetime
 import os
 import re
 
@@ -65,6 +66,93 @@ def _safe_identifier(value):
     return ident
 
 
+# Varias fechas del respaldo (pedidos.fecha_pedido, registros.fecha_accion, pagos.fecha_pago)
+# son TEXT; en instalaciones nuevas son TIMESTAMPTZ. fecha_hora_segura() convierte ambas a
+# TIMESTAMP y devuelve NULL para valores que no empiezan con una fecha ISO en vez de abortar
+# la consulta. Solo acepta el formato ISO, que no depende de DateStyle: por eso puede
+# declararse IMMUTABLE y usarse en indices de expresion.
+FECHA_HORA_SEGURA_DDL = """
+CREATE OR REPLACE FUNCTION fecha_hora_segura(valor TEXT) RETURNS TIMESTAMP AS $$
+BEGIN
+    IF valor IS NULL OR valor !~ '^ *[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}' THEN
+        RETURN NULL;
+    END IF;
+    RETURN CAST(valor AS TIMESTAMP);
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+"""
+
+
+def fecha_hora_sql(columna):
+    """Expresion SQL de `columna` como TIMESTAMP; debe coincidir con la de los indices de fecha."""
+    return f"fecha_hora_segura(CAST({columna} AS TEXT))"
+
+
+# Cada escritura en pedidos, detalle_pedido o pagos marca el dia del pedido como pendiente;
+# services/sales_rollup_service recalcula solo esos dias en ventas_diarias. Las fechas que
+# fecha_hora_segura() no reconoce no marcan ningun dia, en vez de abortar la escritura.
+VENTAS_DIARIAS_TRIGGERS_DDL = """
+CREATE OR REPLACE FUNCTION marcar_ventas_diarias_pedido() RETURNS trigger AS $$
+DECLARE
+    dia_pedido DATE;
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        dia_pedido := CAST(fecha_hora_segura(CAST(OLD.fecha_pedido AS TEXT)) AS DATE);
+        IF dia_pedido IS NOT NULL THEN
+            INSERT INTO ventas_diarias_pendiente (dia) VALUES (dia_pedido) ON CONFLICT DO NOTHING;
+        END IF;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        dia_pedido := CAST(fecha_hora_segura(CAST(NEW.fecha_pedido AS TEXT)) AS DATE);
+        IF dia_pedido IS NOT NULL THEN
+            INSERT INTO ventas_diarias_pendiente (dia) VALUES (dia_pedido) ON CONFLICT DO NOTHING;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION marcar_ventas_diarias_por_id_pedido() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO ventas_diarias_pendiente (dia)
+        SELECT f.dia
+        FROM pedidos p
+        CROSS JOIN LATERAL (SELECT CAST(fecha_hora_segura(CAST(p.fecha_pedido AS TEXT)) AS DATE) AS dia) f
+        WHERE p.id_pedido = OLD.id_pedido AND f.dia IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO ventas_diarias_pendiente (dia)
+        SELECT f.dia
+        FROM pedidos p
+        CROSS JOIN LATERAL (SELECT CAST(fecha_hora_segura(CAST(p.fecha_pedido AS TEXT)) AS DATE) AS dia) f
+        WHERE p.id_pedido = NEW.id_pedido AND f.dia IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ventas_diarias_pedidos ON pedidos;
+CREATE TRIGGER trg_ventas_diarias_pedidos
+    AFTER INSERT OR DELETE OR UPDATE OF id_pedido, fecha_pedido ON pedidos
+    FOR EACH ROW EXECUTE FUNCTION marcar_ventas_diarias_pedido();
+
+DROP TRIGGER IF EXISTS trg_ventas_diarias_detalle ON detalle_pedido;
+CREATE TRIGGER trg_ventas_diarias_detalle
+    AFTER INSERT OR DELETE OR UPDATE OF id_pedido, id_producto, cantidad, subtotal ON detalle_pedido
+    FOR EACH ROW EXECUTE FUNCTION marcar_ventas_diarias_por_id_pedido();
+
+DROP TRIGGER IF EXISTS trg_ventas_diarias_pagos ON pagos;
+CREATE TRIGGER trg_ventas_diarias_pagos
+    AFTER INSERT OR DELETE OR UPDATE OF id_pedido, monto, metodo_pago ON pagos
+    FOR EACH ROW EXECUTE FUNCTION marcar_ventas_diarias_por_id_pedido();
+"""
+
+
 def ensure_tables():
     """Crea y ajusta las tablas base de la aplicacion en PostgreSQL."""
     ddl = """
@@ -171,8 +259,73 @@ def ensure_tables():
         created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
         updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
     );
+    CREATE TABLE IF NOT EXISTS catalogo_version (
+        id SMALLINT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO catalogo_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+    ALTER TABLE catalogo_version ADD COLUMN IF NOT EXISTS version_stock BIGINT NOT NULL DEFAULT 0;
+    CREATE TABLE IF NOT EXISTS registro_pendiente (
+        email TEXT PRIMARY KEY,
+        codigo TEXT NOT NULL,
+        nombre TEXT NOT NULL DEFAULT '',
+        password TEXT NOT NULL DEFAULT '',
+        expira_en TIMESTAMPTZ NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_registro_pendiente_expira_en ON registro_pendiente (expira_en);
+    CREATE TABLE IF NOT EXISTS correo_saliente (
+        id_correo BIGSERIAL PRIMARY KEY,
+        destinatarios TEXT NOT NULL,
+        remitente TEXT,
+        asunto TEXT NOT NULL DEFAULT '',
+        html TEXT,
+        cuerpo TEXT,
+        adjuntos_json TEXT NOT NULL DEFAULT '[]',
+        estado TEXT NOT NULL DEFAULT 'pendiente',
+        intentos INT NOT NULL DEFAULT 0,
+        proximo_intento TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        bloqueado_hasta TIMESTAMPTZ,
+        ultimo_error TEXT,
+        creado_en TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        enviado_en TIMESTAMPTZ
+    );
+    CREATE INDEX IF NOT EXISTS idx_correo_saliente_pendientes
+        ON correo_saliente (proximo_intento)
+        WHERE estado IN ('pendiente', 'enviando');
+    CREATE INDEX IF NOT EXISTS idx_detalle_pedido_id_pedido ON detalle_pedido (id_pedido, id_detalle);
+    CREATE INDEX IF NOT EXISTS idx_pagos_id_pedido ON pagos (id_pedido, id_pago DESC);
+    CREATE INDEX IF NOT EXISTS idx_registros_id_registro ON registros (id_registro);
+    DROP INDEX IF EXISTS idx_registros_fecha_accion;
+    CREATE INDEX IF NOT EXISTS idx_registros_fecha_accion_ts ON registros ((fecha_hora_segura(CAST(fecha_accion AS TEXT))));
+    DROP INDEX IF EXISTS idx_pedidos_fecha_pedido;
+    CREATE INDEX IF NOT EXISTS idx_pedidos_fecha_pedido_ts ON pedidos ((fecha_hora_segura(CAST(fecha_pedido AS TEXT))));
+    CREATE INDEX IF NOT EXISTS idx_pedidos_id_usuario ON pedidos (id_usuario, id_pedido);
+    CREATE INDEX IF NOT EXISTS idx_usuarios_email_normalizado ON usuarios ((lower(btrim(email))));
+    CREATE INDEX IF NOT EXISTS idx_pedidos_estado_normalizado
+        ON pedidos ((COALESCE(NULLIF(lower(btrim(estado)), ''), 'confirmado')), id_pedido DESC);
+    CREATE TABLE IF NOT EXISTS ventas_diarias (
+        dia DATE NOT NULL,
+        nivel TEXT NOT NULL,
+        id_producto BIGINT,
+        metodo_pago TEXT,
+        pedidos BIGINT NOT NULL DEFAULT 0,
+        unidades BIGINT NOT NULL DEFAULT 0,
+        subtotal NUMERIC(14,2) NOT NULL DEFAULT 0,
+        monto NUMERIC(14,2) NOT NULL DEFAULT 0,
+        pagos BIGINT NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_ventas_diarias_dia ON ventas_diarias (dia, nivel);
+    CREATE TABLE IF NOT EXISTS ventas_diarias_pendiente (
+        dia DATE PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS ventas_diarias_version (
+        id SMALLINT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO ventas_diarias_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
     """
     with engine.begin() as conn:
+        conn.execute(sa.text(FECHA_HORA_SEGURA_DDL))
         conn.execute(sa.text(ddl))
         conn.execute(sa.text("ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS reset_token TEXT"))
         conn.execute(sa.text("ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS reset_token_expiry TIMESTAMPTZ"))
@@ -191,6 +344,39 @@ def ensure_tables():
         conn.execute(sa.text("ALTER TABLE pagos ADD COLUMN IF NOT EXISTS comprobante_url TEXT"))
         conn.execute(sa.text("ALTER TABLE promociones ADD COLUMN IF NOT EXISTS id_producto BIGINT"))
         conn.execute(sa.text("ALTER TABLE stripe_checkout ADD COLUMN IF NOT EXISTS carrito_json TEXT NOT NULL DEFAULT '[]'"))
+        _asegurar_secuencias_ids(conn)
+        conn.execute(sa.text(VENTAS_DIARIAS_TRIGGERS_DDL))
+        # Primera ejecucion con historial previo: todos los dias quedan pendientes de agregar.
+        conn.execute(sa.text("""
+            INSERT INTO ventas_diarias_pendiente (dia)
+            SELECT DISTINCT f.dia
+            FROM pedidos p
+            CROSS JOIN LATERAL (SELECT CAST(fecha_hora_segura(CAST(p.fecha_pedido AS TEXT)) AS DATE) AS dia) f
+            WHERE f.dia IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM ventas_diarias)
+            ON CONFLICT DO NOTHING
+        """))
+        _crear_indices_busqueda_registros(conn)
+
+
+def _crear_indices_busqueda_registros(conn):
+    """
+    Indices trigram para la busqueda por texto de /admin/registros (ILIKE '%...%').
+    pg_trgm puede no estar disponible o requerir permisos: en ese caso la busqueda
+    sigue funcionando, solo que sin indice.
+    """
+    try:
+        with conn.begin_nested():
+            conn.execute(sa.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(sa.text(
+                "CREATE INDEX IF NOT EXISTS idx_registros_accion_trgm ON registros USING gin (accion gin_trgm_ops)"
+            ))
+            conn.execute(sa.text(
+                "CREATE INDEX IF NOT EXISTS idx_registros_usuario_trgm "
+                "ON registros USING gin ((CAST(id_usuario AS TEXT)) gin_trgm_ops)"
+            ))
+    except sa.exc.DBAPIError:
+        pass
 
 
 def read_table_df(table_name):
@@ -212,27 +398,353 @@ def replace_table_df(table_name, df):
             data.to_sql(table, con=conn, if_exists="append", index=False, method="multi")
 
 
-def next_id(table_name, id_column):
+TABLE_PRIMARY_KEYS = {
+    "usuarios": "id_usuario",
+    "registros": "id_registro",
+    "categoria_producto": "id_categoria",
+    "producto": "id_producto",
+    "pedidos": "id_pedido",
+    "detalle_pedido": "id_detalle",
+    "promociones": "id_promo",
+    "pagos": "id_pago",
+    "carrito_usuario": "email",
+    "stripe_checkout": "session_id",
+}
+
+_COLUMN_KINDS_CACHE = {}
+
+
+def _column_kinds(conn, table):
+    """Devuelve {columna: tipo_logico} para la tabla, consultando information_schema una sola vez."""
+    kinds = _COLUMN_KINDS_CACHE.get(table)
+    if kinds:
+        return kinds
+
+    rows = conn.execute(
+        sa.text("""
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = :table
+        """),
+        {"table": table},
+    ).all()
+    kinds = {}
+    for column_name, data_type in rows:
+        tipo = str(data_type or "").lower()
+        if tipo in {"bigint", "integer", "smallint"}:
+            kinds[column_name] = "int"
+        elif tipo in {"numeric", "double precision", "real"}:
+            kinds[column_name] = "float"
+        elif tipo == "boolean":
+            kinds[column_name] = "bool"
+        elif tipo == "date":
+            kinds[column_name] = "date"
+        elif tipo.startswith("timestamp"):
+            kinds[column_name] = "datetime"
+        else:
+            kinds[column_name] = "text"
+    if kinds:
+        _COLUMN_KINDS_CACHE[table] = kinds
+    return kinds
+
+
+def _es_nulo(valor):
+    if valor is None:
+        return True
+    try:
+        return bool(pd.isna(valor))
+    except (TypeError, ValueError):
+        return False
+
+
+def _valor_sql(valor, kind):
+    """Convierte un valor de DataFrame al tipo Python que espera la columna SQL."""
+    if _es_nulo(valor):
+        return None
+    if kind == "text":
+        if isinstance(valor, datetime):
+            return valor.strftime("%Y-%m-%d %H:%M:%S")
+        return str(valor)
+    if isinstance(valor, str) and not valor.strip():
+        return None
+    if kind in {"int", "float"}:
+        numero = pd.to_numeric(valor, errors="coerce")
+        if _es_nulo(numero):
+            return None
+        return int(numero) if kind == "int" else float(numero)
+    if kind == "bool":
+        if isinstance(valor, str):
+            return valor.strip().lower() in {"true", "t", "1", "yes", "si", "y"}
+        return bool(valor)
+    fecha = pd.to_datetime(valor, errors="coerce")
+    if _es_nulo(fecha):
+        return None
+    return fecha.date() if kind == "date" else fecha.to_pydatetime()
+
+
+def _valor_comparable(valor, kind):
+    """Clave de comparacion estable entre el valor leido de SQL y el del DataFrame."""
+    if kind == "text":
+        return "" if valor is None else valor
+    if kind == "float" and valor is not None:
+        return round(valor, 6)
+    if kind == "datetime" and valor is not None:
+        # Se compara la hora de pared: PostgreSQL interpreta los valores sin zona en la zona de la sesion.
+        return valor.replace(tzinfo=None)
+    return valor
+
+
+def _filas_por_pk(registros, columns, kinds, pk, table):
+    filas = {}
+    filas_sin_pk = []
+    for registro in registros:
+        fila = {column: _valor_sql(registro.get(column), kinds.get(column, "text")) for column in columns}
+        if fila.get(pk) is None:
+            filas_sin_pk.append(fila)
+        elif fila[pk] in filas:
+            raise ValueError(f"{table}.{pk} tiene el valor repetido {fila[pk]!r}; no se puede sincronizar")
+        else:
+            filas[fila[pk]] = fila
+    return filas, filas_sin_pk
+
+
+def _insert_statement(table, columns):
+    columnas_sql = ", ".join(f'"{column}"' for column in columns)
+    valores_sql = ", ".join(f":{column}" for column in columns)
+    return sa.text(f'INSERT INTO "{table}" ({columnas_sql}) VALUES ({valores_sql})')
+
+
+def sync_table_df(table_name, df, pk_column=None, cambios=None):
+    """
+    Sincroniza una tabla con el DataFrame emitiendo solo INSERT/UPDATE/DELETE
+    para las llaves primarias que cambiaron.
+
+    Si se entrega `cambios` ({'existentes': llaves cargadas, 'cambiadas': {llave: columnas}},
+    calculado desde la huella de la carga) el diff se toma de ahi; si no, se compara contra
+    las filas actuales de la tabla dentro de la misma transaccion. Los UPDATE solo asignan
+    las columnas que cambiaron, de modo que una escritura concurrente sobre otra columna de
+    la misma fila no se pisa. Una llave repetida en `df` es un error (ValueError).
+    Devuelve el conteo de filas insertadas, actualizadas y eliminadas.
+    """
+    table = _safe_identifier(table_name)
+    pk = _safe_identifier(pk_column or TABLE_PRIMARY_KEYS.get(table, ""))
+    data = df if df is not None else pd.DataFrame()
+    columns = [_safe_identifier(column) for column in data.columns]
+    if pk not in columns:
+        raise ValueError(f"El DataFrame de {table} no incluye la llave primaria {pk!r}")
+
+    resumen = {"insertados": 0, "actualizados": 0, "eliminados": 0}
+    with engine.begin() as conn:
+        kinds = _column_kinds(conn, table)
+        nuevas, nuevas_sin_pk = _filas_por_pk(data.to_dict(orient="records"), columns, kinds, pk, table)
+        actualizados = {}
+
+        def _agregar_actualizacion(fila, cambiadas):
+            if cambiadas:
+                actualizados.setdefault(cambiadas, []).append(
+                    {column: fila[column] for column in (pk,) + cambiadas}
+                )
+
+        if cambios is not None:
+            kind_pk = kinds.get(pk, "text")
+            actuales = {_valor_sql(llave, kind_pk) for llave in cambios["existentes"]}
+            for llave, columnas_cambiadas in cambios["cambiadas"].items():
+                fila = nuevas.get(_valor_sql(llave, kind_pk))
+                if fila is not None:
+                    _agregar_actualizacion(
+                        fila, tuple(column for column in columns if column != pk and column in columnas_cambiadas)
+                    )
+        else:
+            columnas_sql = ", ".join(f'"{column}"' for column in columns)
+            registros = conn.execute(sa.text(f'SELECT {columnas_sql} FROM "{table}"')).mappings()
+            actuales, _ = _filas_por_pk(registros, columns, kinds, pk, table)
+            for llave, fila in nuevas.items():
+                if llave in actuales:
+                    anterior = actuales[llave]
+                    _agregar_actualizacion(fila, tuple(
+                        column for column in columns
+                        if column != pk
+                        and _valor_comparable(fila[column], kinds.get(column, "text"))
+                        != _valor_comparable(anterior[column], kinds.get(column, "text"))
+                    ))
+
+        eliminados = [llave for llave in actuales if llave not in nuevas]
+        insertados = [fila for llave, fila in nuevas.items() if llave not in actuales] + nuevas_sin_pk
+
+        if eliminados:
+            conn.execute(
+                sa.text(f'DELETE FROM "{table}" WHERE "{pk}" IN :ids').bindparams(
+                    sa.bindparam("ids", expanding=True)
+                ),
+                {"ids": eliminados},
+            )
+        for cambiadas, filas in actualizados.items():
+            asignaciones = ", ".join(f'"{column}" = :{column}' for column in cambiadas)
+            conn.execute(
+                sa.text(f'UPDATE "{table}" SET {asignaciones} WHERE "{pk}" = :{pk}'),
+                filas,
+            )
+        con_pk = [fila for fila in insertados if fila.get(pk) is not None]
+        if con_pk:
+            conn.execute(_insert_statement(table, columns), con_pk)
+            if kinds.get(pk) == "int":
+                _avanzar_secuencia(conn, table, pk, max(fila[pk] for fila in con_pk))
+        if nuevas_sin_pk:
+            columnas_insert = [column for column in columns if column != pk]
+            conn.execute(
+                _insert_statement(table, columnas_insert),
+                [{column: fila[column] for column in columnas_insert} for fila in nuevas_sin_pk],
+            )
+
+    resumen["insertados"] = len(insertados)
+    resumen["actualizados"] = sum(len(filas) for filas in actualizados.values())
+    resumen["eliminados"] = len(eliminados)
+    return resumen
+
+
+def append_rows(table_name, rows, conn=None):
+    """
+    Inserta filas (dicts) sin leer la tabla: cada valor se convierte al tipo de su columna
+    y las columnas omitidas (por ejemplo el id BIGSERIAL) toman su DEFAULT.
+    Todas las filas deben traer las mismas llaves. Devuelve la cantidad insertada.
+    """
+    table = _safe_identifier(table_name)
+    filas = list(rows or [])
+    if not filas:
+        return 0
+
+    def _insertar(conexion):
+        kinds = _column_kinds(conexion, table)
+        columns = [_safe_identifier(column) for column in filas[0]]
+        conexion.execute(
+            _insert_statement(table, columns),
+            [{column: _valor_sql(fila.get(column), kinds.get(column, "text")) for column in columns} for fila in filas],
+        )
+
+    if conn is not None:
+        _insertar(conn)
+    else:
+        with engine.begin() as conn_propia:
+            _insertar(conn_propia)
+    return len(filas)
+
+
+SERIAL_SEQUENCE_SQL = "pg_get_serial_sequence(:table, :column)"
+
+
+def sync_id_sequences():
+    """
+    Alinea cada secuencia BIGSERIAL con el MAX() actual de su tabla.
+    Las filas historicas se insertaron con ids explicitos y no avanzaron la secuencia.
+    """
+    with engine.begin() as conn:
+        for table, column in TABLE_PRIMARY_KEYS.items():
+            max_id = conn.execute(sa.text(f'SELECT MAX("{column}") FROM "{table}"')).scalar()
+            if isinstance(max_id, int) and max_id > 0:
+                _avanzar_secuencia(conn, table, column, max_id)
+
+
+def _asegurar_secuencias_ids(conn):
+    """
+    Las tablas restauradas desde el respaldo tienen ids BIGINT sin DEFAULT ni secuencia,
+    asi que nextval(pg_get_serial_sequence(...)) devolveria NULL. Crea la secuencia que
+    falte, la deja como DEFAULT de la columna y la asocia con OWNED BY para que
+    pg_get_serial_sequence la encuentre; luego la adelanta al MAX() actual.
+    """
+    for table, column in TABLE_PRIMARY_KEYS.items():
+        info = conn.execute(
+            sa.text("""
+                SELECT data_type, column_default
+                FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column
+            """),
+            {"table": table, "column": column},
+        ).first()
+        if info is None or str(info[0] or "").lower() not in {"bigint", "integer", "smallint"}:
+            continue
+
+        seq = conn.execute(
+            sa.text(f"SELECT {SERIAL_SEQUENCE_SQL}"),
+            {"table": table, "column": column},
+        ).scalar()
+        if seq is None:
+            seq = _safe_identifier(f"{table}_{column}_seq")
+            conn.execute(sa.text(f'CREATE SEQUENCE IF NOT EXISTS "{seq}"'))
+            conn.execute(sa.text(f'ALTER SEQUENCE "{seq}" OWNED BY "{table}"."{column}"'))
+        if info[1] is None:
+            seq_literal = str(seq).replace("'", "''")
+            conn.execute(sa.text(
+                f"""ALTER TABLE "{table}" ALTER COLUMN "{column}" SET DEFAULT nextval('{seq_literal}'::regclass)"""
+            ))
+
+        max_id = conn.execute(sa.text(f'SELECT MAX("{column}") FROM "{table}"')).scalar()
+        if max_id is not None and int(max_id) > 0:
+            _avanzar_secuencia(conn, table, column, max_id)
+
+
+def _avanzar_secuencia(conn, table, column, max_id):
+    """Evita que nextval() reparta ids ya usados por inserts con id explicito."""
+    conn.execute(
+        sa.text(f"""
+            SELECT setval(
+                CAST(seq AS regclass),
+                GREATEST(:max_id, COALESCE(pg_sequence_last_value(CAST(seq AS regclass)), 0))
+            )
+            FROM (SELECT {SERIAL_SEQUENCE_SQL} AS seq) s
+            WHERE seq IS NOT NULL
+        """),
+        {"table": table, "column": column, "max_id": int(max_id)},
+    )
+
+
+def reserve_ids(table_name, id_column, count=1, conn=None):
+    """
+    Reserva `count` ids de la secuencia BIGSERIAL de la tabla en un solo viaje (orden ascendente).
+    nextval() no bloquea ni colisiona entre workers; un id reservado y no usado queda como hueco.
+    Si se entrega `conn` se usa esa conexion (por ejemplo, dentro de una transaccion abierta).
+    """
     table = _safe_identifier(table_name)
     column = _safe_identifier(id_column)
-    with engine.connect() as conn:
-        query = sa.text(f'SELECT COALESCE(MAX("{column}"), 0) + 1 FROM "{table}"')
-        return int(conn.execute(query).scalar_one())
+    cantidad = max(1, int(count))
+    query = sa.text(f"""
+        SELECT nextval({SERIAL_SEQUENCE_SQL})
+        FROM generate_series(1, :cantidad)
+    """)
+    params = {"table": table, "column": column, "cantidad": cantidad}
+    if conn is not None:
+        ids = conn.execute(query, params).scalars().all()
+    else:
+        with engine.begin() as conn_propia:
+            ids = conn_propia.execute(query, params).scalars().all()
+    if any(valor is None for valor in ids):
+        raise ValueError(f"La columna {table}.{column} no tiene una secuencia asociada; no se pueden reservar ids")
+    return sorted(int(valor) for valor in ids)
+
+
+def next_id(table_name, id_column):
+    return reserve_ids(table_name, id_column, 1)[0]
 
 
 def init_db():
     ensure_tables()
+    sync_id_sequences()
     return engine
 
 
 init_db()
 
 __all__ = [
+    "append_rows",
     "DATABASE_URL",
     "engine",
     "ensure_tables",
+    "fecha_hora_sql",
     "init_db",
     "next_id",
     "read_table_df",
     "replace_table_df",
+    "reserve_ids",
+    "sync_id_sequences",
+    "sync_table_df",
+    "TABLE_PRIMARY_KEYS",
 ]
@@ -1,10 +1,13 @@
 from core.db_utils import engine
 from services.email_service import mail
+from services.mail_queue_service import iniciar_envio_correos
 
 
 def init_extensions(app):
     """Inicializa extensiones Flask en la app modular."""
     mail.init_app(app)
+    if app.config.get("MAIL_OUTBOX_ENABLED", True) and not app.config.get("TESTING", False):
+        iniciar_envio_correos(app)
     return app
 
 
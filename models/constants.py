@@ -130,3 +130,38 @@ MAX_IMAGES_PER_PRODUCT = 5
 REGISTER_CODE_EXP_MINUTES = 7
 PASSWORD_RESET_EXP_MINUTES = 30
 PASSWORD_CHANGE_CODE_EXP_MINUTES = 7
+
+# Textos fijos del recibo POS. Los usan la plantilla recibo_pos_pdf.html (via el contexto,
+# clave `textos`) y el motor PDF nativo (services/pdf_recibo_service), asi que un cambio
+# aqui llega a los dos.
+RECIBO_POS_TEXTOS = {
+    'titulo': 'RECIBO DE VENTA',
+    'marca': 'NACHOHERS',
+    'lema': 'Diseno - Calidad - Precision',
+    'recibo': 'Recibo',
+    'fecha': 'Fecha',
+    'hora': 'Hora',
+    'pagina': 'Pág.',
+    'datos_generales': 'DATOS GENERALES',
+    'empresa_ubicacion': 'Ubicacion: Urbanizacion Pablo Sexto Manzana A Casa 6',
+    'empresa_ciudad': 'Ciudad: Ibague, Tolima',
+    'empresa_telefono': 'Telefono: +57 3229393211',
+    'empresa_correo': 'Correo: contacto@nachoher.com',
+    'cliente': 'INFORMACION DEL CLIENTE',
+    'detalle': 'DETALLE DE LA COMPRA',
+    'columnas': {
+        'cantidad': 'CANTIDAD',
+        'talla': 'TALLA',
+        'descripcion': 'DESCRIPCION',
+        'valor_unitario': 'VALOR UNITARIO',
+        'total': 'TOTAL',
+    },
+    'sin_productos': 'Sin productos',
+    'resumen': 'RESUMEN DE PAGO',
+    'cantidad_items': 'Cantidad de items',
+    'metodo_pago': 'Metodo de pago',
+    'subtotal': 'Subtotal',
+    'descuento': 'Descuento',
+    'total_pagar': 'Total a pagar',
+    'observaciones': 'OBSERVACIONES',
+}
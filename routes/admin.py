@@ -1,16 +1,17 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from io import BytesIO
+import itertools
 import json
 import os
 import re
 
 import pandas as pd
-from flask import Blueprint, Response, flash, redirect, render_template, request, send_file, session, url_for
-from openpyxl.chart import BarChart, LineChart, PieChart, Reference
-from openpyxl.chart.series import DataPoint
+from flask import Blueprint, Response, flash, jsonify, redirect, render_template, request, send_file, session, url_for
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
+REGISTROS_POR_PAGINA = 50
+
 
 def register_admin_legacy_routes(app, legacy):
     """Registro incremental de rutas legacy del area administrativa."""
@@ -71,7 +72,7 @@ def register_admin_legacy_routes(app, legacy):
                 flash("El descuento fijo debe ser inferior al precio establecido de la prenda.", "warning")
                 return redirect(url_for("admin_promo"))
 
-            promos = legacy.cargar_promociones_df()
+            promos = legacy.cargar_promociones_df(fresco=True)
             if codigo:
                 if not re.fullmatch(r"[A-Z0-9_-]{3,30}", codigo):
                     flash("El código promocional debe tener entre 3 y 30 caracteres: letras, números, guion o guion bajo.", "warning")
@@ -80,11 +81,11 @@ def register_admin_legacy_routes(app, legacy):
                 if not existe_codigo.empty:
                     flash("El código promocional ya existe. Usa otro.", "warning")
                     return redirect(url_for("admin_promo"))
-            next_id = int(pd.to_numeric(promos["id_promo"], errors="coerce").max() + 1) if not promos.empty else 1
+            nuevo_id_promo = legacy.next_id("promociones", "id_promo")
             if not nombre:
                 nombre = f"Promoción {producto_ref.get('nombre', 'producto')}"
             nuevo = {
-                "id_promo": next_id,
+                "id_promo": nuevo_id_promo,
                 "nombre": nombre,
                 "descripcion": descripcion,
                 "tipo_descuento": tipo_descuento,
@@ -95,7 +96,7 @@ def register_admin_legacy_routes(app, legacy):
                 "fecha_fin": fecha_fin,
                 "activo": activo,
             }
-            promos = pd.concat([promos, pd.DataFrame([nuevo])], ignore_index=True)
+            promos = legacy.anexar_filas_df(promos, [nuevo])
             legacy.guardar_promociones_df(promos)
             detalle_desc = (
                 legacy.formatear_cop(valor_descuento) if tipo_descuento == "valor_fijo" else f"{valor_descuento:.2f}%"
@@ -172,7 +173,7 @@ def register_admin_legacy_routes(app, legacy):
     def admin_promo_toggle(id_promo):
         if session.get("rol") != "admin":
             return "Acceso denegado"
-        promos = legacy.cargar_promociones_df()
+        promos = legacy.cargar_promociones_df(fresco=True)
         idx = promos[promos["id_promo"] == id_promo].index
         if not idx.empty:
             promo_actual = promos.loc[idx[0]].to_dict()
@@ -186,194 +187,6 @@ def register_admin_legacy_routes(app, legacy):
             )
         return redirect(url_for("admin_promo"))
 
-    def obtener_datos_charts(periodo, fecha_desde_raw, fecha_hasta_raw):
-        detalle = legacy.cargar_detalle_pedido_df()
-        productos = legacy.cargar_productos_df()
-        pedidos = legacy.cargar_pedidos_df()
-        pagos = legacy.cargar_pagos_df()
-
-        if "id_producto" not in detalle.columns:
-            detalle["id_producto"] = pd.Series(dtype="int")
-        if "cantidad" not in detalle.columns:
-            detalle["cantidad"] = 0
-        if "subtotal" not in detalle.columns:
-            detalle["subtotal"] = 0
-        if "id_pedido" not in detalle.columns:
-            detalle["id_pedido"] = pd.Series(dtype="int")
-
-        detalle["cantidad"] = pd.to_numeric(detalle["cantidad"], errors="coerce").fillna(0)
-        detalle["subtotal"] = pd.to_numeric(detalle["subtotal"], errors="coerce").fillna(0)
-
-        if "id_producto" not in productos.columns:
-            productos["id_producto"] = pd.Series(dtype="int")
-        if "nombre" not in productos.columns:
-            productos["nombre"] = ""
-        if "precio" not in productos.columns:
-            productos["precio"] = 0
-        productos["precio"] = pd.to_numeric(productos["precio"], errors="coerce").fillna(0)
-
-        if "id_pedido" not in pedidos.columns:
-            pedidos["id_pedido"] = pd.Series(dtype="int")
-        if "fecha_pedido" not in pedidos.columns:
-            pedidos["fecha_pedido"] = ""
-        pedidos["fecha_pedido"] = pd.to_datetime(pedidos["fecha_pedido"], errors="coerce")
-
-        if "monto" not in pagos.columns:
-            pagos["monto"] = 0
-        if "metodo_pago" not in pagos.columns:
-            pagos["metodo_pago"] = ""
-        pagos["monto"] = pd.to_numeric(pagos["monto"], errors="coerce").fillna(0)
-        pagos["metodo_pago"] = pagos["metodo_pago"].fillna("").astype(str)
-
-        def filtrar_pedidos_por_rango(df_pedidos, desde=None, hasta=None):
-            filtrado = df_pedidos.copy().dropna(subset=["fecha_pedido"])
-            if desde is not None:
-                filtrado = filtrado[filtrado["fecha_pedido"].dt.date >= desde]
-            if hasta is not None:
-                filtrado = filtrado[filtrado["fecha_pedido"].dt.date <= hasta]
-            return filtrado
-
-        def calcular_kpis_desde_pedidos(pedidos_base):
-            ids = pedidos_base["id_pedido"].tolist()
-            detalle_base = detalle[detalle["id_pedido"].isin(ids)].copy()
-            pagos_base = pagos[pagos["id_pedido"].isin(ids)].copy()
-            total_ventas_base = float(pagos_base["monto"].sum()) if not pagos_base.empty else float(detalle_base["subtotal"].sum())
-            total_pedidos_base = int(len(pedidos_base))
-            total_items_base = int(detalle_base["cantidad"].sum()) if not detalle_base.empty else 0
-            ticket_promedio_base = (total_ventas_base / total_pedidos_base) if total_pedidos_base > 0 else 0
-            return {
-                "total_ventas": total_ventas_base,
-                "total_pedidos": total_pedidos_base,
-                "ticket_promedio": ticket_promedio_base,
-                "total_items": total_items_base,
-            }
-
-        def variacion_kpi(valor_actual, valor_anterior):
-            if valor_anterior == 0:
-                if valor_actual == 0:
-                    return {"trend": "flat", "texto": "0.0% vs periodo anterior"}
-                return {"trend": "up", "texto": "Nuevo vs periodo anterior"}
-
-            delta_pct = ((valor_actual - valor_anterior) / abs(valor_anterior)) * 100
-            trend = "up" if delta_pct > 0 else "down" if delta_pct < 0 else "flat"
-            return {"trend": trend, "texto": f"{delta_pct:+.1f}% vs periodo anterior"}
-
-        hoy = datetime.now().date()
-        fecha_desde = None
-        fecha_hasta = None
-
-        if periodo == "today":
-            fecha_desde = hoy
-            fecha_hasta = hoy
-        elif periodo == "week":
-            fecha_desde = hoy - timedelta(days=6)
-            fecha_hasta = hoy
-        elif periodo == "month":
-            fecha_desde = hoy.replace(day=1)
-            fecha_hasta = hoy
-        elif periodo == "range":
-            if fecha_desde_raw:
-                try:
-                    fecha_desde = datetime.strptime(fecha_desde_raw, "%Y-%m-%d").date()
-                except ValueError:
-                    fecha_desde = None
-            if fecha_hasta_raw:
-                try:
-                    fecha_hasta = datetime.strptime(fecha_hasta_raw, "%Y-%m-%d").date()
-                except ValueError:
-                    fecha_hasta = None
-            if fecha_desde is not None and fecha_hasta is not None and fecha_desde > fecha_hasta:
-                fecha_desde, fecha_hasta = fecha_hasta, fecha_desde
-
-        pedidos_filtrados = filtrar_pedidos_por_rango(pedidos, fecha_desde, fecha_hasta)
-        ids_pedidos = pedidos_filtrados["id_pedido"].tolist()
-        detalle_filtrado = detalle[detalle["id_pedido"].isin(ids_pedidos)].copy()
-        pagos_filtrados = pagos[pagos["id_pedido"].isin(ids_pedidos)].copy()
-
-        ventas_por_producto_df = detalle_filtrado.groupby("id_producto", as_index=False)["cantidad"].sum()
-        ventas_por_producto_df = pd.merge(
-            ventas_por_producto_df,
-            productos[["id_producto", "nombre", "precio"]],
-            on="id_producto",
-            how="left",
-        )
-        ventas_por_producto_df["nombre"] = ventas_por_producto_df["nombre"].fillna("Producto sin nombre")
-        ventas_por_producto_df["precio"] = pd.to_numeric(ventas_por_producto_df["precio"], errors="coerce").fillna(0)
-
-        pedidos_fechas = pedidos_filtrados.copy()
-        pedidos_fechas["mes"] = pedidos_fechas["fecha_pedido"].dt.to_period("M").astype(str)
-
-        ventas_por_mes_df = detalle_filtrado.groupby("id_pedido", as_index=False)["subtotal"].sum()
-        ventas_por_mes_df = pd.merge(ventas_por_mes_df, pedidos_fechas[["id_pedido", "mes"]], on="id_pedido", how="left")
-        ventas_por_mes_df = ventas_por_mes_df.dropna(subset=["mes"])
-        ventas_por_mes_df = ventas_por_mes_df.groupby("mes", as_index=False)["subtotal"].sum().sort_values("mes")
-
-        metodos_pago_df = pagos_filtrados.groupby("metodo_pago", as_index=False)["monto"].sum()
-        metodos_pago_df = metodos_pago_df[metodos_pago_df["metodo_pago"].str.strip() != ""]
-
-        kpis = calcular_kpis_desde_pedidos(pedidos_filtrados)
-
-        top_productos_df = ventas_por_producto_df.sort_values("cantidad", ascending=False).head(5).copy()
-        if "precio" not in top_productos_df.columns:
-            top_productos_df = pd.merge(
-                top_productos_df,
-                productos[["id_producto", "precio"]],
-                on="id_producto",
-                how="left",
-            )
-        top_productos_df["precio"] = pd.to_numeric(top_productos_df.get("precio", 0), errors="coerce").fillna(0)
-
-        kpis_anterior = {"total_ventas": 0, "total_pedidos": 0, "ticket_promedio": 0, "total_items": 0}
-        comparacion_texto = "Sin comparacion de periodo"
-        if fecha_desde is not None and fecha_hasta is not None:
-            dias_periodo = max(1, (fecha_hasta - fecha_desde).days + 1)
-            anterior_hasta = fecha_desde - timedelta(days=1)
-            anterior_desde = anterior_hasta - timedelta(days=dias_periodo - 1)
-            pedidos_anterior = filtrar_pedidos_por_rango(pedidos, anterior_desde, anterior_hasta)
-            kpis_anterior = calcular_kpis_desde_pedidos(pedidos_anterior)
-            comparacion_texto = (
-                f"Comparando contra {anterior_desde.strftime('%Y-%m-%d')} a " f"{anterior_hasta.strftime('%Y-%m-%d')}"
-            )
-        elif periodo == "all":
-            comparacion_texto = "Selecciona un periodo para activar comparacion"
-
-        kpi_variaciones = {
-            "total_ventas": variacion_kpi(kpis["total_ventas"], kpis_anterior["total_ventas"]),
-            "total_pedidos": variacion_kpi(kpis["total_pedidos"], kpis_anterior["total_pedidos"]),
-            "ticket_promedio": variacion_kpi(kpis["ticket_promedio"], kpis_anterior["ticket_promedio"]),
-            "total_items": variacion_kpi(kpis["total_items"], kpis_anterior["total_items"]),
-        }
-
-        rango_texto = "Todo el historial"
-        if fecha_desde is not None and fecha_hasta is not None:
-            rango_texto = f"{fecha_desde.strftime('%Y-%m-%d')} a {fecha_hasta.strftime('%Y-%m-%d')}"
-        elif fecha_desde is not None:
-            rango_texto = f"Desde {fecha_desde.strftime('%Y-%m-%d')}"
-        elif fecha_hasta is not None:
-            rango_texto = f"Hasta {fecha_hasta.strftime('%Y-%m-%d')}"
-
-        filtros = {
-            "periodo": periodo if periodo in {"all", "today", "week", "month", "range"} else "all",
-            "fecha_desde": fecha_desde_raw,
-            "fecha_hasta": fecha_hasta_raw,
-        }
-
-        return {
-            "ventas_producto": ventas_por_producto_df.to_dict(orient="records"),
-            "ventas_mes": ventas_por_mes_df.to_dict(orient="records"),
-            "metodos_pago": metodos_pago_df.to_dict(orient="records"),
-            "top_productos": top_productos_df.to_dict(orient="records"),
-            "kpis": kpis,
-            "kpi_variaciones": kpi_variaciones,
-            "filtros": filtros,
-            "rango_texto": rango_texto,
-            "comparacion_texto": comparacion_texto,
-            "ventas_producto_df": ventas_por_producto_df,
-            "ventas_mes_df": ventas_por_mes_df,
-            "metodos_pago_df": metodos_pago_df,
-            "top_productos_df": top_productos_df,
-        }
-
     def admin_charts():
         if session.get("rol") != "admin":
             return "Acceso denegado"
@@ -381,7 +194,7 @@ def register_admin_legacy_routes(app, legacy):
         periodo = request.args.get("periodo", "all").strip().lower()
         fecha_desde_raw = request.args.get("fecha_desde", "").strip()
         fecha_hasta_raw = request.args.get("fecha_hasta", "").strip()
-        datos = obtener_datos_charts(periodo, fecha_desde_raw, fecha_hasta_raw)
+        datos = legacy.obtener_datos_charts(periodo, fecha_desde_raw, fecha_hasta_raw)
 
         return render_template(
             "Administrador/Informes/admin_charts_dashboard.html",
@@ -403,120 +216,31 @@ def register_admin_legacy_routes(app, legacy):
         periodo = request.args.get("periodo", "all").strip().lower()
         fecha_desde_raw = request.args.get("fecha_desde", "").strip()
         fecha_hasta_raw = request.args.get("fecha_hasta", "").strip()
-        datos = obtener_datos_charts(periodo, fecha_desde_raw, fecha_hasta_raw)
-
-        resumen_df = pd.DataFrame(
-            [
-                {"metrica": "Ventas totales", "valor": legacy.formatear_cop(datos["kpis"]["total_ventas"])},
-                {"metrica": "Pedidos", "valor": datos["kpis"]["total_pedidos"]},
-                {"metrica": "Ticket promedio", "valor": legacy.formatear_cop(datos["kpis"]["ticket_promedio"])},
-                {"metrica": "Items vendidos", "valor": datos["kpis"]["total_items"]},
-                {"metrica": "Rango aplicado", "valor": datos["rango_texto"]},
-                {"metrica": "Comparacion", "valor": datos["comparacion_texto"]},
-            ]
-        )
+        nombre_archivo = f"graficas_informe_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
 
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-            resumen_df.to_excel(writer, sheet_name="Resumen", index=False)
-            datos["ventas_producto_df"].to_excel(writer, sheet_name="Ventas por producto", index=False)
-            datos["ventas_mes_df"].to_excel(writer, sheet_name="Ventas por mes", index=False)
-            datos["metodos_pago_df"].to_excel(writer, sheet_name="Metodos de pago", index=False)
-            datos["top_productos_df"].to_excel(writer, sheet_name="Top productos", index=False)
-
-            wb = writer.book
-            ws_producto = wb["Ventas por producto"]
-            ws_mes = wb["Ventas por mes"]
-            ws_metodos = wb["Metodos de pago"]
-            ws_top = wb["Top productos"]
-            formato_cop = '[>=1000]#,##0.00 "COP";0.00 "COP"'
-
-            for row in range(2, ws_mes.max_row + 1):
-                ws_mes.cell(row=row, column=2).number_format = formato_cop
-            for row in range(2, ws_metodos.max_row + 1):
-                ws_metodos.cell(row=row, column=2).number_format = formato_cop
-            for row in range(2, ws_top.max_row + 1):
-                ws_top.cell(row=row, column=4).number_format = formato_cop
-
-            if ws_producto.max_row > 1:
-                chart_prod = BarChart()
-                chart_prod.title = "Cantidad vendida por producto"
-                chart_prod.y_axis.title = "Cantidad"
-                chart_prod.x_axis.title = "Producto"
-                data_prod = Reference(ws_producto, min_col=3, min_row=1, max_row=ws_producto.max_row)
-                cats_prod = Reference(ws_producto, min_col=2, min_row=2, max_row=ws_producto.max_row)
-                chart_prod.add_data(data_prod, titles_from_data=True)
-                chart_prod.set_categories(cats_prod)
-                chart_prod.height = 8
-                chart_prod.width = 14
-                if chart_prod.series:
-                    chart_prod.series[0].graphicalProperties.solidFill = "1882A9"
-                ws_producto.add_chart(chart_prod, "E2")
-
-            if ws_mes.max_row > 1:
-                chart_mes = LineChart()
-                chart_mes.title = "Ventas por mes"
-                chart_mes.y_axis.title = "Subtotal"
-                chart_mes.x_axis.title = "Mes"
-                data_mes = Reference(ws_mes, min_col=2, min_row=1, max_row=ws_mes.max_row)
-                cats_mes = Reference(ws_mes, min_col=1, min_row=2, max_row=ws_mes.max_row)
-                chart_mes.add_data(data_mes, titles_from_data=True)
-                chart_mes.set_categories(cats_mes)
-                chart_mes.height = 8
-                chart_mes.width = 14
-                if chart_mes.series:
-                    chart_mes.series[0].graphicalProperties.line.solidFill = "0A2962"
-                ws_mes.add_chart(chart_mes, "D2")
-
-            if ws_metodos.max_row > 1:
-                chart_met = PieChart()
-                chart_met.title = "Distribucion por metodo de pago"
-                data_met = Reference(ws_metodos, min_col=2, min_row=1, max_row=ws_metodos.max_row)
-                cats_met = Reference(ws_metodos, min_col=1, min_row=2, max_row=ws_metodos.max_row)
-                chart_met.add_data(data_met, titles_from_data=True)
-                chart_met.set_categories(cats_met)
-                chart_met.height = 8
-                chart_met.width = 12
-                if chart_met.series:
-                    colores = ["0A2962", "1882A9", "1ABC9C", "F1C40F", "E74C3C", "6C5CE7"]
-                    points = []
-                    num_points = max(0, ws_metodos.max_row - 1)
-                    for i in range(num_points):
-                        point = DataPoint(idx=i)
-                        point.graphicalProperties.solidFill = colores[i % len(colores)]
-                        points.append(point)
-                    chart_met.series[0].dPt = points
-                ws_metodos.add_chart(chart_met, "D2")
-
-            if ws_top.max_row > 1:
-                chart_top = BarChart()
-                chart_top.title = "Top productos vendidos"
-                chart_top.y_axis.title = "Cantidad"
-                chart_top.x_axis.title = "Producto"
-                data_top = Reference(ws_top, min_col=3, min_row=1, max_row=ws_top.max_row)
-                cats_top = Reference(ws_top, min_col=2, min_row=2, max_row=ws_top.max_row)
-                chart_top.add_data(data_top, titles_from_data=True)
-                chart_top.set_categories(cats_top)
-                chart_top.height = 8
-                chart_top.width = 14
-                if chart_top.series:
-                    chart_top.series[0].graphicalProperties.solidFill = "0A2962"
-                ws_top.add_chart(chart_top, "F2")
-        buffer.seek(0)
+        def generar(salida):
+            datos = legacy.obtener_datos_charts(periodo, fecha_desde_raw, fecha_hasta_raw)
+            legacy.escribir_excel_charts(salida, datos, legacy.formatear_cop)
 
-        nombre_archivo = f"graficas_informe_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=nombre_archivo,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        # "today", "week" y "month" dependen del dia actual, que forma parte de la clave; la
+        # version de ventas_diarias invalida el archivo en cuanto cambian los datos.
+        # Se genera en linea (sin solicitar): sale de ventas_diarias ya agregado y su tamano
+        # depende de productos y meses, no del numero de pedidos.
+        params = {
+            "periodo": periodo,
+            "fecha_desde": fecha_desde_raw,
+            "fecha_hasta": fecha_hasta_raw,
+            "hoy": datetime.now().date(),
+            "version_ventas": legacy.marca_datos_charts(),
+        }
+        _, ruta = legacy.trabajos_exportacion.generar("charts", params, nombre_archivo, generar)
+        return send_file(ruta, as_attachment=True, download_name=nombre_archivo, mimetype=legacy.app_export_service.MIMETYPE_XLSX)
 
     def agregar_producto():
         if session.get("rol") != "admin":
             return "Acceso denegado"
 
-        productos = legacy.cargar_productos_df()
+        productos = legacy.cargar_productos_df(fresco=True)
         nuevo_id = legacy.next_id("producto", "id_producto")
         fuerza = request.form.get("fuerza", "").strip()
         intendencia = request.form.get("intendencia", "").strip()
@@ -570,7 +294,7 @@ def register_admin_legacy_routes(app, legacy):
             "eliminado": False,
         }
 
-        productos = pd.concat([productos, pd.DataFrame([nuevo_producto])], ignore_index=True)
+        productos = legacy.anexar_filas_df(productos, [nuevo_producto])
         legacy.guardar_productos_df(productos)
         legacy.registrar_actividad(
             f"Creo producto '{request.form['nombre']}' (ID {nuevo_id})\n"
@@ -586,20 +310,29 @@ def register_admin_legacy_routes(app, legacy):
         if session.get("rol") != "admin":
             return "Acceso denegado"
 
-        pedidos = legacy.cargar_pedidos_df()
-        pagos = legacy.cargar_pagos_df()
-        detalle = legacy.cargar_detalle_pedido_df()
-
-        informe = pd.merge(pedidos, pagos, on="id_pedido", how="left")
-        totales_pedido = detalle.groupby("id_pedido")["subtotal"].sum().reset_index()
-        totales_pedido.columns = ["id_pedido", "total_productos"]
-        informe = pd.merge(informe, totales_pedido, on="id_pedido", how="left")
-        csv_data = informe.to_csv(index=False)
+        fechas = {}
+        for parametro in ("fecha_desde", "fecha_hasta"):
+            valor = request.args.get(parametro, "").strip()
+            if not valor:
+                fechas[parametro] = None
+                continue
+            try:
+                fechas[parametro] = datetime.strptime(valor, "%Y-%m-%d").date()
+            except ValueError:
+                return Response(f"{parametro} debe tener el formato AAAA-MM-DD.", status=400, mimetype="text/plain; charset=utf-8")
 
+        sufijo = "".join(f"_{fecha.strftime('%Y%m%d')}" for fecha in fechas.values() if fecha is not None)
+        # El primer fragmento (encabezado) se pide aqui: si la consulta falla, el error sale
+        # de la vista antes de enviar el 200.
+        fragmentos = legacy.generar_csv_ventas(fechas["fecha_desde"], fechas["fecha_hasta"])
+        encabezado = next(fragmentos)
         return Response(
-            csv_data,
+            itertools.chain([encabezado], fragmentos),
             mimetype="text/csv",
-            headers={"Content-Disposition": f"attachment; filename=ventas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"},
+            headers={
+                "Content-Disposition": f"attachment; filename=ventas{sufijo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                "X-Accel-Buffering": "no",
+            },
         )
 
     def subir_imagen(id_producto):
@@ -632,7 +365,7 @@ def register_admin_legacy_routes(app, legacy):
                     flash(error_validacion, "danger")
                     return redirect(url_for("admin_productos"))
 
-        productos = legacy.cargar_productos_df()
+        productos = legacy.cargar_productos_df(fresco=True)
         idx = productos[productos["id_producto"] == id_producto].index
         if not idx.empty:
             fuerza = str(productos.at[idx[0], "fuerza"]) if "fuerza" in productos.columns else ""
@@ -672,7 +405,7 @@ def register_admin_legacy_routes(app, legacy):
                 flash(error_validacion, "danger")
                 return redirect(url_for("admin_productos"))
 
-        productos = legacy.cargar_productos_df()
+        productos = legacy.cargar_productos_df(fresco=True)
         idx = productos[productos["id_producto"] == id_producto].index
         if idx.empty:
             flash("Producto no encontrado.", "danger")
@@ -713,7 +446,7 @@ def register_admin_legacy_routes(app, legacy):
             flash("Selecciona una imagen para eliminar.", "warning")
             return redirect(url_for("admin_productos"))
 
-        productos = legacy.cargar_productos_df()
+        productos = legacy.cargar_productos_df(fresco=True)
         idx = productos[productos["id_producto"] == id_producto].index
         if idx.empty:
             flash("Producto no encontrado.", "danger")
@@ -725,9 +458,7 @@ def register_admin_legacy_routes(app, legacy):
             flash("La imagen seleccionada no pertenece a este producto.", "danger")
             return redirect(url_for("admin_productos"))
 
-        ruta_absoluta = legacy.ruta_imagen_producto_absoluta(imagen_a_eliminar)
-        if ruta_absoluta and os.path.exists(ruta_absoluta):
-            os.remove(ruta_absoluta)
+        legacy.eliminar_imagen_producto(imagen_a_eliminar)
 
         galeria_actualizada = legacy.obtener_galeria_producto(id_producto, "")
         productos.at[idx[0], "imagen_url"] = galeria_actualizada[0] if galeria_actualizada else ""
@@ -738,7 +469,7 @@ def register_admin_legacy_routes(app, legacy):
     def eliminar_producto(id_producto):
         if session.get("rol") != "admin":
             return "Acceso denegado"
-        productos = legacy.cargar_productos_df()
+        productos = legacy.cargar_productos_df(fresco=True)
         idx = productos[productos["id_producto"] == id_producto].index
         if not idx.empty:
             productos.at[idx[0], "eliminado"] = True
@@ -750,7 +481,7 @@ def register_admin_legacy_routes(app, legacy):
     def eliminar_definitivo(id_producto):
         if session.get("rol") != "admin":
             return "Acceso denegado"
-        productos = legacy.cargar_productos_df()
+        productos = legacy.cargar_productos_df(fresco=True)
         idx = productos[productos["id_producto"] == id_producto].index
         if not idx.empty:
             nombre = productos.at[idx[0], "nombre"]
@@ -762,7 +493,7 @@ def register_admin_legacy_routes(app, legacy):
     def restaurar_producto(id_producto):
         if session.get("rol") != "admin":
             return "Acceso denegado"
-        productos = legacy.cargar_productos_df()
+        productos = legacy.cargar_productos_df(fresco=True)
         idx = productos[productos["id_producto"] == id_producto].index
         if not idx.empty:
             productos.at[idx[0], "eliminado"] = False
@@ -962,8 +693,7 @@ def register_admin_legacy_routes(app, legacy):
             )
             flash("Usuario actualizado correctamente.", "success")
         else:
-            ultimo_id = pd.to_numeric(usuarios["id_usuario"], errors="coerce").max()
-            nuevo_id = int(ultimo_id + 1) if pd.notna(ultimo_id) else 1
+            nuevo_id = legacy.next_id("usuarios", "id_usuario")
 
             nuevo_usuario = {
                 "id_usuario": nuevo_id,
@@ -983,7 +713,7 @@ def register_admin_legacy_routes(app, legacy):
                 "reset_token": "",
                 "reset_token_expiry": "",
             }
-            usuarios = pd.concat([usuarios, pd.DataFrame([nuevo_usuario])], ignore_index=True)
+            usuarios = legacy.anexar_filas_df(usuarios, [nuevo_usuario])
             legacy.guardar_usuarios_df(usuarios[legacy.USUARIO_COLUMNS])
             legacy.registrar_actividad(f"Creo usuario {email} (ID {nuevo_id})\n- rol: {rol}\n- estado: {estado}\n- verificado: False")
             flash("Usuario creado correctamente.", "success")
@@ -1025,56 +755,77 @@ def register_admin_legacy_routes(app, legacy):
         if session.get("rol") != "admin":
             return "Acceso denegado"
 
-        registros = legacy.cargar_registros_df()
         filtro_usuario = request.args.get("usuario", "").strip()
         filtro_fecha = request.args.get("fecha", "").strip()
+        pagina_actual = legacy._parse_positive_int(request.args.get("page", 1), default=1)
 
-        if filtro_usuario:
-            registros = registros[
-                registros["id_usuario"].astype(str).str.contains(filtro_usuario, case=False, na=False)
-                | registros["accion"].astype(str).str.contains(filtro_usuario, case=False, na=False)
-            ]
-
-        if filtro_fecha:
-            registros = registros[registros["fecha_accion"].astype(str).str.startswith(filtro_fecha)]
-
-        registros["id_registro"] = pd.to_numeric(registros["id_registro"], errors="coerce")
-        registros = registros.sort_values(by="id_registro", ascending=False, na_position="last")
-
-        lista_registros = registros.fillna("").to_dict(orient="records")
-        for registro in lista_registros:
-            if registro.get("id_registro") != "":
-                registro["id_registro"] = int(registro["id_registro"])
+        lista_registros, total = legacy.consultar_registros_actividad(
+            filtro_usuario,
+            filtro_fecha,
+            pagina=pagina_actual,
+            por_pagina=REGISTROS_POR_PAGINA,
+        )
+        paginacion = legacy._construir_paginacion(total, pagina_actual, per_page=REGISTROS_POR_PAGINA)
 
         filtros = {"usuario": filtro_usuario, "fecha": filtro_fecha}
-        return render_template("Administrador/Gestion usuarios/admin_registros.html", registros=lista_registros, filtros=filtros)
+        return render_template(
+            "Administrador/Gestion usuarios/admin_registros.html",
+            registros=lista_registros,
+            filtros=filtros,
+            paginacion=paginacion,
+        )
 
     def admin_registros_export_excel():
         if session.get("rol") != "admin":
             return "Acceso denegado"
 
-        registros = legacy.cargar_registros_df()
         filtro_usuario = request.args.get("usuario", "").strip()
         filtro_fecha = request.args.get("fecha", "").strip()
+        nombre_archivo = f"registros_bd_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        # Con MAX(id_registro) en la clave, un registro nuevo invalida el archivo cacheado.
+        params = {"usuario": filtro_usuario, "fecha": filtro_fecha, "ultimo_id": legacy.ultimo_id_registro_actividad()}
+        trabajos = legacy.trabajos_exportacion
 
-        if filtro_usuario:
-            registros = registros[
-                registros["id_usuario"].astype(str).str.contains(filtro_usuario, case=False, na=False)
-                | registros["accion"].astype(str).str.contains(filtro_usuario, case=False, na=False)
-            ]
-        if filtro_fecha:
-            registros = registros[registros["fecha_accion"].astype(str).str.startswith(filtro_fecha)]
+        def generar(salida):
+            legacy.exportar_registros_excel(salida, filtro_usuario, filtro_fecha)
 
-        buffer = BytesIO()
-        registros.to_excel(buffer, index=False)
-        buffer.seek(0)
+        ruta = trabajos.ruta_archivo(trabajos.clave("registros", params))
+        if not ruta:
+            total = legacy.contar_registros_actividad(filtro_usuario, filtro_fecha)
+            if total > app.config.get("EXPORT_SINCRONO_MAX_FILAS", 20000):
+                clave = trabajos.solicitar("registros", params, nombre_archivo, generar)
+                return redirect(url_for("admin_exportacion_estado", clave=clave))
+            _, ruta = trabajos.generar("registros", params, nombre_archivo, generar)
 
-        nombre_archivo = f"registros_bd_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        return send_file(ruta, as_attachment=True, download_name=nombre_archivo, mimetype=legacy.app_export_service.MIMETYPE_XLSX)
+
+    def admin_exportacion_estado(clave):
+        if session.get("rol") != "admin":
+            return "Acceso denegado"
+        try:
+            estado = legacy.trabajos_exportacion.estado(clave)
+        except ValueError:
+            return Response("Exportacion no encontrada.", status=404, mimetype="text/plain; charset=utf-8")
+
+        if request.args.get("formato") == "json":
+            url_descarga = url_for("admin_exportacion_descargar", clave=clave) if estado["estado"] == "listo" else ""
+            return jsonify({**estado, "url_descarga": url_descarga})
+        return render_template("Administrador/Informes/admin_exportacion.html", estado=estado, clave=clave)
+
+    def admin_exportacion_descargar(clave):
+        if session.get("rol") != "admin":
+            return "Acceso denegado"
+        try:
+            ruta = legacy.trabajos_exportacion.ruta_archivo(clave)
+        except ValueError:
+            ruta = None
+        if not ruta:
+            return Response("La exportacion no existe o ya vencio.", status=404, mimetype="text/plain; charset=utf-8")
         return send_file(
-            buffer,
+            ruta,
             as_attachment=True,
-            download_name=nombre_archivo,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            download_name=legacy.trabajos_exportacion.estado(clave)["nombre"],
+            mimetype=legacy.app_export_service.MIMETYPE_XLSX,
         )
 
     def admin_ajustes():
@@ -1349,65 +1100,67 @@ def register_admin_legacy_routes(app, legacy):
             recibo_pedido_id=recibo_pedido_id,
         )
 
+    def _respuesta_recibo_no_modificado(etag):
+        respuesta = Response(status=304)
+        respuesta.set_etag(etag)
+        respuesta.cache_control.private = True
+        respuesta.cache_control.no_cache = True
+        return respuesta
+
     def admin_pos_recibo_pdf(id_pedido):
         if session.get("rol") != "admin":
             return "Acceso denegado"
         try:
-            pdf_bytes = legacy.generar_pdf_recibo_pos(id_pedido)
+            etag = f"{legacy.huella_recibo_pos(id_pedido)}-pdf"
+            if etag in request.if_none_match:
+                return _respuesta_recibo_no_modificado(etag)
+            pdf_bytes = legacy.recibo_pos_cacheado(id_pedido, "pdf", huella=etag[:-4])
         except ValueError as exc:
             return Response(str(exc), status=404, mimetype="text/plain; charset=utf-8")
         except Exception as exc:
             return Response(f"No se pudo generar el recibo PDF. {str(exc)}", status=500, mimetype="text/plain; charset=utf-8")
 
-        return send_file(
+        respuesta = send_file(
             BytesIO(pdf_bytes),
             mimetype="application/pdf",
             as_attachment=True,
             download_name=f"recibo_pos_{id_pedido}.pdf",
+            etag=etag,
         )
+        respuesta.cache_control.private = True
+        respuesta.cache_control.no_cache = True
+        return respuesta
 
     def admin_pos_recibo_html(id_pedido):
         if session.get("rol") != "admin":
             return "Acceso denegado"
         try:
-            return legacy.render_html_recibo_pos(id_pedido)
+            etag = f"{legacy.huella_recibo_pos(id_pedido)}-html"
+            if etag in request.if_none_match:
+                return _respuesta_recibo_no_modificado(etag)
+            html = legacy.recibo_pos_cacheado(id_pedido, "html", huella=etag[:-5])
         except ValueError as exc:
             return Response(str(exc), status=404, mimetype="text/plain; charset=utf-8")
         except Exception as exc:
             return Response(f"No se pudo generar la vista del recibo. {str(exc)}", status=500, mimetype="text/plain; charset=utf-8")
 
+        respuesta = Response(html, mimetype="text/html; charset=utf-8")
+        respuesta.set_etag(etag)
+        respuesta.cache_control.private = True
+        respuesta.cache_control.no_cache = True
+        return respuesta
+
     def admin_pedidos():
         if session.get("rol") != "admin":
             return "Acceso denegado"
 
-        pedidos = legacy.cargar_pedidos_df()
-        pagos = legacy.cargar_pagos_df()
-        detalle = legacy.cargar_detalle_pedido_df()
-        productos = legacy.cargar_productos_df()
-        usuarios = legacy.cargar_usuarios_df()
-
-        pedidos, pagos, detalle, productos = legacy._normalizar_dataframes_admin_pedidos(pedidos, pagos, detalle, productos)
-        pedidos_view = legacy._construir_vista_pedidos(pedidos, pagos, detalle, usuarios, productos)
-
         filtros, pago_filtros = legacy._leer_filtros_admin_pedidos(request.args)
-        pedidos_view, filtros, paginacion, hay_filtros_activos = legacy._filtrar_y_paginar_pedidos(pedidos_view, filtros, per_page=10)
+        pedidos_pagina, filtros, paginacion, hay_filtros_activos = legacy._consultar_pedidos_admin(filtros, per_page=10)
+        lista_pedidos = legacy._enriquecer_pedidos_con_tracking(pedidos_pagina)
+
         pagina_curso_actual = legacy._parse_positive_int(request.args.get("curso_page", 1), default=1)
-        lista_pedidos_base = legacy._enriquecer_pedidos_con_tracking(
-            legacy._serializar_pedidos_admin(
-                legacy._construir_vista_pedidos(pedidos, pagos, detalle, usuarios, productos).sort_values(
-                    by="id_pedido", ascending=False, na_position="last"
-                )
-            )
-        )
-        pedidos_activos = [pedido for pedido in lista_pedidos_base if pedido.get("estado_activo")]
-        pedidos_activos_vista, paginacion_curso = legacy._paginar_lista(pedidos_activos, pagina_curso_actual, per_page=6)
-        resumen_estados = {
-            "activos": len(pedidos_activos),
-            "confirmados": sum(1 for pedido in pedidos_activos if pedido.get("estado_ui") == "confirmado"),
-            "empaquetados": sum(1 for pedido in pedidos_activos if pedido.get("estado_ui") == "empaquetado"),
-            "enviados": sum(1 for pedido in pedidos_activos if pedido.get("estado_ui") == "enviado"),
-        }
-        lista_pedidos = legacy._enriquecer_pedidos_con_tracking(legacy._serializar_pedidos_admin(pedidos_view))
+        pedidos_activos, paginacion_curso, resumen_estados = legacy._consultar_pedidos_en_curso(pagina_curso_actual, per_page=6)
+        pedidos_activos_vista = legacy._enriquecer_pedidos_con_tracking(pedidos_activos)
 
         return render_template(
             "Administrador/Gestion pedidos/admin_orders.html",
@@ -1421,10 +1174,8 @@ def register_admin_legacy_routes(app, legacy):
             estados_pedido=legacy.PEDIDO_STATUS_FLOW,
         )
 
-    def admin_pedidos_estado(id_pedido):
-        if session.get("rol") != "admin":
-            return "Acceso denegado"
-
+    def _filtros_retorno_pedidos():
+        """Filtros y paginas que los formularios de pedidos reenvian para volver a la misma vista."""
         filtros = {
             "q": str(request.form.get("f_q", "")).strip(),
             "estado": str(request.form.get("f_estado", "todos")).strip().lower(),
@@ -1443,6 +1194,13 @@ def register_admin_legacy_routes(app, legacy):
         }
         ajustes_page = legacy._parse_positive_int(request.form.get("ajustes_page", "1"), default=1)
         curso_page = legacy._parse_positive_int(request.form.get("curso_page", "1"), default=1)
+        return filtros, pago_filtros, ajustes_page, curso_page
+
+    def admin_pedidos_estado(id_pedido):
+        if session.get("rol") != "admin":
+            return "Acceso denegado"
+
+        filtros, pago_filtros, ajustes_page, curso_page = _filtros_retorno_pedidos()
 
         estado_nuevo = request.form.get("estado", "").strip().lower()
         origen = str(request.form.get("origen", "")).strip().lower()
@@ -1484,28 +1242,68 @@ def register_admin_legacy_routes(app, legacy):
 
         return legacy._redirigir_admin_pedidos_por_origen(origen, filtros, pago_filtros, ajustes_page, curso_page)
 
+    def admin_pedidos_estado_lote():
+        if session.get("rol") != "admin":
+            return "Acceso denegado"
+
+        filtros, pago_filtros, ajustes_page, curso_page = _filtros_retorno_pedidos()
+        origen = str(request.form.get("origen", "")).strip().lower()
+        estado_nuevo = request.form.get("estado", "").strip().lower()
+        estados_validos = {clave for clave, _ in legacy.PEDIDO_STATUS_FLOW} | {"cancelado"}
+        if estado_nuevo not in estados_validos:
+            flash("Estado de pedido invalido.", "danger")
+            return legacy._redirigir_admin_pedidos_por_origen(origen, filtros, pago_filtros, ajustes_page, curso_page)
+
+        ids_pedido = pd.to_numeric(pd.Series(request.form.getlist("ids_pedido"), dtype="object"), errors="coerce").dropna()
+        ids_pedido = sorted({int(valor) for valor in ids_pedido})
+        if not ids_pedido:
+            flash("Selecciona al menos un pedido.", "warning")
+            return legacy._redirigir_admin_pedidos_por_origen(origen, filtros, pago_filtros, ajustes_page, curso_page)
+
+        pedidos = legacy.cargar_pedidos_df()
+        pedidos["id_pedido"] = pd.to_numeric(pedidos["id_pedido"], errors="coerce")
+        seleccionados = pedidos[pedidos["id_pedido"].isin(ids_pedido)]
+        actualizaciones = []
+        for idx, pedido in seleccionados.iterrows():
+            estado_anterior = str(pedido.get("estado", "")).strip().lower()
+            if estado_anterior == estado_nuevo:
+                continue
+            pedidos.at[idx, "estado"] = estado_nuevo
+            actualizaciones.append(
+                {
+                    "id_pedido": int(pedido["id_pedido"]),
+                    "id_usuario": pedido.get("id_usuario", ""),
+                    "estado_anterior": estado_anterior,
+                    "estado_pedido": estado_nuevo,
+                    "tipo_actualizacion": "pedido",
+                }
+            )
+
+        if actualizaciones:
+            legacy.guardar_pedidos_df(pedidos)
+            for actualizacion in actualizaciones:
+                legacy.registrar_actividad(
+                    f"Actualizo estado de pedido #{actualizacion['id_pedido']}: "
+                    f"{actualizacion['estado_anterior']} -> {estado_nuevo}"
+                )
+            flash(f'{len(actualizaciones)} pedido(s) actualizados a "{estado_nuevo}".', "success")
+            resultado_notificacion = legacy._notificar_actualizaciones_pedidos_clientes(actualizaciones)
+            legacy._flash_resultado_notificacion_pedido(resultado_notificacion)
+
+        sin_cambio = len(seleccionados) - len(actualizaciones)
+        if sin_cambio:
+            flash(f'{sin_cambio} pedido(s) ya estaban en "{estado_nuevo}".', "info")
+        no_encontrados = len(ids_pedido) - len(seleccionados)
+        if no_encontrados:
+            flash(f"{no_encontrados} pedido(s) seleccionados no se encontraron.", "warning")
+
+        return legacy._redirigir_admin_pedidos_por_origen(origen, filtros, pago_filtros, ajustes_page, curso_page)
+
     def admin_pedidos_pago(id_pedido):
         if session.get("rol") != "admin":
             return "Acceso denegado"
 
-        filtros = {
-            "q": str(request.form.get("f_q", "")).strip(),
-            "estado": str(request.form.get("f_estado", "todos")).strip().lower(),
-            "estado_pago": str(request.form.get("f_estado_pago", "todos")).strip().lower(),
-            "fecha_desde": str(request.form.get("f_fecha_desde", "")).strip(),
-            "fecha_hasta": str(request.form.get("f_fecha_hasta", "")).strip(),
-            "page": str(request.form.get("f_page", "1")).strip(),
-        }
-        pago_filtros = {
-            "q": str(request.form.get("f_pago_q", "")).strip(),
-            "metodo": str(request.form.get("f_pago_metodo", "todos")).strip().lower(),
-            "estado": str(request.form.get("f_pago_estado", "todos")).strip().lower(),
-            "fecha_desde": str(request.form.get("f_pago_fecha_desde", "")).strip(),
-            "fecha_hasta": str(request.form.get("f_pago_fecha_hasta", "")).strip(),
-            "page": str(request.form.get("f_pago_page", "1")).strip(),
-        }
-        ajustes_page = legacy._parse_positive_int(request.form.get("ajustes_page", "1"), default=1)
-        curso_page = legacy._parse_positive_int(request.form.get("curso_page", "1"), default=1)
+        filtros, pago_filtros, ajustes_page, curso_page = _filtros_retorno_pedidos()
         origen = str(request.form.get("origen", "")).strip().lower()
 
         accion = str(request.form.get("accion_pago", "")).strip().lower()
@@ -1574,6 +1372,7 @@ def register_admin_legacy_routes(app, legacy):
 
         legacy.guardar_pagos_df(pagos)
         legacy.guardar_pedidos_df(pedidos)
+        legacy.invalidar_recibo_pos(id_pedido)
 
         if estado_pago_anterior != estado_pago_nuevo or estado_pedido_anterior != estado_pedido_nuevo:
             legacy.registrar_actividad(
@@ -1699,9 +1498,12 @@ def register_admin_legacy_routes(app, legacy):
         total_bruto = resultado_carrito["total_bruto"]
         total_descuento = resultado_carrito["total_descuento"]
         total = resultado_carrito["total"]
-        legacy.guardar_productos_df(resultado_carrito["productos"])
 
-        next_pedido_id = legacy._registrar_venta_pos_admin(carrito_validado, metodo_pago, total, total_descuento)
+        orden = legacy._registrar_venta_pos_admin(carrito_validado, metodo_pago, total, total_descuento)
+        if orden["error"]:
+            flash(orden["error"][0], orden["error"][1])
+            return redirect(url_for("admin_pos"))
+        next_pedido_id = orden["id_pedido"]
 
         total_bruto = round(total_bruto, 2)
         total_descuento = round(total_descuento, 2)
@@ -1741,7 +1543,7 @@ def register_admin_legacy_routes(app, legacy):
         if session.get("rol") != "admin":
             return "Acceso denegado"
 
-        productos = legacy.cargar_productos_df()
+        productos = legacy.cargar_productos_df(fresco=True)
         producto = productos[productos["id_producto"] == id_producto]
         if producto.empty:
             return "Producto no encontrado."
@@ -1862,6 +1664,10 @@ def register_admin_legacy_routes(app, legacy):
     )
     app.add_url_rule("/admin/registros", endpoint="admin_registros", view_func=admin_registros)
     app.add_url_rule("/admin/registros/export_excel", endpoint="admin_registros_export_excel", view_func=admin_registros_export_excel)
+    app.add_url_rule("/admin/exportaciones/<clave>", endpoint="admin_exportacion_estado", view_func=admin_exportacion_estado)
+    app.add_url_rule(
+        "/admin/exportaciones/<clave>/descargar", endpoint="admin_exportacion_descargar", view_func=admin_exportacion_descargar
+    )
     app.add_url_rule("/admin/ajustes", endpoint="admin_ajustes", view_func=admin_ajustes, methods=["GET", "POST"])
     app.add_url_rule(
         "/admin/ajustes/orden-personalizada/<int:id_orden>/estado",
@@ -1880,6 +1686,7 @@ def register_admin_legacy_routes(app, legacy):
     app.add_url_rule("/admin/pos/recibo/<int:id_pedido>/html", endpoint="admin_pos_recibo_html", view_func=admin_pos_recibo_html)
     app.add_url_rule("/admin/pedidos", endpoint="admin_pedidos", view_func=admin_pedidos)
     app.add_url_rule("/admin/pedidos/estado/<int:id_pedido>", endpoint="admin_pedidos_estado", view_func=admin_pedidos_estado, methods=["POST"])
+    app.add_url_rule("/admin/pedidos/estado/lote", endpoint="admin_pedidos_estado_lote", view_func=admin_pedidos_estado_lote, methods=["POST"])
     app.add_url_rule("/admin/pedidos/pago/<int:id_pedido>", endpoint="admin_pedidos_pago", view_func=admin_pedidos_pago, methods=["POST"])
     app.add_url_rule("/admin", endpoint="admin_dashboard", view_func=admin_dashboard)
     app.add_url_rule("/admin/destacados", endpoint="admin_actualizar_destacados", view_func=admin_actualizar_destacados, methods=["POST"])
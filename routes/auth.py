@@ -1,6 +1,5 @@
 from datetime import datetime, timedelta
 
-import pandas as pd
 from flask import Blueprint, flash, jsonify, redirect, render_template, request, session, url_for
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
@@ -24,7 +23,6 @@ def register_auth_legacy_routes(app, legacy):
     def login():
         if request.method == "GET":
             return render_template("Usuarios/Autenticacion/login_form.html")
-        usuarios = legacy.cargar_usuarios_df()  # leer cada vez
         email = legacy.normalizar_email(request.form.get("email", ""))
         password = request.form.get("password", "")
         acepta_terminos = request.form.get("acepta_terminos_identidad") == "on"
@@ -33,32 +31,20 @@ def register_auth_legacy_routes(app, legacy):
             flash("Debes aceptar los términos de validación de identidad y tratamiento de datos personales para iniciar sesión.", "warning")
             return render_template("Usuarios/Autenticacion/login_form.html"), 400
 
-        usuarios["email"] = usuarios["email"].astype(str).str.strip()
-        candidatos = usuarios[usuarios["email"].str.lower() == email]
-        if candidatos.empty:
+        usuario = legacy.obtener_usuario_por_email(email)
+        if usuario is None:
             flash("Correo equivocado.", "email_error")
             return render_template("Usuarios/Autenticacion/login_form.html"), 401
 
-        idx_usuario = candidatos.index[0]
-        usuario = candidatos.loc[idx_usuario]
-
         if not legacy.password_coincide(usuario.get("password_hash", ""), password):
             flash("Contraseña incorrecta.", "password_error")
             return render_template("Usuarios/Autenticacion/login_form.html"), 401
 
         password_guardado = str(usuario.get("password_hash", "") or "")
-        debe_guardar_usuario = False
+        password_hash_nuevo = None
         if not legacy.password_esta_hasheado(password_guardado):
-            usuarios.at[idx_usuario, "password_hash"] = legacy.crear_hash_password(password)
-            debe_guardar_usuario = True
-
-        if "terminos_identidad_aceptados" in usuarios.columns:
-            usuarios.at[idx_usuario, "terminos_identidad_aceptados"] = True
-            usuarios.at[idx_usuario, "terminos_identidad_fecha"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            debe_guardar_usuario = True
-
-        if debe_guardar_usuario:
-            legacy.guardar_usuarios_df(usuarios)
+            password_hash_nuevo = legacy.crear_hash_password(password)
+        legacy.registrar_inicio_sesion_usuario(usuario["id_usuario"], password_hash_nuevo)
 
         estado = str(usuario.get("estado", "activo")).strip().lower()
         if estado != "activo":
@@ -237,7 +223,7 @@ def register_auth_legacy_routes(app, legacy):
 
             envio_ok, mensaje_envio = legacy.enviar_codigo_registro(email, codigo)
             if not envio_ok:
-                legacy.PENDING_REGISTRATIONS.pop(email, None)
+                legacy.eliminar_registro_pendiente(email)
                 session.pop("registro_pendiente_email", None)
                 flash(mensaje_envio, "danger")
                 return _render_registro(nombre, email), 500
@@ -313,7 +299,7 @@ def register_auth_legacy_routes(app, legacy):
             envio_ok, mensaje_envio = legacy.enviar_codigo_registro(email, codigo)
 
             if not envio_ok:
-                legacy.PENDING_REGISTRATIONS.pop(email, None)
+                legacy.eliminar_registro_pendiente(email)
                 session.pop("registro_pendiente_email", None)
                 return jsonify({"success": False, "message": mensaje_envio}), 500
 
@@ -352,7 +338,7 @@ def register_auth_legacy_routes(app, legacy):
                 envio_ok, mensaje_envio = legacy.enviar_codigo_registro(email, codigo_nuevo)
                 flash(mensaje_envio, "success" if envio_ok else "danger")
                 if not envio_ok:
-                    legacy.PENDING_REGISTRATIONS.pop(email, None)
+                    legacy.eliminar_registro_pendiente(email)
                     session.pop("registro_pendiente_email", None)
                     return redirect(url_for("registro"))
                 return _render_verificacion(email)
@@ -375,7 +361,7 @@ def register_auth_legacy_routes(app, legacy):
             usuarios = legacy.cargar_usuarios_df()
             usuarios["email"] = usuarios["email"].astype(str).str.strip().str.lower()
             if email in usuarios["email"].values:
-                legacy.PENDING_REGISTRATIONS.pop(email, None)
+                legacy.eliminar_registro_pendiente(email)
                 session.pop("registro_pendiente_email", None)
                 flash(
                     "El correo electrónico ya está registrado con otra cuenta. "
@@ -387,7 +373,7 @@ def register_auth_legacy_routes(app, legacy):
             nombre = str(registro_pendiente.get("nombre", "")).strip()
             password_guardado = str(registro_pendiente.get("password", ""))
             if not nombre or not password_guardado:
-                legacy.PENDING_REGISTRATIONS.pop(email, None)
+                legacy.eliminar_registro_pendiente(email)
                 session.pop("registro_pendiente_email", None)
                 flash("No se encontraron los datos del registro pendiente. Intenta nuevamente.", "warning")
                 return redirect(url_for("registro"))
@@ -395,8 +381,7 @@ def register_auth_legacy_routes(app, legacy):
             if not legacy.password_esta_hasheado(password_guardado):
                 password_guardado = legacy.crear_hash_password(password_guardado)
 
-            ultimo_id = pd.to_numeric(usuarios["id_usuario"], errors="coerce").max()
-            nuevo_id = int(ultimo_id + 1) if pd.notna(ultimo_id) else 1
+            nuevo_id = legacy.next_id("usuarios", "id_usuario")
             nuevo_usuario = {
                 "id_usuario": nuevo_id,
                 "nombre": nombre,
@@ -414,9 +399,9 @@ def register_auth_legacy_routes(app, legacy):
                 "terminos_identidad_fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             }
 
-            usuarios = pd.concat([usuarios, pd.DataFrame([nuevo_usuario])], ignore_index=True)
+            usuarios = legacy.anexar_filas_df(usuarios, [nuevo_usuario])
             legacy.guardar_usuarios_df(usuarios)
-            legacy.PENDING_REGISTRATIONS.pop(email, None)
+            legacy.eliminar_registro_pendiente(email)
             session.pop("registro_pendiente_email", None)
 
             legacy.registrar_actividad(f"Nuevo usuario registrado y verificado: {nombre}")
@@ -355,11 +355,6 @@ def register_checkout_legacy_routes(app, legacy):
         session["checkout_cliente_direccion"] = cliente_direccion
         legacy._guardar_contacto_checkout_usuario(cliente_telefono, cliente_direccion)
 
-        pagos = legacy.cargar_pagos_df()
-        pagos = legacy._asegurar_columnas_descuento_pagos(pagos)
-        pedidos = legacy.cargar_pedidos_df()
-        detalle_pedido = legacy.cargar_detalle_pedido_df()
-
         productos = legacy.cargar_productos_df()
         if productos.empty:
             flash("No existe la base de productos.", "danger")
@@ -396,14 +391,8 @@ def register_checkout_legacy_routes(app, legacy):
 
         if metodo_pago == "tarjeta":
             return legacy._iniciar_pago_stripe_desde_carrito(carrito_calculado, codigo_promo, total_final)
-        agotados_en_compra = legacy._descontar_stock_checkout(productos, carrito_calculado)
-        legacy.guardar_productos_df(productos)
-
-        nuevo_id_pedido = legacy._registrar_compra_checkout_usuario(
+        orden = legacy._registrar_compra_checkout_usuario(
             carrito=carrito_calculado,
-            pedidos=pedidos,
-            detalle_pedido=detalle_pedido,
-            pagos=pagos,
             metodo_pago=metodo_pago,
             total_final=total_final,
             promo_aplicada=promo_aplicada,
@@ -412,6 +401,11 @@ def register_checkout_legacy_routes(app, legacy):
             cliente_telefono=cliente_telefono,
             cliente_direccion=cliente_direccion,
         )
+        if orden["error"]:
+            flash(orden["error"][0], orden["error"][1])
+            return redirect(url_for("cart", metodo_pago=metodo_pago, codigo_promo=codigo_promo))
+        nuevo_id_pedido = orden["id_pedido"]
+        agotados_en_compra = orden["agotados"]
         legacy.actualizar_estado_ordenes_personalizadas_carrito(
             carrito_calculado,
             "en_revision" if metodo_pago == "transferencia" else "pendiente",
@@ -427,17 +421,8 @@ def register_checkout_legacy_routes(app, legacy):
         if metodo_pago == "transferencia":
             comprobante_url, error_guardado = legacy.guardar_comprobante_transferencia(comprobante_transferencia, nuevo_id_pedido)
             if comprobante_url:
-                pagos_actualizados = legacy.cargar_pagos_df()
-                pagos_actualizados = legacy._asegurar_columnas_descuento_pagos(pagos_actualizados)
-                pagos_actualizados["id_pedido_num"] = pd.to_numeric(pagos_actualizados["id_pedido"], errors="coerce")
-                pagos_actualizados["id_pago_num"] = pd.to_numeric(pagos_actualizados["id_pago"], errors="coerce")
-                idx_pago = pagos_actualizados[pagos_actualizados["id_pedido_num"] == nuevo_id_pedido].sort_values(
-                    by="id_pago_num", ascending=False, na_position="last"
-                ).index
-                if not idx_pago.empty:
-                    pagos_actualizados.at[idx_pago[0], "comprobante_url"] = comprobante_url
-                    pagos_actualizados = pagos_actualizados.drop(columns=["id_pedido_num", "id_pago_num"])
-                    legacy.guardar_pagos_df(pagos_actualizados)
+                if orden["id_pago"]:
+                    legacy._actualizar_comprobante_pago(orden["id_pago"], comprobante_url)
                     comprobante_adjunto = True
                     notificacion_admin_ok = legacy._notificar_transferencia_admin(
                         id_pedido=nuevo_id_pedido,
@@ -579,36 +564,28 @@ def register_checkout_legacy_routes(app, legacy):
                     "valor_descuento": 0.0,
                 }
 
-        productos = legacy.cargar_productos_df()
-        pedidos = legacy.cargar_pedidos_df()
-        detalle_pedido = legacy.cargar_detalle_pedido_df()
-        pagos = legacy._asegurar_columnas_descuento_pagos(legacy.cargar_pagos_df())
-
-        estado_pedido = "confirmado"
-        agotados_en_compra = []
-        error_stock = legacy._validar_stock_checkout(productos, carrito_checkout)
-        if error_stock:
-            estado_pedido = "pendiente_revision"
+        datos_orden = {
+            "carrito": carrito_checkout,
+            "metodo_pago": "tarjeta",
+            "total_final": total_final,
+            "promo_aplicada": promo_aplicada,
+            "descuento_promo": descuento_promo,
+            "cliente_telefono": cliente_telefono,
+            "cliente_direccion": cliente_direccion,
+        }
+        orden = legacy._registrar_compra_checkout_usuario(estado_pedido="confirmado", **datos_orden)
+        if orden["error"]:
+            # El cobro ya se hizo: el pedido se registra sin descontar stock y queda en revision.
             legacy.registrar_actividad(
                 f"Pago Stripe {session_id} confirmado con stock en conflicto. Pedido quedo en revision."
             )
-        else:
-            agotados_en_compra = legacy._descontar_stock_checkout(productos, carrito_checkout)
-            legacy.guardar_productos_df(productos)
-
-        nuevo_id_pedido = legacy._registrar_compra_checkout_usuario(
-            carrito=carrito_checkout,
-            pedidos=pedidos,
-            detalle_pedido=detalle_pedido,
-            pagos=pagos,
-            metodo_pago="tarjeta",
-            total_final=total_final,
-            promo_aplicada=promo_aplicada,
-            descuento_promo=descuento_promo,
-            estado_pedido=estado_pedido,
-            cliente_telefono=cliente_telefono,
-            cliente_direccion=cliente_direccion,
-        )
+            orden = legacy._registrar_compra_checkout_usuario(
+                estado_pedido="pendiente_revision",
+                descontar_stock=False,
+                **datos_orden,
+            )
+        nuevo_id_pedido = orden["id_pedido"]
+        agotados_en_compra = orden["agotados"]
         legacy._stripe_checkout_marcar_estado(session_id, "pagado", nuevo_id_pedido)
         legacy.actualizar_estado_ordenes_personalizadas_carrito(carrito_checkout, "pendiente")
         notificacion_personalizado_ok = legacy._notificar_pago_personalizado_admin(
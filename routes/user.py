@@ -21,49 +21,28 @@ def register_user_legacy_routes(app, legacy):
         if session.get("rol") != "normal":
             return "Acceso denegado"
 
-        pedidos = legacy.cargar_pedidos_df().copy()
-        pedidos["id_pedido_num"] = pd.to_numeric(pedidos["id_pedido"], errors="coerce")
-        pedidos["id_usuario_num"] = pd.to_numeric(pedidos["id_usuario"], errors="coerce")
         id_usuario = pd.to_numeric(session.get("id_usuario"), errors="coerce")
-        pedido = pedidos[(pedidos["id_pedido_num"] == id_pedido) & (pedidos["id_usuario_num"] == id_usuario)]
-
-        if pedido.empty:
+        if pd.isna(id_usuario):
+            return "Pedido no encontrado o no tienes permiso para verlo"
+        resultado = legacy.obtener_pedido_con_detalle(id_pedido, id_usuario=int(id_usuario))
+        if resultado is None:
             return "Pedido no encontrado o no tienes permiso para verlo"
 
-        pedidos_usuario = pedidos[pedidos["id_usuario_num"] == id_usuario].copy()
-        pedidos_usuario = pedidos_usuario.sort_values(by="id_pedido_num", ascending=True, na_position="last").reset_index(drop=True)
-        pedidos_usuario["numero_pedido_usuario"] = range(1, len(pedidos_usuario) + 1)
-        pedido_numero_usuario = pedidos_usuario.loc[pedidos_usuario["id_pedido_num"] == id_pedido, "numero_pedido_usuario"]
-
-        detalle_pedido = legacy.cargar_detalle_pedido_df()
-        detalles = detalle_pedido[detalle_pedido["id_pedido"] == id_pedido]
-
-        productos = legacy.cargar_productos_df()
-        detalles = pd.merge(detalles, productos[["id_producto", "nombre", "precio"]], on="id_producto")
-        if "talla" not in detalles.columns:
-            detalles["talla"] = ""
-
-        pedido_dict = pedido.iloc[0].to_dict()
-        pedido_dict["numero_pedido_usuario"] = int(pedido_numero_usuario.iloc[0]) if not pedido_numero_usuario.empty else ""
-        pagos = legacy.cargar_pagos_df()
-        if not pagos.empty:
-            pagos = pagos.copy()
-            pagos["id_pedido_num"] = pd.to_numeric(pagos["id_pedido"], errors="coerce")
-            pagos["id_pago_num"] = pd.to_numeric(pagos["id_pago"], errors="coerce")
-            pago_pedido = pagos[pagos["id_pedido_num"] == id_pedido].sort_values(by="id_pago_num", ascending=False, na_position="last")
-            if not pago_pedido.empty:
-                pago_info = pago_pedido.iloc[0].to_dict()
-                pedido_dict["monto"] = pago_info.get("monto", "")
-                pedido_dict["metodo_pago"] = pago_info.get("metodo_pago", "")
-                pedido_dict["estado_pago"] = pago_info.get("estado_pago", "")
-                pedido_dict["comprobante_url"] = pago_info.get("comprobante_url", "")
+        pedido_dict = resultado["pedido"]
+        detalles = resultado["detalles"]
+        pago_info = legacy.ultimo_pago_de_pedido(id_pedido)
+        if pago_info:
+            pedido_dict["monto"] = pago_info.get("monto", "")
+            pedido_dict["metodo_pago"] = pago_info.get("metodo_pago", "")
+            pedido_dict["estado_pago"] = pago_info.get("estado_pago", "")
+            pedido_dict["comprobante_url"] = pago_info.get("comprobante_url", "")
 
         pedido_info = legacy._enriquecer_pedidos_con_tracking([pedido_dict])[0]
 
         return render_template(
             "Usuarios/Informacion compras pedido/user_order_details.html",
             pedido=pedido_info,
-            detalles=detalles.to_dict(orient="records"),
+            detalles=detalles,
         )
 
     def user_profile():
@@ -504,14 +483,14 @@ def register_user_legacy_routes(app, legacy):
         return render_template("Usuarios/catalogo/ejercito.html", productos=productos)
 
     def producto_detalle(id_producto):
-        productos = legacy.cargar_productos_activos_df()
-        producto = productos[productos["id_producto"] == id_producto]
-        if producto.empty:
+        producto_dict = legacy.obtener_producto(id_producto)
+        if producto_dict is None:
             return "Producto no encontrado"
 
-        producto_dict = producto.iloc[0].to_dict()
         promos = legacy.cargar_promociones_df()
-        mejor_promo = legacy.obtener_mejor_promocion_por_producto(producto, promos, datetime.now().date())
+        mejor_promo = legacy.obtener_mejor_promocion_por_producto(
+            pd.DataFrame([producto_dict]), promos, datetime.now().date()
+        )
         promo = mejor_promo.get(int(producto_dict.get("id_producto", id_producto)))
         precio_base_raw = pd.to_numeric(producto_dict.get("precio", 0), errors="coerce")
         precio_base = float(precio_base_raw) if pd.notna(precio_base_raw) else 0.0
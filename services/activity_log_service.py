@@ -0,0 +1,236 @@
+"""
+Bitacora de actividad (tabla registros): anexado y consulta.
+
+Cada accion es un INSERT con el id de la secuencia BIGSERIAL; nunca se lee ni se
+reescribe la tabla. Con `espera_ms` > 0 las acciones se acumulan en memoria y un hilo
+las inserta juntas (group commit) cada `espera_ms` o al llegar a `max_lote`, lo que
+aplana las rafagas (importaciones, acciones masivas) a una transaccion por lote. Si la
+base no responde, lo pendiente se conserva hasta `max_pendientes` filas; por encima se
+descartan (y se registran en el log) las mas antiguas.
+
+La consulta del panel /admin/registros filtra, ordena y pagina en SQL (indices trigram
+para el texto y btree para la fecha) y la exportacion recorre la tabla por lotes con un
+cursor del servidor, sin cargar el historial completo en memoria.
+"""
+
+import atexit
+from datetime import datetime, timedelta
+import logging
+import os
+import re
+import threading
+
+from openpyxl import Workbook
+import sqlalchemy as sa
+
+from core.db_utils import append_rows, engine, fecha_hora_sql
+from services.export_service import escribir_hoja
+
+logger = logging.getLogger(__name__)
+
+
+def insertar_actividades(filas):
+    return append_rows("registros", filas)
+
+
+class BitacoraActividad:
+    def __init__(self, insertar_fn=insertar_actividades, espera_ms=0, max_lote=200, max_pendientes=10000):
+        self._insertar_fn = insertar_fn
+        self._espera = max(0.0, float(espera_ms or 0)) / 1000
+        self._max_lote = max(1, int(max_lote))
+        self._max_pendientes = max(self._max_lote, int(max_pendientes))
+        self._lock = threading.Lock()
+        self._pendientes = []
+        self._despertar = threading.Event()
+        self._hilo_pid = None
+        if self._espera:
+            atexit.register(self.vaciar)
+
+    def registrar(self, id_usuario, accion, fecha=None):
+        fila = {
+            "id_usuario": id_usuario,
+            "accion": accion,
+            "fecha_accion": fecha or datetime.now(),
+        }
+        if not self._espera:
+            self._insertar_fn([fila])
+            return
+
+        with self._lock:
+            self._pendientes.append(fila)
+            self._recortar_pendientes()
+            lleno = len(self._pendientes) >= self._max_lote
+            if self._hilo_pid != os.getpid():
+                # Tras un fork el hilo del padre no existe en el hijo.
+                self._hilo_pid = os.getpid()
+                threading.Thread(target=self._bucle, name="bitacora-actividad", daemon=True).start()
+        if lleno:
+            self._despertar.set()
+
+    def _recortar_pendientes(self):
+        """Descarta las filas mas antiguas por encima de max_pendientes (llamar con el lock tomado)."""
+        sobrantes = len(self._pendientes) - self._max_pendientes
+        if sobrantes <= 0:
+            return
+        descartadas = self._pendientes[:sobrantes]
+        del self._pendientes[:sobrantes]
+        logger.error(
+            "Bitacora de actividad sin guardar por encima de %s filas; se descartan %s (desde %s hasta %s)",
+            self._max_pendientes,
+            sobrantes,
+            descartadas[0]["fecha_accion"],
+            descartadas[-1]["fecha_accion"],
+        )
+
+    def vaciar(self):
+        """
+        Inserta en una sola transaccion todo lo pendiente; si falla, lo conserva para el
+        siguiente lote dentro del limite de max_pendientes.
+        """
+        with self._lock:
+            lote, self._pendientes = self._pendientes, []
+        if not lote:
+            return 0
+        try:
+            return self._insertar_fn(lote)
+        except Exception:
+            with self._lock:
+                self._pendientes[:0] = lote
+                self._recortar_pendientes()
+            raise
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self._espera)
+            self._despertar.clear()
+            try:
+                self.vaciar()
+            except Exception:
+                logger.exception("No fue posible guardar la bitacora de actividad")
+
+
+# registros.fecha_accion es TEXT en el respaldo y TIMESTAMPTZ en instalaciones nuevas.
+# Debe coincidir con la expresion de idx_registros_fecha_accion_ts (core.db_utils).
+_FECHA_ACCION_SQL = fecha_hora_sql("fecha_accion")
+_COLUMNAS_REGISTRO_SQL = f"""
+    id_registro,
+    COALESCE(CAST(id_usuario AS TEXT), '') AS id_usuario,
+    COALESCE(accion, '') AS accion,
+    COALESCE(to_char({_FECHA_ACCION_SQL}, 'YYYY-MM-DD HH24:MI:SS'), CAST(fecha_accion AS TEXT), '') AS fecha_accion
+"""
+_FORMATOS_PREFIJO_FECHA = (
+    ("%Y-%m-%d %H:%M:%S", timedelta(seconds=1)),
+    ("%Y-%m-%d %H:%M", timedelta(minutes=1)),
+    ("%Y-%m-%d %H", timedelta(hours=1)),
+    ("%Y-%m-%d", timedelta(days=1)),
+)
+
+
+def _rango_prefijo_fecha(prefijo):
+    """Convierte un prefijo 'YYYY', 'YYYY-MM', 'YYYY-MM-DD[ HH[:MM[:SS]]]' en [inicio, fin)."""
+    if re.fullmatch(r"\d{4}", prefijo):
+        anio = int(prefijo)
+        return datetime(anio, 1, 1), datetime(anio + 1, 1, 1)
+    if re.fullmatch(r"\d{4}-\d{2}", prefijo):
+        inicio = datetime.strptime(prefijo, "%Y-%m")
+        return inicio, datetime(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+    for formato, duracion in _FORMATOS_PREFIJO_FECHA:
+        try:
+            inicio = datetime.strptime(prefijo, formato)
+        except ValueError:
+            continue
+        return inicio, inicio + duracion
+    return None
+
+
+def _escapar_like(texto):
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _filtros_registros(filtro_usuario="", filtro_fecha=""):
+    condiciones = []
+    params = {}
+    filtro_usuario = str(filtro_usuario or "").strip()
+    filtro_fecha = str(filtro_fecha or "").strip()
+    if filtro_usuario:
+        condiciones.append("(CAST(id_usuario AS TEXT) ILIKE :texto OR accion ILIKE :texto)")
+        params["texto"] = f"%{_escapar_like(filtro_usuario)}%"
+    if filtro_fecha:
+        rango = _rango_prefijo_fecha(filtro_fecha)
+        if rango:
+            condiciones.append(f"{_FECHA_ACCION_SQL} >= :fecha_inicio AND {_FECHA_ACCION_SQL} < :fecha_fin")
+            params["fecha_inicio"], params["fecha_fin"] = rango
+        else:
+            condiciones.append("CAST(fecha_accion AS TEXT) LIKE :fecha_prefijo")
+            params["fecha_prefijo"] = f"{_escapar_like(filtro_fecha)}%"
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return where, params
+
+
+def contar_registros(filtro_usuario="", filtro_fecha=""):
+    where, params = _filtros_registros(filtro_usuario, filtro_fecha)
+    with engine.connect() as conn:
+        return int(conn.execute(sa.text(f"SELECT COUNT(*) FROM registros {where}"), params).scalar() or 0)
+
+
+def ultimo_id_registro():
+    """MAX(id_registro): cambia con cada registro nuevo; sirve de marca para la cache de exportaciones."""
+    with engine.connect() as conn:
+        return conn.execute(sa.text("SELECT MAX(id_registro) FROM registros")).scalar()
+
+
+def consultar_registros(filtro_usuario="", filtro_fecha="", pagina=1, por_pagina=50):
+    """
+    Devuelve (registros, total) de la pagina pedida, del mas reciente al mas antiguo.
+    El texto se busca (sin distinguir mayusculas) en usuario y accion; la fecha es un prefijo.
+    """
+    where, params = _filtros_registros(filtro_usuario, filtro_fecha)
+    por_pagina = max(1, int(por_pagina))
+    with engine.connect() as conn:
+        total = int(conn.execute(sa.text(f"SELECT COUNT(*) FROM registros {where}"), params).scalar() or 0)
+        paginas = max(1, (total + por_pagina - 1) // por_pagina)
+        pagina = min(max(1, int(pagina)), paginas)
+        filas = conn.execute(
+            sa.text(f"""
+                SELECT {_COLUMNAS_REGISTRO_SQL}
+                FROM registros
+                {where}
+                ORDER BY id_registro DESC
+                LIMIT :limite OFFSET :desplazamiento
+            """),
+            {**params, "limite": por_pagina, "desplazamiento": (pagina - 1) * por_pagina},
+        ).mappings().all()
+    return [dict(fila) for fila in filas], total
+
+
+def iterar_registros(filtro_usuario="", filtro_fecha="", tamano_lote=5000):
+    """Genera lotes de registros filtrados leyendo con un cursor del servidor."""
+    where, params = _filtros_registros(filtro_usuario, filtro_fecha)
+    with engine.connect() as conn:
+        resultado = conn.execution_options(stream_results=True, yield_per=tamano_lote).execute(
+            sa.text(f"""
+                SELECT {_COLUMNAS_REGISTRO_SQL}
+                FROM registros
+                {where}
+                ORDER BY id_registro DESC
+            """),
+            params,
+        )
+        for lote in resultado.mappings().partitions():
+            yield lote
+
+
+def exportar_registros_excel(salida, filtro_usuario="", filtro_fecha="", tamano_lote=5000):
+    """
+    Escribe en `salida` un .xlsx con los registros filtrados. El libro es de solo escritura
+    (openpyxl no conserva las filas en memoria) y se alimenta lote a lote desde el cursor.
+    """
+    libro = Workbook(write_only=True)
+    columnas = ["id_registro", "id_usuario", "accion", "fecha_accion"]
+    filas = (
+        [fila[columna] for columna in columnas]
+        for lote in iterar_registros(filtro_usuario, filtro_fecha, tamano_lote=tamano_lote)
+        for fila in lote
+    )
+    escribir_hoja(libro, "Sheet1", columnas, filas, anchos={"accion": 80, "fecha_accion": 20})
+    libro.save(salida)
@@ -0,0 +1,293 @@
+"""
+Consultas del panel /admin/pedidos resueltas en PostgreSQL.
+
+Los filtros (estado, estado del ultimo pago, rango de fechas y texto), el orden y la
+paginacion se aplican en SQL; solo los pedidos de la pagina visible se enriquecen, en
+lote, con el nombre del usuario, los productos y el total del detalle. El costo de una
+pagina depende de `per_page`, no del numero total de pedidos.
+"""
+
+from datetime import timedelta
+
+import pandas as pd
+import sqlalchemy as sa
+
+from core.db_utils import engine, fecha_hora_sql
+from services import order_service
+
+# Deben coincidir con las expresiones de idx_pedidos_estado_normalizado e
+# idx_pedidos_fecha_pedido_ts (core.db_utils).
+_ESTADO_SQL = "COALESCE(NULLIF(lower(btrim(p.estado)), ''), 'confirmado')"
+_FECHA_PEDIDO_SQL = fecha_hora_sql("p.fecha_pedido")
+
+# pedidos.id_usuario guarda ids numericos o correos (ventas POS / respaldo historico).
+_NOMBRE_USUARIO_SQL = """
+    COALESCE(
+        NULLIF(btrim(u.nombre), ''),
+        CASE
+            WHEN btrim(CAST(p.id_usuario AS TEXT)) ~ '^[0-9]+$' THEN 'Usuario #' || btrim(CAST(p.id_usuario AS TEXT))
+            ELSE NULLIF(btrim(CAST(p.id_usuario AS TEXT)), '')
+        END,
+        'N/A'
+    )
+"""
+
+_ULTIMO_PAGO_SQL = """
+    LEFT JOIN LATERAL (
+        SELECT pg.monto, pg.metodo_pago, pg.fecha_pago, pg.estado_pago, pg.comprobante_url
+        FROM pagos pg
+        WHERE pg.id_pedido = p.id_pedido
+        ORDER BY pg.id_pago DESC
+        LIMIT 1
+    ) ult ON TRUE
+"""
+
+_COLUMNAS_PEDIDO_SQL = f"""
+    p.id_pedido,
+    p.id_usuario,
+    p.fecha_pedido,
+    {_ESTADO_SQL} AS estado,
+    COALESCE(p.cliente_telefono, '') AS cliente_telefono,
+    COALESCE(p.cliente_direccion, '') AS cliente_direccion,
+    COALESCE(ult.monto, 0) AS monto,
+    lower(btrim(COALESCE(ult.metodo_pago, ''))) AS metodo_pago,
+    ult.fecha_pago,
+    lower(btrim(COALESCE(ult.estado_pago, ''))) AS estado_pago,
+    btrim(COALESCE(ult.comprobante_url, '')) AS comprobante_url
+"""
+
+_TEXTO_PRODUCTO_SQL = """
+    EXISTS (
+        SELECT 1
+        FROM detalle_pedido d
+        LEFT JOIN producto pr ON pr.id_producto = d.id_producto
+        WHERE d.id_pedido = p.id_pedido
+          AND (
+              CASE
+                  WHEN pr.id_producto IS NULL AND d.id_producto IS NOT NULL THEN 'Producto #' || d.id_producto
+                  ELSE COALESCE(NULLIF(btrim(pr.nombre), ''), 'Producto sin nombre')
+              END || COALESCE(' (' || NULLIF(upper(btrim(d.talla)), '') || ')', '')
+          ) ILIKE :texto
+    )
+"""
+
+ESTADOS_INACTIVOS_UI = {"entregado", "cancelado"}
+
+
+def _escapar_like(texto):
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def estados_crudos_de(estados_ui, pedido_status_alias):
+    """Estados guardados (normalizados) que la interfaz muestra como alguno de `estados_ui`."""
+    estados_ui = set(estados_ui)
+    return sorted(estados_ui | {crudo for crudo, alias in pedido_status_alias.items() if alias in estados_ui})
+
+
+def _normalizar_filtros(filtros, pedido_status_flow, pago_status_labels):
+    filtros = dict(filtros)
+    estados_validos = {clave for clave, _ in pedido_status_flow} | {"cancelado", "pago_en_revision"}
+    if filtros.get("estado") not in estados_validos:
+        filtros["estado"] = "todos"
+    if filtros.get("estado_pago") not in set(pago_status_labels.keys()):
+        filtros["estado_pago"] = "todos"
+    for clave in ("fecha_desde", "fecha_hasta"):
+        fecha = pd.to_datetime(filtros.get(clave, ""), errors="coerce")
+        filtros[clave] = fecha.date() if pd.notna(fecha) else ""
+    return filtros
+
+
+def _condiciones_pedidos(filtros, pedido_status_alias):
+    condiciones = []
+    params = {}
+    joins = [_ULTIMO_PAGO_SQL]
+
+    if filtros["estado"] != "todos":
+        condiciones.append(f"{_ESTADO_SQL} = ANY(:estados)")
+        params["estados"] = estados_crudos_de({filtros["estado"]}, pedido_status_alias)
+    if filtros["estado_pago"] != "todos":
+        condiciones.append("lower(btrim(COALESCE(ult.estado_pago, ''))) = :estado_pago")
+        params["estado_pago"] = filtros["estado_pago"]
+    if filtros["fecha_desde"]:
+        condiciones.append(f"{_FECHA_PEDIDO_SQL} >= :fecha_desde")
+        params["fecha_desde"] = filtros["fecha_desde"]
+    if filtros["fecha_hasta"]:
+        condiciones.append(f"{_FECHA_PEDIDO_SQL} < :fecha_hasta")
+        params["fecha_hasta"] = filtros["fecha_hasta"] + timedelta(days=1)
+
+    texto = str(filtros.get("q", "") or "").strip()
+    if texto:
+        joins.append("LEFT JOIN usuarios u ON CAST(u.id_usuario AS TEXT) = CAST(p.id_usuario AS TEXT)")
+        condiciones.append(
+            f"""(
+                CAST(p.id_pedido AS TEXT) ILIKE :texto
+                OR CAST(p.fecha_pedido AS TEXT) ILIKE :texto
+                OR {_NOMBRE_USUARIO_SQL} ILIKE :texto
+                OR {_TEXTO_PRODUCTO_SQL}
+            )"""
+        )
+        params["texto"] = f"%{_escapar_like(texto)}%"
+
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return "\n".join(joins), where, params
+
+
+def _texto_valor(valor):
+    return "" if valor is None else str(valor)
+
+
+def _id_usuario_valor(valor):
+    if valor is None:
+        return ""
+    uid = pd.to_numeric(valor, errors="coerce")
+    return int(uid) if pd.notna(uid) else str(valor).strip()
+
+
+def enriquecer_pagina_pedidos(conn, filas, etiqueta_estado_pago_fn):
+    """Completa las filas de una pagina con usuario, productos y total del detalle (3 consultas en lote)."""
+    registros = [dict(fila) for fila in filas]
+    ids_pedido = [int(registro["id_pedido"]) for registro in registros]
+    if not ids_pedido:
+        return []
+
+    # Los correos guardados en id_usuario no se buscan en usuarios: resolver_nombre_usuario los muestra tal cual.
+    ids_usuario = sorted({
+        int(uid)
+        for uid in (pd.to_numeric(r.get("id_usuario"), errors="coerce") for r in registros)
+        if pd.notna(uid)
+    })
+    usuarios_map = {}
+    if ids_usuario:
+        for fila in conn.execute(
+            sa.text("SELECT id_usuario, nombre FROM usuarios WHERE id_usuario = ANY(:ids)"),
+            {"ids": ids_usuario},
+        ).mappings():
+            usuarios_map[int(fila["id_usuario"])] = str(fila["nombre"] or "").strip()
+
+    detalle = pd.DataFrame(
+        [
+            dict(fila)
+            for fila in conn.execute(
+                sa.text("""
+                    SELECT d.id_pedido, d.id_producto, d.cantidad, d.subtotal,
+                           upper(btrim(COALESCE(d.talla, ''))) AS talla
+                    FROM detalle_pedido d
+                    WHERE d.id_pedido = ANY(:ids)
+                    ORDER BY d.id_pedido, d.id_detalle
+                """),
+                {"ids": ids_pedido},
+            ).mappings()
+        ],
+        columns=["id_pedido", "id_producto", "cantidad", "subtotal", "talla"],
+    )
+    ids_producto = sorted({int(valor) for valor in detalle["id_producto"].dropna().tolist()})
+    productos_map = {}
+    if ids_producto:
+        for fila in conn.execute(
+            sa.text("SELECT id_producto, nombre FROM producto WHERE id_producto = ANY(:ids)"),
+            {"ids": ids_producto},
+        ).mappings():
+            productos_map[int(fila["id_producto"])] = str(fila["nombre"] or "").strip()
+
+    detalle["subtotal"] = pd.to_numeric(detalle["subtotal"], errors="coerce").fillna(0)
+    totales = detalle.groupby("id_pedido")["subtotal"].sum().to_dict()
+    productos_por_pedido = order_service.construir_productos_por_pedido(detalle, productos_map)
+
+    for registro in registros:
+        id_pedido = int(registro["id_pedido"])
+        id_usuario = registro.get("id_usuario")
+        registro["id_pedido"] = id_pedido
+        registro["id_usuario"] = _id_usuario_valor(id_usuario)
+        registro["fecha_pedido"] = _texto_valor(registro.get("fecha_pedido"))
+        registro["fecha_pago"] = _texto_valor(registro.get("fecha_pago"))
+        registro["monto"] = float(registro.get("monto") or 0)
+        registro["total_productos"] = float(totales.get(id_pedido, 0))
+        registro["usuario_nombre"] = order_service.resolver_nombre_usuario(registro["id_usuario"], usuarios_map)
+        registro["productos_pedido"] = productos_por_pedido.get(id_pedido, "Sin productos")
+        registro["metodo_pago_label"] = order_service.etiqueta_metodo_pago(registro["metodo_pago"])
+        registro["estado_pago_label"] = etiqueta_estado_pago_fn(registro["estado_pago"])
+    return registros
+
+
+def consultar_pedidos_admin(
+    filtros,
+    pedido_status_flow,
+    pedido_status_alias,
+    pago_status_labels,
+    etiqueta_estado_pago_fn,
+    per_page=10,
+):
+    """
+    Equivalente en SQL de construir_vista_pedidos + filtrar_y_paginar_pedidos: devuelve
+    (pedidos de la pagina, filtros normalizados, paginacion, hay_filtros_activos).
+    """
+    filtros = _normalizar_filtros(filtros, pedido_status_flow, pago_status_labels)
+    joins, where, params = _condiciones_pedidos(filtros, pedido_status_alias)
+    pagina_actual = order_service.parse_positive_int(filtros.get("page", 1), default=1)
+
+    with engine.connect() as conn:
+        total = int(conn.execute(sa.text(f"SELECT COUNT(*) FROM pedidos p {joins} {where}"), params).scalar() or 0)
+        paginacion = order_service.construir_paginacion(total, pagina_actual, per_page)
+        filas = conn.execute(
+            sa.text(f"""
+                SELECT {_COLUMNAS_PEDIDO_SQL}
+                FROM pedidos p
+                {joins}
+                {where}
+                ORDER BY p.id_pedido DESC
+                LIMIT :limite OFFSET :desplazamiento
+            """),
+            {**params, "limite": per_page, "desplazamiento": (paginacion["page"] - 1) * per_page},
+        ).mappings().all()
+        pedidos = enriquecer_pagina_pedidos(conn, filas, etiqueta_estado_pago_fn)
+
+    filtros["page"] = paginacion["page"]
+    for clave in ("fecha_desde", "fecha_hasta"):
+        filtros[clave] = filtros[clave].strftime("%Y-%m-%d") if filtros[clave] else ""
+    hay_filtros_activos = bool(
+        filtros.get("q")
+        or filtros.get("fecha_desde")
+        or filtros.get("fecha_hasta")
+        or filtros.get("estado") != "todos"
+        or filtros.get("estado_pago") != "todos"
+    )
+    return pedidos, filtros, paginacion, hay_filtros_activos
+
+
+def consultar_pedidos_en_curso(pagina_actual, pedido_status_alias, etiqueta_estado_pago_fn, per_page=6):
+    """Pagina de pedidos activos (ni entregados ni cancelados) y resumen por estado: (pedidos, paginacion, resumen)."""
+    params = {"inactivos": estados_crudos_de(ESTADOS_INACTIVOS_UI, pedido_status_alias)}
+    where = f"WHERE {_ESTADO_SQL} <> ALL(:inactivos)"
+
+    with engine.connect() as conn:
+        conteos = conn.execute(
+            sa.text(f"SELECT {_ESTADO_SQL} AS estado, COUNT(*) AS total FROM pedidos p {where} GROUP BY 1"),
+            params,
+        ).mappings().all()
+        por_estado_ui = {}
+        for fila in conteos:
+            estado_ui = order_service.estado_pedido_ui(fila["estado"], pedido_status_alias)
+            por_estado_ui[estado_ui] = por_estado_ui.get(estado_ui, 0) + int(fila["total"])
+        total = sum(por_estado_ui.values())
+
+        paginacion = order_service.construir_paginacion(total, pagina_actual, per_page)
+        filas = conn.execute(
+            sa.text(f"""
+                SELECT {_COLUMNAS_PEDIDO_SQL}
+                FROM pedidos p
+                {_ULTIMO_PAGO_SQL}
+                {where}
+                ORDER BY p.id_pedido DESC
+                LIMIT :limite OFFSET :desplazamiento
+            """),
+            {**params, "limite": per_page, "desplazamiento": (paginacion["page"] - 1) * per_page},
+        ).mappings().all()
+        pedidos = enriquecer_pagina_pedidos(conn, filas, etiqueta_estado_pago_fn)
+
+    resumen_estados = {
+        "activos": total,
+        "confirmados": por_estado_ui.get("confirmado", 0),
+        "empaquetados": por_estado_ui.get("empaquetado", 0),
+        "enviados": por_estado_ui.get("enviado", 0),
+    }
+    return pedidos, paginacion, resumen_estados
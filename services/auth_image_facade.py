@@ -46,6 +46,9 @@ def build_auth_image_legacy_bindings(
             password=password,
         )
 
+    def eliminar_registro_pendiente(email):
+        return app_auth_service.eliminar_registro_pendiente(email, pending_registrations)
+
     def password_esta_hasheado(valor):
         return app_auth_service.password_esta_hasheado(valor)
 
@@ -126,6 +129,9 @@ def build_auth_image_legacy_bindings(
     def ruta_imagen_producto_absoluta(ruta_relativa):
         return app_image_service.ruta_imagen_producto_absoluta(ruta_relativa)
 
+    def eliminar_imagen_producto(ruta_relativa):
+        return app_image_service.eliminar_imagen_producto(ruta_relativa)
+
     def listar_archivos_galeria_producto(id_producto, fuerza=""):
         return app_image_service.listar_archivos_galeria_producto(
             id_producto,
@@ -184,6 +190,7 @@ def build_auth_image_legacy_bindings(
         "limpiar_registros_pendientes": limpiar_registros_pendientes,
         "obtener_registro_pendiente": obtener_registro_pendiente,
         "guardar_registro_pendiente": guardar_registro_pendiente,
+        "eliminar_registro_pendiente": eliminar_registro_pendiente,
         "password_esta_hasheado": password_esta_hasheado,
         "crear_hash_password": crear_hash_password,
         "password_coincide": password_coincide,
@@ -202,6 +209,7 @@ def build_auth_image_legacy_bindings(
         "guardar_preview_personalizado_desde_data_url": guardar_preview_personalizado_desde_data_url,
         "guardar_documento_identidad_personalizada_desde_data_url": guardar_documento_identidad_personalizada_desde_data_url,
         "ruta_imagen_producto_absoluta": ruta_imagen_producto_absoluta,
+        "eliminar_imagen_producto": eliminar_imagen_producto,
         "listar_archivos_galeria_producto": listar_archivos_galeria_producto,
         "migrar_legacy_a_galeria": migrar_legacy_a_galeria,
         "limpiar_imagenes_producto": limpiar_imagenes_producto,
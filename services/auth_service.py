@@ -15,30 +15,27 @@ def normalizar_email(valor):
 
 
 def limpiar_registros_pendientes(pending_registrations):
-    ahora = datetime.now()
-    expirados = []
-    for email, data in pending_registrations.items():
-        expiry_at = data.get("expiry_at")
-        if not expiry_at or ahora > expiry_at:
-            expirados.append(email)
-    for email in expirados:
-        pending_registrations.pop(email, None)
+    pending_registrations.limpiar_expirados()
 
 
 def obtener_registro_pendiente(email, pending_registrations):
-    limpiar_registros_pendientes(pending_registrations)
-    return pending_registrations.get(normalizar_email(email))
+    return pending_registrations.obtener(normalizar_email(email))
 
 
 def guardar_registro_pendiente(email, codigo, pending_registrations, register_code_exp_minutes, nombre="", password=""):
-    expiry_at = datetime.now() + timedelta(minutes=register_code_exp_minutes)
-    pending_registrations[normalizar_email(email)] = {
-        "code": str(codigo).strip(),
-        "expiry_at": expiry_at,
-        "nombre": str(nombre).strip(),
-        "password": str(password),
-    }
-    return expiry_at
+    return pending_registrations.guardar(
+        normalizar_email(email),
+        {
+            "code": str(codigo).strip(),
+            "nombre": str(nombre).strip(),
+            "password": str(password),
+        },
+        register_code_exp_minutes,
+    )
+
+
+def eliminar_registro_pendiente(email, pending_registrations):
+    pending_registrations.eliminar(normalizar_email(email))
 
 
 def password_esta_hasheado(valor):
@@ -55,6 +55,13 @@ def build_cart_legacy_bindings(
             normalizar_imagen_url_fn=normalizar_imagen_url_fn,
         )
 
+    def _reservar_stock_checkout(carrito):
+        return order_service.reservar_stock_carrito(
+            carrito,
+            engine=engine,
+            sa_module=sa_module,
+        )
+
     _hash_carrito_checkout = order_service.hash_carrito_checkout
 
     def _stripe_checkout_guardar_creado(session_id, usuario_email, codigo_promo, carrito, cart_hash, total_esperado):
@@ -97,6 +104,7 @@ def build_cart_legacy_bindings(
         '_sincronizar_carrito_usuario_desde_sesion': _sincronizar_carrito_usuario_desde_sesion,
         '_obtener_carrito_sesion_usuario': _obtener_carrito_sesion_usuario,
         '_enriquecer_carrito_con_imagenes': _enriquecer_carrito_con_imagenes,
+        '_reservar_stock_checkout': _reservar_stock_checkout,
         '_hash_carrito_checkout': _hash_carrito_checkout,
         '_stripe_checkout_guardar_creado': _stripe_checkout_guardar_creado,
         '_stripe_checkout_obtener': _stripe_checkout_obtener,
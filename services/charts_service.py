@@ -0,0 +1,356 @@
+"""
+Datos del panel /admin/charts calculados en PostgreSQL.
+
+Los filtros de rango, las agregaciones por producto, mes y metodo de pago y la
+comparacion contra el periodo anterior son consultas agregadas sobre ventas_diarias
+(ver services.sales_rollup_service); el proceso web solo recibe filas del tamano del
+resultado, nunca el historial de pedidos.
+"""
+
+from datetime import datetime, timedelta
+import logging
+
+from openpyxl import Workbook
+from openpyxl.chart import BarChart, LineChart, PieChart, Reference
+from openpyxl.chart.series import DataPoint
+import sqlalchemy as sa
+
+from core.db_utils import engine
+from services.export_service import FORMATO_COP, escribir_hoja, registrar_estilo_columna
+from services.sales_rollup_service import refrescar_ventas_diarias, version_ventas_diarias
+
+logger = logging.getLogger(__name__)
+
+PERIODOS_CHARTS = {"all", "today", "week", "month", "range"}
+KPIS_VACIOS = {"total_ventas": 0, "total_pedidos": 0, "ticket_promedio": 0, "total_items": 0}
+
+_KPIS_SQL = """
+    SELECT
+        COALESCE(SUM(pedidos) FILTER (WHERE {actual}), 0) AS pedidos,
+        COALESCE(SUM(unidades) FILTER (WHERE {actual}), 0) AS unidades,
+        COALESCE(SUM(subtotal) FILTER (WHERE {actual}), 0) AS subtotal,
+        COALESCE(SUM(monto) FILTER (WHERE {actual}), 0) AS monto,
+        COALESCE(SUM(pagos) FILTER (WHERE {actual}), 0) AS pagos,
+        COALESCE(SUM(pedidos) FILTER (WHERE {anterior}), 0) AS pedidos_anterior,
+        COALESCE(SUM(unidades) FILTER (WHERE {anterior}), 0) AS unidades_anterior,
+        COALESCE(SUM(subtotal) FILTER (WHERE {anterior}), 0) AS subtotal_anterior,
+        COALESCE(SUM(monto) FILTER (WHERE {anterior}), 0) AS monto_anterior,
+        COALESCE(SUM(pagos) FILTER (WHERE {anterior}), 0) AS pagos_anterior
+    FROM ventas_diarias
+    WHERE nivel = 'dia' {rango_total}
+"""
+
+
+def resolver_rango_charts(periodo, fecha_desde_raw="", fecha_hasta_raw="", hoy=None):
+    """Traduce el periodo del formulario a (fecha_desde, fecha_hasta); None deja el extremo abierto."""
+    hoy = hoy or datetime.now().date()
+    if periodo == "today":
+        return hoy, hoy
+    if periodo == "week":
+        return hoy - timedelta(days=6), hoy
+    if periodo == "month":
+        return hoy.replace(day=1), hoy
+    if periodo != "range":
+        return None, None
+
+    fecha_desde = None
+    fecha_hasta = None
+    if fecha_desde_raw:
+        try:
+            fecha_desde = datetime.strptime(fecha_desde_raw, "%Y-%m-%d").date()
+        except ValueError:
+            fecha_desde = None
+    if fecha_hasta_raw:
+        try:
+            fecha_hasta = datetime.strptime(fecha_hasta_raw, "%Y-%m-%d").date()
+        except ValueError:
+            fecha_hasta = None
+    if fecha_desde is not None and fecha_hasta is not None and fecha_desde > fecha_hasta:
+        fecha_desde, fecha_hasta = fecha_hasta, fecha_desde
+    return fecha_desde, fecha_hasta
+
+
+def periodo_anterior(fecha_desde, fecha_hasta):
+    """Ventana de igual duracion inmediatamente anterior al rango, o (None, None) si el rango es abierto."""
+    if fecha_desde is None or fecha_hasta is None:
+        return None, None
+    dias_periodo = max(1, (fecha_hasta - fecha_desde).days + 1)
+    anterior_hasta = fecha_desde - timedelta(days=1)
+    return anterior_hasta - timedelta(days=dias_periodo - 1), anterior_hasta
+
+
+def variacion_kpi(valor_actual, valor_anterior):
+    if valor_anterior == 0:
+        if valor_actual == 0:
+            return {"trend": "flat", "texto": "0.0% vs periodo anterior"}
+        return {"trend": "up", "texto": "Nuevo vs periodo anterior"}
+
+    delta_pct = ((valor_actual - valor_anterior) / abs(valor_anterior)) * 100
+    trend = "up" if delta_pct > 0 else "down" if delta_pct < 0 else "flat"
+    return {"trend": trend, "texto": f"{delta_pct:+.1f}% vs periodo anterior"}
+
+
+def _condicion_rango(desde_param, hasta_param, params, desde, hasta):
+    condiciones = []
+    if desde is not None:
+        condiciones.append(f"dia >= :{desde_param}")
+        params[desde_param] = desde
+    if hasta is not None:
+        condiciones.append(f"dia <= :{hasta_param}")
+        params[hasta_param] = hasta
+    return " AND ".join(condiciones) or "TRUE"
+
+
+def _kpis(pedidos, unidades, subtotal, monto, pagos):
+    total_ventas = float(monto) if pagos > 0 else float(subtotal)
+    total_pedidos = int(pedidos)
+    return {
+        "total_ventas": total_ventas,
+        "total_pedidos": total_pedidos,
+        "ticket_promedio": (total_ventas / total_pedidos) if total_pedidos > 0 else 0,
+        "total_items": int(unidades),
+    }
+
+
+def consultar_kpis(conn, fecha_desde, fecha_hasta, anterior_desde=None, anterior_hasta=None):
+    """Devuelve (kpis, kpis_anterior) con una sola pasada sobre las filas diarias de ambos periodos."""
+    params = {}
+    actual = _condicion_rango("desde", "hasta", params, fecha_desde, fecha_hasta)
+    comparar = anterior_desde is not None and anterior_hasta is not None
+    anterior = _condicion_rango("anterior_desde", "anterior_hasta", params, anterior_desde, anterior_hasta) if comparar else "FALSE"
+    rango_total = ""
+    if comparar:
+        rango_total = "AND dia BETWEEN :anterior_desde AND :hasta"
+    elif actual != "TRUE":
+        rango_total = f"AND {actual}"
+    fila = conn.execute(
+        sa.text(_KPIS_SQL.format(actual=actual, anterior=anterior, rango_total=rango_total)),
+        params,
+    ).mappings().one()
+    kpis = _kpis(fila["pedidos"], fila["unidades"], fila["subtotal"], fila["monto"], fila["pagos"])
+    if not comparar:
+        return kpis, dict(KPIS_VACIOS)
+    kpis_anterior = _kpis(
+        fila["pedidos_anterior"],
+        fila["unidades_anterior"],
+        fila["subtotal_anterior"],
+        fila["monto_anterior"],
+        fila["pagos_anterior"],
+    )
+    return kpis, kpis_anterior
+
+
+def consultar_ventas_producto(conn, fecha_desde, fecha_hasta):
+    params = {}
+    rango = _condicion_rango("desde", "hasta", params, fecha_desde, fecha_hasta)
+    filas = conn.execute(
+        sa.text(f"""
+            SELECT v.id_producto,
+                   SUM(v.unidades) AS cantidad,
+                   CASE WHEN MAX(pr.id_producto) IS NULL THEN 'Producto sin nombre'
+                        ELSE COALESCE(MAX(pr.nombre), '') END AS nombre,
+                   COALESCE(MAX(pr.precio), 0) AS precio
+            FROM ventas_diarias v
+            LEFT JOIN producto pr ON pr.id_producto = v.id_producto
+            WHERE v.nivel = 'producto' AND v.id_producto IS NOT NULL AND {rango}
+            GROUP BY v.id_producto
+            ORDER BY v.id_producto
+        """),
+        params,
+    ).mappings().all()
+    return [
+        {
+            "id_producto": int(fila["id_producto"]),
+            "cantidad": int(fila["cantidad"] or 0),
+            "nombre": fila["nombre"],
+            "precio": float(fila["precio"] or 0),
+        }
+        for fila in filas
+    ]
+
+
+def consultar_ventas_mes(conn, fecha_desde, fecha_hasta):
+    params = {}
+    rango = _condicion_rango("desde", "hasta", params, fecha_desde, fecha_hasta)
+    filas = conn.execute(
+        sa.text(f"""
+            SELECT to_char(dia, 'YYYY-MM') AS mes, SUM(subtotal) AS subtotal
+            FROM ventas_diarias
+            WHERE nivel = 'producto' AND {rango}
+            GROUP BY 1
+            ORDER BY 1
+        """),
+        params,
+    ).mappings().all()
+    return [{"mes": fila["mes"], "subtotal": float(fila["subtotal"] or 0)} for fila in filas]
+
+
+def consultar_metodos_pago(conn, fecha_desde, fecha_hasta):
+    params = {}
+    rango = _condicion_rango("desde", "hasta", params, fecha_desde, fecha_hasta)
+    filas = conn.execute(
+        sa.text(f"""
+            SELECT metodo_pago, SUM(monto) AS monto
+            FROM ventas_diarias
+            WHERE nivel = 'metodo' AND btrim(metodo_pago) <> '' AND {rango}
+            GROUP BY metodo_pago
+            ORDER BY metodo_pago
+        """),
+        params,
+    ).mappings().all()
+    return [{"metodo_pago": fila["metodo_pago"], "monto": float(fila["monto"] or 0)} for fila in filas]
+
+
+def _refrescar_sin_fallar(refrescar_fn):
+    # Un fallo al recalcular no debe tumbar el panel ni la exportacion: se muestra el
+    # agregado existente y los dias siguen pendientes para el proximo intento.
+    try:
+        refrescar_fn()
+    except Exception:
+        logger.exception("No fue posible actualizar ventas_diarias; se usa el agregado existente")
+
+
+def marca_datos_charts(refrescar_fn=refrescar_ventas_diarias):
+    """Version de ventas_diarias tras aplicar los dias pendientes; cambia cuando cambian los datos de /admin/charts."""
+    _refrescar_sin_fallar(refrescar_fn)
+    return version_ventas_diarias()
+
+
+def obtener_datos_charts(periodo, fecha_desde_raw="", fecha_hasta_raw="", refrescar_fn=refrescar_ventas_diarias):
+    fecha_desde, fecha_hasta = resolver_rango_charts(periodo, fecha_desde_raw, fecha_hasta_raw)
+    anterior_desde, anterior_hasta = periodo_anterior(fecha_desde, fecha_hasta)
+
+    _refrescar_sin_fallar(refrescar_fn)
+    with engine.connect() as conn:
+        kpis, kpis_anterior = consultar_kpis(conn, fecha_desde, fecha_hasta, anterior_desde, anterior_hasta)
+        ventas_producto = consultar_ventas_producto(conn, fecha_desde, fecha_hasta)
+        ventas_mes = consultar_ventas_mes(conn, fecha_desde, fecha_hasta)
+        metodos_pago = consultar_metodos_pago(conn, fecha_desde, fecha_hasta)
+    top_productos = sorted(ventas_producto, key=lambda fila: fila["cantidad"], reverse=True)[:5]
+
+    comparacion_texto = "Sin comparacion de periodo"
+    if anterior_desde is not None:
+        comparacion_texto = (
+            f"Comparando contra {anterior_desde.strftime('%Y-%m-%d')} a " f"{anterior_hasta.strftime('%Y-%m-%d')}"
+        )
+    elif periodo == "all":
+        comparacion_texto = "Selecciona un periodo para activar comparacion"
+
+    rango_texto = "Todo el historial"
+    if fecha_desde is not None and fecha_hasta is not None:
+        rango_texto = f"{fecha_desde.strftime('%Y-%m-%d')} a {fecha_hasta.strftime('%Y-%m-%d')}"
+    elif fecha_desde is not None:
+        rango_texto = f"Desde {fecha_desde.strftime('%Y-%m-%d')}"
+    elif fecha_hasta is not None:
+        rango_texto = f"Hasta {fecha_hasta.strftime('%Y-%m-%d')}"
+
+    return {
+        "ventas_producto": ventas_producto,
+        "ventas_mes": ventas_mes,
+        "metodos_pago": metodos_pago,
+        "top_productos": top_productos,
+        "kpis": kpis,
+        "kpi_variaciones": {clave: variacion_kpi(kpis[clave], kpis_anterior[clave]) for clave in KPIS_VACIOS},
+        "filtros": {
+            "periodo": periodo if periodo in PERIODOS_CHARTS else "all",
+            "fecha_desde": fecha_desde_raw,
+            "fecha_hasta": fecha_hasta_raw,
+        },
+        "rango_texto": rango_texto,
+        "comparacion_texto": comparacion_texto,
+    }
+
+
+def _grafica(grafica, titulo, hoja, filas, col_datos, col_categorias, ancho=14, eje_x=None, eje_y=None):
+    grafica.title = titulo
+    if eje_y:
+        grafica.y_axis.title = eje_y
+    if eje_x:
+        grafica.x_axis.title = eje_x
+    grafica.add_data(Reference(hoja, min_col=col_datos, min_row=1, max_row=filas + 1), titles_from_data=True)
+    grafica.set_categories(Reference(hoja, min_col=col_categorias, min_row=2, max_row=filas + 1))
+    grafica.height = 8
+    grafica.width = ancho
+    return grafica
+
+
+def escribir_excel_charts(salida, datos, formatear_cop_fn):
+    """Escribe en `salida` el informe de /admin/charts (resumen, tablas y graficas)."""
+    libro = Workbook(write_only=True)
+    cop = registrar_estilo_columna(libro, "cop", FORMATO_COP)
+    columnas_producto = ["id_producto", "cantidad", "nombre", "precio"]
+    kpis = datos["kpis"]
+
+    escribir_hoja(
+        libro,
+        "Resumen",
+        ["metrica", "valor"],
+        [
+            ("Ventas totales", formatear_cop_fn(kpis["total_ventas"])),
+            ("Pedidos", kpis["total_pedidos"]),
+            ("Ticket promedio", formatear_cop_fn(kpis["ticket_promedio"])),
+            ("Items vendidos", kpis["total_items"]),
+            ("Rango aplicado", datos["rango_texto"]),
+            ("Comparacion", datos["comparacion_texto"]),
+        ],
+        anchos={"metrica": 18, "valor": 40},
+    )
+
+    hoja, filas = escribir_hoja(
+        libro,
+        "Ventas por producto",
+        columnas_producto,
+        ([fila[c] for c in columnas_producto] for fila in datos["ventas_producto"]),
+        anchos={"nombre": 32},
+    )
+    if filas:
+        grafica = _grafica(BarChart(), "Cantidad vendida por producto", hoja, filas, 2, 3, eje_x="Producto", eje_y="Cantidad")
+        grafica.series[0].graphicalProperties.solidFill = "1882A9"
+        hoja.add_chart(grafica, "F2")
+
+    hoja, filas = escribir_hoja(
+        libro,
+        "Ventas por mes",
+        ["mes", "subtotal"],
+        ((fila["mes"], fila["subtotal"]) for fila in datos["ventas_mes"]),
+        estilos={"subtotal": cop},
+        anchos={"subtotal": 20},
+    )
+    if filas:
+        grafica = _grafica(LineChart(), "Ventas por mes", hoja, filas, 2, 1, eje_x="Mes", eje_y="Subtotal")
+        grafica.series[0].graphicalProperties.line.solidFill = "0A2962"
+        hoja.add_chart(grafica, "D2")
+
+    hoja, filas = escribir_hoja(
+        libro,
+        "Metodos de pago",
+        ["metodo_pago", "monto"],
+        ((fila["metodo_pago"], fila["monto"]) for fila in datos["metodos_pago"]),
+        estilos={"monto": cop},
+        anchos={"metodo_pago": 20, "monto": 20},
+    )
+    if filas:
+        grafica = _grafica(PieChart(), "Distribucion por metodo de pago", hoja, filas, 2, 1, ancho=12)
+        colores = ["0A2962", "1882A9", "1ABC9C", "F1C40F", "E74C3C", "6C5CE7"]
+        puntos = []
+        for i in range(filas):
+            punto = DataPoint(idx=i)
+            punto.graphicalProperties.solidFill = colores[i % len(colores)]
+            puntos.append(punto)
+        grafica.series[0].dPt = puntos
+        hoja.add_chart(grafica, "D2")
+
+    hoja, filas = escribir_hoja(
+        libro,
+        "Top productos",
+        columnas_producto,
+        ([fila[c] for c in columnas_producto] for fila in datos["top_productos"]),
+        estilos={"precio": cop},
+        anchos={"nombre": 32, "precio": 20},
+    )
+    if filas:
+        grafica = _grafica(BarChart(), "Top productos vendidos", hoja, filas, 2, 3, eje_x="Producto", eje_y="Cantidad")
+        grafica.series[0].graphicalProperties.solidFill = "0A2962"
+        hoja.add_chart(grafica, "F2")
+
+    libro.save(salida)
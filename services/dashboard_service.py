@@ -12,21 +12,26 @@ def construir_contexto_home(
     promos,
     *,
     obtener_mejor_promocion_por_producto_fn,
-    calcular_descuento_promocion_fn,
+    evaluar_promociones_lote_fn,
     formatear_cop_fn,
     obtener_galeria_producto_fn,
 ):
     lista_productos = productos_activos.to_dict(orient="records")
     hoy = datetime.now().date()
     mejor_promo_por_producto = obtener_mejor_promocion_por_producto_fn(productos_activos, promos, hoy)
-
-    for producto in lista_productos:
-        precio_base = float(pd.to_numeric(producto.get("precio", 0), errors="coerce") or 0)
-        promo = mejor_promo_por_producto.get(int(producto.get("id_producto", 0)))
+    lote = evaluar_promociones_lote_fn(
+        [producto.get("id_producto", 0) for producto in lista_productos],
+        [producto.get("precio", 0) for producto in lista_productos],
+        [1] * len(lista_productos),
+        mejor_promo_por_producto,
+    )
+
+    for indice, producto in enumerate(lista_productos):
+        precio_base = float(lote["subtotal_bruto"][indice])
+        promo = lote["promos"][indice]
+        producto["precio_original"] = precio_base
         if promo:
-            descuento = calcular_descuento_promocion_fn(precio_base, promo)
-            producto["precio_original"] = precio_base
-            producto["precio_con_descuento"] = max(0.0, precio_base - descuento)
+            producto["precio_con_descuento"] = float(lote["subtotal"][indice])
             producto["promo_activa"] = True
             producto["promo_nombre"] = promo.get("nombre", "")
             if promo.get("tipo_descuento") == "valor_fijo":
@@ -35,7 +40,6 @@ def construir_contexto_home(
                 valor_pct = float(pd.to_numeric(promo.get("valor_descuento", 0), errors="coerce") or 0)
                 producto["promo_etiqueta"] = f"-{valor_pct:g}%"
         else:
-            producto["precio_original"] = precio_base
             producto["precio_con_descuento"] = precio_base
             producto["promo_activa"] = False
             producto["promo_nombre"] = ""
@@ -7,10 +7,28 @@ import os
 from flask import current_app, render_template
 from flask_mail import Mail, Message
 
+from services import mail_queue_service, mail_transport_service
+
 logger = logging.getLogger(__name__)
 mail = Mail()
 
 
+def _despachar_correo(msg):
+    """
+    Encola el mensaje en la cola de salida (ver mail_queue_service). Si la cola esta
+    deshabilitada o no se pudo registrar, lo envia en linea como antes.
+    """
+    if current_app.config.get('MAIL_OUTBOX_ENABLED', True):
+        try:
+            mail_queue_service.encolar_correo(msg)
+            return
+        except Exception:
+            logger.exception("No fue posible encolar el correo; se envia en linea")
+    resultado = mail_transport_service.enviar_lote([msg])[0]
+    if not resultado['ok']:
+        raise RuntimeError(resultado['error'])
+
+
 def generar_codigo_verificacion():
     """Genera un codigo de verificacion de 6 digitos."""
     return ''.join(random.choices(string.digits, k=6))
@@ -48,7 +66,7 @@ def enviar_codigo_verificacion(email, codigo, tipo='registro', minutos_expiracio
             es_registro=es_registro,
         )
 
-        mail.send(msg)
+        _despachar_correo(msg)
         return True
     except Exception:
         logger.exception("Error al enviar correo")
@@ -69,7 +87,7 @@ def enviar_recuperacion_password(email, enlace_recuperacion, minutos_expiracion=
             enlace_recuperacion=enlace_recuperacion,
             minutos_expiracion=int(minutos_expiracion),
         )
-        mail.send(msg)
+        _despachar_correo(msg)
         return True
     except Exception:
         logger.exception("Error al enviar correo de recuperación")
@@ -148,6 +166,46 @@ def _contenido_actualizacion_pedido(tipo_actualizacion, estado_pedido, estado_pa
     )
 
 
+def construir_mensaje_actualizacion_pedido(
+    email,
+    id_pedido,
+    nombre='',
+    estado_pedido='',
+    estado_pedido_label='',
+    estado_pago='',
+    estado_pago_label='',
+    tipo_actualizacion='pedido',
+    url_pedidos='',
+):
+    """Arma (sin enviar) el mensaje de cambio de estado de un pedido."""
+    proyecto = str(current_app.config.get('PROJECT_NAME', 'NACHOHERS')).strip() or 'NACHOHERS'
+    titulo, resumen, detalle = _contenido_actualizacion_pedido(
+        tipo_actualizacion,
+        estado_pedido,
+        estado_pago,
+        estado_pedido_label,
+        estado_pago_label,
+    )
+    msg = Message(
+        subject=f"Actualizacion de tu pedido #{id_pedido} - {proyecto}",
+        recipients=[email],
+    )
+    msg.html = render_template(
+        'emails/actualizacion_pedido.html',
+        proyecto=proyecto,
+        nombre=str(nombre or '').strip(),
+        id_pedido=id_pedido,
+        titulo=titulo,
+        resumen=resumen,
+        detalle=detalle,
+        estado_pedido_label=estado_pedido_label,
+        estado_pago_label=estado_pago_label,
+        tipo_actualizacion=str(tipo_actualizacion or '').strip().lower(),
+        url_pedidos=str(url_pedidos or '').strip(),
+    )
+    return msg
+
+
 def enviar_actualizacion_pedido(
     email,
     id_pedido,
@@ -161,38 +219,68 @@ def enviar_actualizacion_pedido(
 ):
     """Envia una notificacion transaccional cuando cambia el estado de un pedido."""
     try:
-        proyecto = str(current_app.config.get('PROJECT_NAME', 'NACHOHERS')).strip() or 'NACHOHERS'
-        titulo, resumen, detalle = _contenido_actualizacion_pedido(
-            tipo_actualizacion,
-            estado_pedido,
-            estado_pago,
-            estado_pedido_label,
-            estado_pago_label,
-        )
-        msg = Message(
-            subject=f"Actualizacion de tu pedido #{id_pedido} - {proyecto}",
-            recipients=[email],
-        )
-        msg.html = render_template(
-            'emails/actualizacion_pedido.html',
-            proyecto=proyecto,
-            nombre=str(nombre or '').strip(),
-            id_pedido=id_pedido,
-            titulo=titulo,
-            resumen=resumen,
-            detalle=detalle,
+        msg = construir_mensaje_actualizacion_pedido(
+            email,
+            id_pedido,
+            nombre=nombre,
+            estado_pedido=estado_pedido,
             estado_pedido_label=estado_pedido_label,
+            estado_pago=estado_pago,
             estado_pago_label=estado_pago_label,
-            tipo_actualizacion=str(tipo_actualizacion or '').strip().lower(),
-            url_pedidos=str(url_pedidos or '').strip(),
+            tipo_actualizacion=tipo_actualizacion,
+            url_pedidos=url_pedidos,
         )
-        mail.send(msg)
+        _despachar_correo(msg)
         return True
     except Exception:
         logger.exception("Error al enviar correo de actualización de pedido")
         return False
 
 
+def enviar_actualizaciones_pedido_lote(notificaciones):
+    """
+    Envia varias notificaciones de pedido de una vez. Cada notificacion es un dict con
+    los argumentos de enviar_actualizacion_pedido. Con la cola de salida activa se
+    encolan todas; si no, salen por una sola sesion SMTP. Devuelve un resultado por
+    notificacion: {'email', 'id_pedido', 'ok', 'encolado', 'error'}; `encolado` indica que
+    el correo quedo en la cola de salida y aun no se envio.
+    """
+    resultados = []
+    mensajes = []
+    for notificacion in notificaciones:
+        resultado = {
+            'email': notificacion.get('email', ''),
+            'id_pedido': notificacion.get('id_pedido'),
+            'ok': False,
+            'encolado': False,
+            'error': '',
+        }
+        resultados.append(resultado)
+        try:
+            mensajes.append((resultado, construir_mensaje_actualizacion_pedido(**notificacion)))
+        except Exception as error:
+            logger.exception("Error al preparar correo de actualización de pedido")
+            resultado['error'] = str(error)
+
+    if current_app.config.get('MAIL_OUTBOX_ENABLED', True):
+        pendientes = []
+        for resultado, msg in mensajes:
+            try:
+                mail_queue_service.encolar_correo(msg)
+                resultado['ok'] = True
+                resultado['encolado'] = True
+            except Exception:
+                logger.exception("No fue posible encolar el correo; se envia en linea")
+                pendientes.append((resultado, msg))
+        mensajes = pendientes
+
+    envios = mail_transport_service.enviar_lote([msg for _, msg in mensajes]) if mensajes else []
+    for (resultado, _), envio in zip(mensajes, envios):
+        resultado['ok'] = envio['ok']
+        resultado['error'] = envio['error']
+    return resultados
+
+
 def enviar_notificacion_transferencia_admin(
     destinatario,
     id_pedido,
@@ -236,7 +324,7 @@ def enviar_notificacion_transferencia_admin(
         with open(ruta_comprobante, 'rb') as adjunto:
             msg.attach(filename, content_type, adjunto.read())
 
-        mail.send(msg)
+        _despachar_correo(msg)
         return True
     except Exception:
         logger.exception("Error al enviar notificación de transferencia al administrador")
@@ -277,7 +365,7 @@ def enviar_notificacion_pago_personalizado_admin(
             promo_codigo=promo_codigo,
             descuento=descuento,
         )
-        mail.send(msg)
+        _despachar_correo(msg)
         return True
     except Exception:
         logger.exception("Error al enviar notificación de pago personalizado al administrador")
@@ -0,0 +1,197 @@
+"""
+Exportaciones .xlsx del panel de administracion.
+
+Los libros se escriben con openpyxl en modo de solo escritura: las filas van directo al
+archivo temporal del libro y el formato numerico se aplica por columna con un estilo con
+nombre, no celda por celda despues de cargar la hoja.
+
+`TrabajosExportacion` guarda los archivos terminados en disco con una clave derivada del
+tipo y de los filtros, asi que repetir la misma descarga dentro de `ttl_segundos` no
+vuelve a consultar la base. Las exportaciones grandes se generan en un hilo de fondo; el
+estado vive en archivos junto al resultado (`.pendiente`, `.error`), de modo que cualquier
+worker que comparta el directorio puede responder por el.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle
+from openpyxl.utils import get_column_letter
+
+logger = logging.getLogger(__name__)
+
+FORMATO_COP = '[>=1000]#,##0.00 "COP";0.00 "COP"'
+MIMETYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+_CLAVE_VALIDA = re.compile(r"^[0-9a-f]{32}$")
+
+
+def registrar_estilo_columna(libro, nombre, number_format):
+    """Registra (una vez por libro) el estilo con nombre usado por una columna."""
+    if nombre not in libro.named_styles:
+        libro.add_named_style(NamedStyle(name=nombre, number_format=number_format))
+    return nombre
+
+
+def escribir_hoja(libro, titulo, columnas, filas, estilos=None, anchos=None):
+    """
+    Agrega una hoja de solo escritura con encabezado y filas (secuencias en el orden de
+    `columnas`). `estilos` asocia nombre de columna -> estilo registrado en el libro y
+    `anchos` nombre de columna -> ancho. Devuelve la hoja y el numero de filas de datos.
+    """
+    hoja = libro.create_sheet(titulo)
+    for posicion, columna in enumerate(columnas, start=1):
+        if anchos and columna in anchos:
+            hoja.column_dimensions[get_column_letter(posicion)].width = anchos[columna]
+
+    estilos_por_posicion = [(estilos or {}).get(columna) for columna in columnas]
+    hoja.append(list(columnas))
+    total = 0
+    for fila in filas:
+        if any(estilos_por_posicion):
+            fila = list(fila)
+            for posicion, estilo in enumerate(estilos_por_posicion):
+                if estilo and fila[posicion] is not None:
+                    celda = WriteOnlyCell(hoja, value=fila[posicion])
+                    celda.style = estilo
+                    fila[posicion] = celda
+        hoja.append(fila)
+        total += 1
+    return hoja, total
+
+
+class TrabajosExportacion:
+    def __init__(self, directorio, max_workers=2, ttl_segundos=600, pendiente_max_segundos=1800):
+        self._directorio = directorio
+        self._ttl = max(0, int(ttl_segundos))
+        self._pendiente_max = max(60, int(pendiente_max_segundos))
+        self._max_workers = max(1, int(max_workers))
+        self._lock = threading.Lock()
+        self._ejecutor = None
+        self._ejecutor_pid = None
+
+    def clave(self, tipo, params):
+        texto = json.dumps({"tipo": tipo, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+    def _ruta(self, clave, extension):
+        if not _CLAVE_VALIDA.match(str(clave)):
+            raise ValueError("Clave de exportacion invalida.")
+        return os.path.join(self._directorio, f"{clave}.{extension}")
+
+    def _vigente(self, ruta, segundos):
+        try:
+            return time.time() - os.path.getmtime(ruta) <= segundos
+        except OSError:
+            return False
+
+    def _leer_meta(self, clave):
+        try:
+            with open(self._ruta(clave, "json"), encoding="utf-8") as f_meta:
+                return json.load(f_meta)
+        except (OSError, ValueError):
+            return {}
+
+    def estado(self, clave):
+        """Devuelve {'estado': 'listo'|'pendiente'|'error'|'desconocido', 'nombre', 'error'}."""
+        meta = self._leer_meta(clave)
+        resultado = {"estado": "desconocido", "nombre": meta.get("nombre", f"{clave}.xlsx"), "error": ""}
+        if self._vigente(self._ruta(clave, "xlsx"), self._ttl):
+            resultado["estado"] = "listo"
+        elif self._vigente(self._ruta(clave, "pendiente"), self._pendiente_max):
+            resultado["estado"] = "pendiente"
+        elif os.path.exists(self._ruta(clave, "error")):
+            resultado["estado"] = "error"
+            try:
+                with open(self._ruta(clave, "error"), encoding="utf-8") as f_error:
+                    resultado["error"] = f_error.read()
+            except OSError:
+                pass
+        return resultado
+
+    def ruta_archivo(self, clave):
+        ruta = self._ruta(clave, "xlsx")
+        return ruta if self._vigente(ruta, self._ttl) else None
+
+    def _generar(self, clave, generar_fn):
+        ruta_error = self._ruta(clave, "error")
+        try:
+            descriptor, temporal = tempfile.mkstemp(dir=self._directorio, prefix=".tmp_", suffix=".xlsx")
+            try:
+                with os.fdopen(descriptor, "wb") as salida:
+                    generar_fn(salida)
+                os.replace(temporal, self._ruta(clave, "xlsx"))
+            except BaseException:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+                raise
+        except Exception as exc:
+            logger.exception("No fue posible generar la exportacion %s", clave)
+            with open(ruta_error, "w", encoding="utf-8") as f_error:
+                f_error.write(str(exc) or exc.__class__.__name__)
+        finally:
+            try:
+                os.remove(self._ruta(clave, "pendiente"))
+            except OSError:
+                pass
+
+    def _preparar(self, clave, nombre):
+        os.makedirs(self._directorio, exist_ok=True)
+        self._limpiar_vencidos()
+        with open(self._ruta(clave, "json"), "w", encoding="utf-8") as f_meta:
+            json.dump({"nombre": nombre}, f_meta)
+        try:
+            os.remove(self._ruta(clave, "error"))
+        except OSError:
+            pass
+
+    def generar(self, tipo, params, nombre, generar_fn):
+        """Genera en la peticion actual (o reutiliza) la exportacion; devuelve (clave, ruta)."""
+        clave = self.clave(tipo, params)
+        ruta = self.ruta_archivo(clave)
+        if ruta:
+            return clave, ruta
+        self._preparar(clave, nombre)
+        self._generar(clave, generar_fn)
+        ruta = self.ruta_archivo(clave)
+        if not ruta:
+            raise RuntimeError(self.estado(clave)["error"] or "No fue posible generar la exportacion.")
+        return clave, ruta
+
+    def solicitar(self, tipo, params, nombre, generar_fn):
+        """Encola la exportacion en segundo plano salvo que ya este lista o en curso; devuelve la clave."""
+        clave = self.clave(tipo, params)
+        with self._lock:
+            if self.estado(clave)["estado"] in {"listo", "pendiente"}:
+                return clave
+            self._preparar(clave, nombre)
+            with open(self._ruta(clave, "pendiente"), "w", encoding="utf-8"):
+                pass
+            if self._ejecutor_pid != os.getpid():
+                # Tras un fork el pool del padre no tiene hilos en el hijo.
+                self._ejecutor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="exportacion")
+                self._ejecutor_pid = os.getpid()
+            self._ejecutor.submit(self._generar, clave, generar_fn)
+        return clave
+
+    def _limpiar_vencidos(self):
+        limite = max(self._ttl, self._pendiente_max)
+        try:
+            with os.scandir(self._directorio) as it:
+                entradas = [entrada for entrada in it if entrada.is_file()]
+        except OSError:
+            return
+        ahora = time.time()
+        for entrada in entradas:
+            try:
+                if ahora - entrada.stat().st_mtime > limite:
+                    os.remove(entrada.path)
+            except OSError:
+                continue
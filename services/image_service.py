@@ -5,15 +5,36 @@ Extrae logica de imagenes para reducir app.py.
 
 import base64
 from datetime import datetime
+import hashlib
+import json
 import os
 from pathlib import Path
 import re
 import secrets
+import threading
+import time
 import unicodedata
 
 
 PRODUCT_IMAGE_ROOT = os.path.join("static", "img", "catalogo")
 LEGACY_PRODUCT_IMAGE_ROOT = os.path.join("static", "img", "Empresa")
+GALERIA_REVALIDACION_SEGUNDOS = 2.0
+_PATRON_ARCHIVO_GALERIA = re.compile(r"^producto_(\d+)_(\d+)(?:_.*)?\.([^.]+)$", flags=re.IGNORECASE)
+
+# Indice id_producto -> imagenes de galeria por carpeta del catalogo. Cada carpeta guarda
+# su mtime: si cambia (archivos copiados a mano, otro worker) se vuelve a listar solo esa.
+_galeria_lock = threading.RLock()
+_galeria_indice = {"verificado_en": 0.0, "carpetas": {}}
+
+# Indice persistente de contenido (tamano + sha256 -> ruta) de las imagenes del catalogo.
+# El recorrido completo se hace una sola vez; despues las altas y bajas de la aplicacion
+# se aplican directo y los cambios externos se detectan por el mtime de cada carpeta.
+# Solo se vuelve a leer un archivo cuando cambian su tamano o su mtime. El indice vive en
+# cache/ (junto a recibos y exportes), fuera de static/, para no publicar las rutas y hashes.
+INDICE_HASHES_PATH = os.path.join("cache", "imagenes", "indice_hashes.json")
+_INDICE_HASHES_PUBLICO_ANTERIOR = os.path.join(PRODUCT_IMAGE_ROOT, ".indice_hashes.json")
+_hashes_lock = threading.Lock()
+_hashes_indice = {"cargado": False, "carpetas": {}, "archivos": {}, "por_hash": {}}
 
 
 def _slug_carpeta(valor):
@@ -81,7 +102,188 @@ def _leer_archivo_subido(archivo):
         return b""
 
 
+def _sha256_archivo(ruta):
+    digest = hashlib.sha256()
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(1024 * 1024), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def _leer_indice_hashes():
+    try:
+        # Versiones anteriores lo dejaban dentro de static/; se borra para que deje de servirse.
+        os.remove(_INDICE_HASHES_PUBLICO_ANTERIOR)
+    except OSError:
+        pass
+    try:
+        with open(INDICE_HASHES_PATH, "r", encoding="utf-8") as archivo:
+            datos = json.load(archivo)
+    except (OSError, ValueError):
+        return {}
+    archivos = datos.get("archivos", {}) if isinstance(datos, dict) else {}
+    return {
+        ruta: tuple(valor)
+        for ruta, valor in archivos.items()
+        if isinstance(valor, list) and len(valor) == 3
+    }
+
+
+def _escribir_indice_hashes(archivos):
+    os.makedirs(os.path.dirname(INDICE_HASHES_PATH), exist_ok=True)
+    temporal = f"{INDICE_HASHES_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump({"archivos": {ruta: list(valor) for ruta, valor in archivos.items()}}, archivo)
+        os.replace(temporal, INDICE_HASHES_PATH)
+    except OSError:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+
+
+def _ruta_relativa_static(ruta):
+    return os.path.relpath(ruta, "static").replace("\\", "/")
+
+
+def _indexar_por_hash():
+    por_hash = {}
+    for ruta, (tamano, _, sha256) in sorted(_hashes_indice["archivos"].items()):
+        por_hash.setdefault((tamano, sha256), []).append(ruta)
+    _hashes_indice["por_hash"] = por_hash
+
+
+def _quitar_carpeta_hashes(carpeta, archivos):
+    """Olvida una carpeta, sus subcarpetas y sus archivos del indice."""
+    entrada = _hashes_indice["carpetas"].pop(carpeta, None)
+    if entrada is None:
+        return
+    for subcarpeta in entrada["subcarpetas"]:
+        _quitar_carpeta_hashes(subcarpeta, archivos)
+    for ruta in entrada["archivos"]:
+        archivos.pop(ruta, None)
+
+
+def _revisar_carpeta_hashes(carpeta, previos, archivos):
+    """
+    Vuelve a listar `carpeta` solo si su mtime cambio (alta, baja o renombrado de un
+    archivo o subcarpeta) y baja a las subcarpetas. Devuelve True si hubo cambios.
+    """
+    mtime = _mtime_carpeta(carpeta)
+    entrada = _hashes_indice["carpetas"].get(carpeta)
+    if mtime is None:
+        _quitar_carpeta_hashes(carpeta, archivos)
+        return entrada is not None
+    if entrada is not None and entrada["mtime"] == mtime:
+        cambios = False
+        for subcarpeta in entrada["subcarpetas"]:
+            cambios = _revisar_carpeta_hashes(subcarpeta, previos, archivos) or cambios
+        return cambios
+
+    try:
+        entradas = list(os.scandir(carpeta))
+    except OSError:
+        return False
+    anteriores = entrada or {"archivos": (), "subcarpetas": ()}
+    nuevos_archivos = []
+    subcarpetas = []
+    cambios = entrada is None
+    for item in entradas:
+        if item.name.startswith("."):
+            continue
+        if item.is_dir(follow_symlinks=False):
+            subcarpetas.append(item.path)
+            continue
+        if not item.is_file() or _es_imagen_generada_producto(item.name):
+            continue
+        try:
+            info = item.stat()
+        except OSError:
+            continue
+        ruta = _ruta_relativa_static(item.path)
+        previo = archivos.get(ruta) or previos.get(ruta)
+        if previo is None or previo[0] != info.st_size or previo[1] != info.st_mtime_ns:
+            try:
+                previo = (info.st_size, info.st_mtime_ns, _sha256_archivo(item.path))
+            except OSError:
+                continue
+            cambios = True
+        archivos[ruta] = previo
+        nuevos_archivos.append(ruta)
+
+    for ruta in set(anteriores["archivos"]) - set(nuevos_archivos):
+        archivos.pop(ruta, None)
+        cambios = True
+    for subcarpeta in set(anteriores["subcarpetas"]) - set(subcarpetas):
+        _quitar_carpeta_hashes(subcarpeta, archivos)
+        cambios = True
+    _hashes_indice["carpetas"][carpeta] = {"mtime": mtime, "archivos": nuevos_archivos, "subcarpetas": subcarpetas}
+    for subcarpeta in subcarpetas:
+        cambios = _revisar_carpeta_hashes(subcarpeta, previos, archivos) or cambios
+    return cambios
+
+
+def _sincronizar_indice_hashes():
+    """
+    La primera vez recorre el catalogo completo (reusando los hashes del archivo .json);
+    despues solo hace un stat por carpeta y relista las que cambiaron.
+    """
+    previos = {}
+    if not _hashes_indice["cargado"]:
+        previos = _leer_indice_hashes()
+        _hashes_indice["carpetas"] = {}
+        _hashes_indice["archivos"] = {}
+    archivos = _hashes_indice["archivos"]
+    cambios = _revisar_carpeta_hashes(PRODUCT_IMAGE_ROOT, previos, archivos)
+    if not _hashes_indice["cargado"]:
+        cambios = cambios or len(archivos) != len(previos)
+        _hashes_indice["cargado"] = True
+    if cambios:
+        _escribir_indice_hashes(archivos)
+        _indexar_por_hash()
+
+
+def _actualizar_indice_hashes(carpeta, agregados=(), eliminados=()):
+    """Aplica al indice de contenido las altas/bajas hechas por la aplicacion en `carpeta`."""
+    with _hashes_lock:
+        entrada = _hashes_indice["carpetas"].get(carpeta)
+        mtime = _mtime_carpeta(carpeta)
+        if not _hashes_indice["cargado"] or entrada is None or mtime is None:
+            return
+
+        archivos = _hashes_indice["archivos"]
+        cambios = False
+        for nombre in eliminados:
+            ruta = _ruta_relativa_static(os.path.join(carpeta, os.path.basename(nombre)))
+            if archivos.pop(ruta, None) is not None:
+                cambios = True
+        for nombre in agregados:
+            nombre = os.path.basename(nombre)
+            ruta_absoluta = os.path.join(carpeta, nombre)
+            if nombre.startswith(".") or _es_imagen_generada_producto(nombre):
+                continue
+            try:
+                info = os.stat(ruta_absoluta)
+                archivos[_ruta_relativa_static(ruta_absoluta)] = (info.st_size, info.st_mtime_ns, _sha256_archivo(ruta_absoluta))
+            except OSError:
+                continue
+            cambios = True
+
+        prefijo = _ruta_relativa_static(carpeta) + "/"
+        entrada["archivos"] = [ruta for ruta in archivos if ruta.startswith(prefijo) and "/" not in ruta[len(prefijo):]]
+        entrada["mtime"] = mtime
+        if cambios:
+            _escribir_indice_hashes(archivos)
+            _indexar_por_hash()
+
+
 def buscar_imagen_catalogo_existente(archivo, allowed_image_extensions, fuerza=""):
+    """
+    Devuelve la ruta de una imagen del catalogo con el mismo contenido que `archivo`,
+    aunque tenga otro nombre, o "" si no existe. Prefiere la de igual nombre y luego
+    la de la carpeta de la fuerza.
+    """
     nombre_original = os.path.basename(str(getattr(archivo, "filename", "") or "")).strip()
     extension = extension_imagen(nombre_original)
     if not nombre_original or extension not in allowed_image_extensions:
@@ -93,29 +295,26 @@ def buscar_imagen_catalogo_existente(archivo, allowed_image_extensions, fuerza="
     if not contenido_subido:
         return ""
 
-    nombre_normalizado = nombre_original.lower()
-    for carpeta_catalogo in _carpetas_catalogo_producto(fuerza):
-        carpeta = Path(carpeta_catalogo)
-        if not carpeta.is_dir():
-            continue
+    clave = (len(contenido_subido), hashlib.sha256(contenido_subido).hexdigest())
+    with _hashes_lock:
+        _sincronizar_indice_hashes()
+        candidatas = list(_hashes_indice["por_hash"].get(clave, []))
 
-        for candidata in carpeta.rglob("*"):
-            if not candidata.is_file():
-                continue
-            if candidata.name.lower() != nombre_normalizado:
-                continue
-            if _es_imagen_generada_producto(candidata.name):
-                continue
-            if extension_imagen(candidata.name) not in allowed_image_extensions:
-                continue
-            try:
-                if candidata.read_bytes() != contenido_subido:
-                    continue
-            except OSError:
-                continue
-
-            return os.path.relpath(str(candidata), "static").replace("\\", "/")
+    candidatas = [ruta for ruta in candidatas if extension_imagen(ruta) in allowed_image_extensions]
+    if not candidatas:
+        return ""
 
+    nombre_normalizado = nombre_original.lower()
+    carpeta_fuerza = os.path.relpath(_carpeta_catalogo_fuerza(fuerza), "static").replace("\\", "/").lower() if fuerza else ""
+    candidatas.sort(
+        key=lambda ruta: (
+            ruta.rsplit("/", 1)[-1].lower() != nombre_normalizado,
+            not (carpeta_fuerza and ruta.lower().startswith(carpeta_fuerza + "/")),
+        )
+    )
+    for ruta in candidatas:
+        if os.path.isfile(os.path.join("static", ruta)):
+            return ruta
     return ""
 
 
@@ -325,24 +524,115 @@ def ruta_imagen_producto_absoluta(ruta_relativa):
     return candidata
 
 
-def listar_archivos_galeria_producto(id_producto, allowed_image_extensions, fuerza=""):
-    prefijo = f"producto_{id_producto}_"
-    resultados = []
+def eliminar_imagen_producto(ruta_relativa):
+    """Borra una imagen del catalogo y la quita de los indices de galeria y de contenido."""
+    ruta_absoluta = ruta_imagen_producto_absoluta(ruta_relativa)
+    if not ruta_absoluta or not os.path.isfile(ruta_absoluta):
+        return False
+    os.remove(ruta_absoluta)
+    ruta = str(ruta_relativa or "").strip().replace("\\", "/").lstrip("/")
+    _actualizar_indice_galeria(os.path.dirname(os.path.join("static", ruta)), eliminados=[os.path.basename(ruta)])
+    return True
 
-    for carpeta_destino in _carpetas_catalogo_producto(fuerza):
-        if not os.path.isdir(carpeta_destino):
+
+def _clave_carpeta_galeria(carpeta):
+    return os.path.abspath(carpeta).lower()
+
+
+def _mtime_carpeta(carpeta):
+    try:
+        return os.stat(carpeta).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _escanear_carpeta_galeria(carpeta):
+    por_producto = {}
+    for nombre in os.listdir(carpeta):
+        coincidencia = _PATRON_ARCHIVO_GALERIA.match(nombre)
+        if not coincidencia:
             continue
-        for nombre in os.listdir(carpeta_destino):
-            if not nombre.lower().startswith(prefijo.lower()):
-                continue
-            if extension_imagen(nombre) not in allowed_image_extensions:
-                continue
-            sufijo = nombre[len(prefijo) :]
-            posicion = sufijo.rsplit(".", 1)[0].split("_", 1)[0]
-            if not posicion.isdigit():
+        id_producto, posicion, extension = coincidencia.groups()
+        ruta_relativa = os.path.relpath(os.path.join(carpeta, nombre), "static").replace("\\", "/")
+        por_producto.setdefault(int(id_producto), []).append((int(posicion), ruta_relativa, extension.lower()))
+    return por_producto
+
+
+def _revalidar_indice_galeria(forzar=False):
+    ahora = time.monotonic()
+    if not forzar and ahora - _galeria_indice["verificado_en"] < GALERIA_REVALIDACION_SEGUNDOS:
+        return
+
+    carpetas_previas = _galeria_indice["carpetas"]
+    carpetas = {}
+    for carpeta in _carpetas_catalogo_producto():
+        mtime = _mtime_carpeta(carpeta)
+        if mtime is None:
+            continue
+        clave = _clave_carpeta_galeria(carpeta)
+        previa = carpetas_previas.get(clave)
+        if previa is not None and previa["mtime"] == mtime:
+            carpetas[clave] = previa
+            continue
+        carpetas[clave] = {"ruta": carpeta, "mtime": mtime, "por_producto": _escanear_carpeta_galeria(carpeta)}
+
+    _galeria_indice["carpetas"] = carpetas
+    _galeria_indice["verificado_en"] = ahora
+
+
+def _actualizar_indice_galeria(carpeta, agregados=(), eliminados=()):
+    """Aplica altas/bajas hechas por la aplicacion sin volver a listar la carpeta."""
+    _actualizar_indice_hashes(carpeta, agregados=agregados, eliminados=eliminados)
+    with _galeria_lock:
+        clave = _clave_carpeta_galeria(carpeta)
+        entrada = _galeria_indice["carpetas"].get(clave)
+        mtime = _mtime_carpeta(carpeta)
+        if entrada is None or mtime is None:
+            _galeria_indice["verificado_en"] = 0.0
+            return
+
+        eliminados = {os.path.basename(nombre).lower() for nombre in eliminados}
+        por_producto = {}
+        for id_producto, imagenes in entrada["por_producto"].items():
+            vigentes = [img for img in imagenes if os.path.basename(img[1]).lower() not in eliminados]
+            if vigentes:
+                por_producto[id_producto] = vigentes
+        for nombre in agregados:
+            coincidencia = _PATRON_ARCHIVO_GALERIA.match(os.path.basename(nombre))
+            if not coincidencia:
                 continue
-            ruta_relativa = os.path.relpath(os.path.join(carpeta_destino, nombre), "static").replace("\\", "/")
-            resultados.append((int(posicion), ruta_relativa))
+            id_producto, posicion, extension = coincidencia.groups()
+            ruta_relativa = os.path.relpath(os.path.join(carpeta, os.path.basename(nombre)), "static").replace("\\", "/")
+            por_producto.setdefault(int(id_producto), []).append((int(posicion), ruta_relativa, extension.lower()))
+
+        _galeria_indice["carpetas"][clave] = {"ruta": entrada["ruta"], "mtime": mtime, "por_producto": por_producto}
+
+
+def construir_indice_galeria():
+    """Lista una vez todas las carpetas del catalogo; se llama al iniciar la aplicacion."""
+    with _galeria_lock:
+        _revalidar_indice_galeria(forzar=True)
+
+
+def listar_archivos_galeria_producto(id_producto, allowed_image_extensions, fuerza=""):
+    try:
+        id_producto_int = int(id_producto)
+    except (TypeError, ValueError):
+        return []
+
+    with _galeria_lock:
+        _revalidar_indice_galeria()
+        carpetas = list(_galeria_indice["carpetas"].values())
+
+    if fuerza:
+        clave_fuerza = _clave_carpeta_galeria(_carpeta_catalogo_fuerza(fuerza))
+        carpetas.sort(key=lambda entrada: _clave_carpeta_galeria(entrada["ruta"]) != clave_fuerza)
+
+    resultados = []
+    for entrada in carpetas:
+        for posicion, ruta_relativa, extension in entrada["por_producto"].get(id_producto_int, []):
+            if extension in allowed_image_extensions:
+                resultados.append((posicion, ruta_relativa))
 
     resultados.sort(key=lambda item: item[0])
     return resultados
@@ -366,6 +656,7 @@ def migrar_legacy_a_galeria(id_producto, allowed_image_extensions, fuerza=""):
         nuevo_nombre = f"producto_{id_producto}_1.{extension}"
         nuevo_path = os.path.join(carpeta_destino, nuevo_nombre)
         os.replace(legacy_path, nuevo_path)
+        _actualizar_indice_galeria(carpeta_destino, agregados=[nuevo_nombre])
         break
 
 
@@ -375,6 +666,7 @@ def limpiar_imagenes_producto(id_producto, allowed_image_extensions, fuerza=""):
     for carpeta_destino in _carpetas_catalogo_producto(fuerza, incluir_legacy=True):
         if not os.path.isdir(carpeta_destino):
             continue
+        eliminados = []
         for nombre in os.listdir(carpeta_destino):
             nombre_lower = nombre.lower()
             if not (nombre_lower.startswith(prefijo_galeria) or nombre_lower.startswith(prefijo_legacy)):
@@ -384,6 +676,9 @@ def limpiar_imagenes_producto(id_producto, allowed_image_extensions, fuerza=""):
             ruta = os.path.join(carpeta_destino, nombre)
             if os.path.isfile(ruta):
                 os.remove(ruta)
+                eliminados.append(nombre)
+        if eliminados:
+            _actualizar_indice_galeria(carpeta_destino, eliminados=eliminados)
 
 
 def guardar_galeria_producto(id_producto, imagenes, allowed_image_extensions, reemplazar=True, fuerza="", intendencia=""):
@@ -412,6 +707,8 @@ def guardar_galeria_producto(id_producto, imagenes, allowed_image_extensions, re
         imagen.save(ruta_absoluta)
         ruta_relativa = os.path.relpath(ruta_absoluta, "static").replace("\\", "/")
         rutas_guardadas.append(ruta_relativa)
+    if rutas_guardadas:
+        _actualizar_indice_galeria(carpeta_destino, agregados=[os.path.basename(ruta) for ruta in rutas_guardadas])
     return rutas_guardadas
 
 
@@ -0,0 +1,202 @@
+"""
+Cola de salida de correos respaldada en PostgreSQL (tabla correo_saliente).
+Las rutas encolan el mensaje y responden de inmediato; hilos en segundo plano lo
+envian reutilizando conexiones SMTP persistentes y reintentan con espera exponencial.
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+
+import sqlalchemy as sa
+from flask import current_app
+from flask_mail import Message
+
+from core.db_utils import engine
+from services import mail_transport_service
+
+logger = logging.getLogger(__name__)
+
+LOTE_ENVIO = 20
+ESPERA_BASE_SEGUNDOS = 30
+ESPERA_MAXIMA_SEGUNDOS = 3600
+BLOQUEO_ENVIO_SEGUNDOS = 300
+INTERVALO_SONDEO_SEGUNDOS = 15
+
+_hilos_lock = threading.Lock()
+_hilos = {"pid": None, "hilos": []}
+_despertar = threading.Event()
+
+
+def _serializar_adjuntos(msg):
+    return json.dumps(
+        [
+            {
+                "filename": adjunto.filename,
+                "content_type": adjunto.content_type,
+                "data": base64.b64encode(adjunto.data or b"").decode("ascii"),
+            }
+            for adjunto in msg.attachments
+        ]
+    )
+
+
+def encolar_correo(msg):
+    """Guarda el mensaje en la cola de salida, despierta a los hilos de envio y devuelve su id."""
+    with engine.begin() as conn:
+        id_correo = conn.execute(
+            sa.text("""
+                INSERT INTO correo_saliente (destinatarios, remitente, asunto, html, cuerpo, adjuntos_json)
+                VALUES (:destinatarios, :remitente, :asunto, :html, :cuerpo, :adjuntos_json)
+                RETURNING id_correo
+            """),
+            {
+                "destinatarios": json.dumps(list(msg.recipients or [])),
+                "remitente": json.dumps(msg.sender) if msg.sender else None,
+                "asunto": msg.subject or "",
+                "html": msg.html,
+                "cuerpo": msg.body,
+                "adjuntos_json": _serializar_adjuntos(msg),
+            },
+        ).scalar_one()
+
+    iniciar_envio_correos(current_app._get_current_object())
+    _despertar.set()
+    return int(id_correo)
+
+
+def _mensaje_desde_fila(fila):
+    remitente = json.loads(fila["remitente"]) if fila["remitente"] else None
+    msg = Message(
+        subject=fila["asunto"],
+        recipients=json.loads(fila["destinatarios"] or "[]"),
+        sender=tuple(remitente) if isinstance(remitente, list) else remitente,
+        html=fila["html"],
+        body=fila["cuerpo"],
+    )
+    for adjunto in json.loads(fila["adjuntos_json"] or "[]"):
+        msg.attach(adjunto["filename"], adjunto["content_type"], base64.b64decode(adjunto["data"]))
+    return msg
+
+
+def _reclamar_lote(limite):
+    """Toma hasta `limite` correos listos; SKIP LOCKED evita que dos hilos o workers envien el mismo."""
+    with engine.begin() as conn:
+        return conn.execute(
+            sa.text("""
+                UPDATE correo_saliente
+                SET estado = 'enviando',
+                    intentos = intentos + 1,
+                    bloqueado_hasta = NOW() + make_interval(secs => :bloqueo)
+                WHERE id_correo IN (
+                    SELECT id_correo
+                    FROM correo_saliente
+                    WHERE (estado = 'pendiente' AND proximo_intento <= NOW())
+                       OR (estado = 'enviando' AND bloqueado_hasta < NOW())
+                    ORDER BY id_correo
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT :limite
+                )
+                RETURNING id_correo, destinatarios, remitente, asunto, html, cuerpo, adjuntos_json, intentos
+            """),
+            {"limite": int(limite), "bloqueo": BLOQUEO_ENVIO_SEGUNDOS},
+        ).mappings().all()
+
+
+def _marcar_enviado(id_correo):
+    with engine.begin() as conn:
+        conn.execute(
+            sa.text("""
+                UPDATE correo_saliente
+                SET estado = 'enviado', enviado_en = NOW(), bloqueado_hasta = NULL, ultimo_error = NULL
+                WHERE id_correo = :id_correo
+            """),
+            {"id_correo": int(id_correo)},
+        )
+
+
+def _registrar_fallo(fila, error, max_intentos):
+    intentos = int(fila["intentos"] or 0)
+    agotado = intentos >= max_intentos
+    espera = min(ESPERA_MAXIMA_SEGUNDOS, ESPERA_BASE_SEGUNDOS * 2 ** max(0, intentos - 1))
+    with engine.begin() as conn:
+        conn.execute(
+            sa.text("""
+                UPDATE correo_saliente
+                SET estado = :estado,
+                    proximo_intento = NOW() + make_interval(secs => :espera),
+                    bloqueado_hasta = NULL,
+                    ultimo_error = :error
+                WHERE id_correo = :id_correo
+            """),
+            {
+                "estado": "fallido" if agotado else "pendiente",
+                "espera": espera,
+                "error": str(error)[:1000],
+                "id_correo": int(fila["id_correo"]),
+            },
+        )
+    if agotado:
+        logger.error("Correo %s descartado tras %s intentos: %s", fila["id_correo"], intentos, error)
+
+
+def procesar_cola_correos(app, limite=LOTE_ENVIO):
+    """
+    Envia un lote de la cola sobre una sesion SMTP del pool (ver mail_transport_service).
+    Se puede invocar directamente (por ejemplo en pruebas contra un SMTP local) sin
+    iniciar los hilos.
+    """
+    resumen = {"procesados": 0, "enviados": 0, "fallidos": 0}
+    filas = _reclamar_lote(limite)
+    if not filas:
+        return resumen
+
+    resumen["procesados"] = len(filas)
+    with app.app_context():
+        max_intentos = int(app.config.get("MAIL_OUTBOX_MAX_INTENTOS", 5))
+        mensajes = []
+        for fila in filas:
+            try:
+                mensajes.append((fila, _mensaje_desde_fila(fila)))
+            except Exception as error:
+                _registrar_fallo(fila, error, max_intentos)
+                resumen["fallidos"] += 1
+
+        resultados = mail_transport_service.enviar_lote([msg for _, msg in mensajes], app=app)
+        for (fila, _), resultado in zip(mensajes, resultados):
+            if resultado["ok"]:
+                _marcar_enviado(fila["id_correo"])
+                resumen["enviados"] += 1
+            else:
+                _registrar_fallo(fila, resultado["error"], max_intentos)
+                resumen["fallidos"] += 1
+    return resumen
+
+
+def _bucle_envio(app):
+    while True:
+        try:
+            while procesar_cola_correos(app)["procesados"]:
+                pass
+        except Exception:
+            logger.exception("Error procesando la cola de correos")
+        _despertar.wait(INTERVALO_SONDEO_SEGUNDOS)
+        _despertar.clear()
+
+
+def iniciar_envio_correos(app):
+    """Arranca (una vez por proceso) los hilos que vacian la cola de salida."""
+    with _hilos_lock:
+        if _hilos["pid"] == os.getpid():
+            return
+        cantidad = max(1, int(app.config.get("MAIL_OUTBOX_WORKERS", 1)))
+        hilos = [
+            threading.Thread(target=_bucle_envio, args=(app,), name=f"correo-saliente-{indice}", daemon=True)
+            for indice in range(cantidad)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        _hilos["pid"] = os.getpid()
+        _hilos["hilos"] = hilos
@@ -75,9 +75,77 @@ def notificar_actualizacion_pedido_cliente(
     return "enviado" if ok else "fallo"
 
 
-def flash_resultado_notificacion_pedido(resultado, id_pedido):
+def notificar_actualizaciones_pedidos_clientes(
+    actualizaciones,
+    obtener_contacto_notificacion_pedido_fn,
+    normalizar_email,
+    email_es_valido,
+    enviar_actualizaciones_pedido_lote,
+    etiqueta_estado_pedido,
+    etiqueta_estado_pago,
+):
+    """
+    Variante por lotes de notificar_actualizacion_pedido_cliente. Cada actualizacion es un
+    dict con id_pedido, id_usuario y opcionalmente estado_pedido, estado_pago y
+    tipo_actualizacion. Devuelve {id_pedido: "enviado" | "encolado" | "fallo" | "sin_email"};
+    "encolado" indica que el correo quedo en la cola de salida y aun no se envio.
+    """
+    resultados = {}
+    notificaciones = []
+    url_pedidos = url_for("user_orders", _external=True)
+    for actualizacion in actualizaciones:
+        id_pedido = actualizacion.get("id_pedido")
+        contacto = obtener_contacto_notificacion_pedido_fn(actualizacion.get("id_usuario"))
+        email = normalizar_email(contacto.get("email", ""))
+        if not email_es_valido(email):
+            resultados[id_pedido] = "sin_email"
+            continue
+        estado_pedido = actualizacion.get("estado_pedido", "")
+        estado_pago = actualizacion.get("estado_pago", "")
+        notificaciones.append(
+            {
+                "email": email,
+                "id_pedido": id_pedido,
+                "nombre": contacto.get("nombre", ""),
+                "estado_pedido": estado_pedido,
+                "estado_pedido_label": etiqueta_estado_pedido(estado_pedido),
+                "estado_pago": estado_pago,
+                "estado_pago_label": etiqueta_estado_pago(estado_pago),
+                "tipo_actualizacion": actualizacion.get("tipo_actualizacion", "pedido"),
+                "url_pedidos": url_pedidos,
+            }
+        )
+
+    for envio in enviar_actualizaciones_pedido_lote(notificaciones) if notificaciones else []:
+        if not envio["ok"]:
+            resultados[envio["id_pedido"]] = "fallo"
+        else:
+            resultados[envio["id_pedido"]] = "encolado" if envio.get("encolado") else "enviado"
+    return resultados
+
+
+def flash_resultado_notificacion_pedido(resultado, id_pedido=None):
+    if isinstance(resultado, dict):
+        enviados = [pedido for pedido, estado in resultado.items() if estado == "enviado"]
+        encolados = [pedido for pedido, estado in resultado.items() if estado == "encolado"]
+        fallidos = [pedido for pedido, estado in resultado.items() if estado == "fallo"]
+        sin_email = [pedido for pedido, estado in resultado.items() if estado == "sin_email"]
+        if enviados:
+            flash(f"Se notifico por correo a los clientes de {len(enviados)} pedido(s).", "success")
+        if encolados:
+            flash(f"Se programo el correo a los clientes de {len(encolados)} pedido(s); se enviara en breve.", "success")
+        if fallidos:
+            listado = ", ".join(f"#{pedido}" for pedido in fallidos)
+            flash(f"No se pudo enviar el correo de los pedidos {listado}.", "warning")
+        if sin_email:
+            listado = ", ".join(f"#{pedido}" for pedido in sin_email)
+            flash(f"No se encontro un correo valido para notificar los pedidos {listado}.", "warning")
+        return
+
     if resultado == "enviado":
         flash(f"Se notifico al cliente por correo sobre el pedido #{id_pedido}.", "success")
+    elif resultado == "encolado":
+        flash(f"Se programo el correo al cliente sobre el pedido #{id_pedido}; se enviara en breve.", "success")
     elif resultado == "fallo":
         flash(f"El pedido #{id_pedido} fue actualizado, pero no se pudo enviar el correo al cliente.", "warning")
     elif resultado == "sin_email":
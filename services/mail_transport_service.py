@@ -0,0 +1,115 @@
+"""
+Transporte SMTP con conexiones persistentes y envio por lotes.
+Las sesiones de Flask-Mail ya autenticadas se guardan en un pool y se reutilizan entre
+mensajes y entre lotes, de modo que N correos pagan un solo handshake TLS + AUTH.
+"""
+
+import logging
+import os
+import queue
+import smtplib
+import time
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SEGUNDOS = 60
+
+_pool = queue.LifoQueue()
+
+
+def _abrir_conexion(app):
+    conexion = app.extensions["mail"].connect()
+    conexion.__enter__()
+    return {"conexion": conexion, "usada_en": time.monotonic(), "pid": os.getpid()}
+
+
+def _cerrar_conexion(entrada):
+    try:
+        entrada["conexion"].__exit__(None, None, None)
+    except Exception:
+        pass
+
+
+def _conexion_vigente(entrada, app):
+    if entrada["pid"] != os.getpid():
+        return False
+    keepalive = float(app.config.get("MAIL_SMTP_KEEPALIVE_SEGUNDOS", KEEPALIVE_SEGUNDOS))
+    if time.monotonic() - entrada["usada_en"] > keepalive:
+        return False
+    host = entrada["conexion"].host
+    if host is None:
+        return True
+    try:
+        return host.noop()[0] == 250
+    except Exception:
+        return False
+
+
+def _tomar_conexion(app):
+    while True:
+        try:
+            entrada = _pool.get_nowait()
+        except queue.Empty:
+            return _abrir_conexion(app)
+        if _conexion_vigente(entrada, app):
+            return entrada
+        if entrada["pid"] == os.getpid():
+            _cerrar_conexion(entrada)
+
+
+def _devolver_conexion(entrada, app):
+    entrada["usada_en"] = time.monotonic()
+    if _pool.qsize() < max(1, int(app.config.get("MAIL_SMTP_POOL_SIZE", 2))):
+        _pool.put(entrada)
+    else:
+        _cerrar_conexion(entrada)
+
+
+def enviar_lote(mensajes, app=None):
+    """
+    Envia los mensajes sobre una sola sesion SMTP del pool y devuelve un resultado por
+    mensaje: {'destinatarios': [...], 'ok': bool, 'error': str}. Si el servidor corta la
+    sesion se reconecta una vez y sigue con el resto; un error de un destinatario no
+    afecta a los demas.
+    """
+    app = app or current_app._get_current_object()
+    resultados = []
+    entrada = None
+    error_conexion = None
+    try:
+        with app.app_context():
+            for msg in mensajes:
+                resultado = {"destinatarios": list(msg.recipients or []), "ok": False, "error": ""}
+                resultados.append(resultado)
+                if error_conexion is not None:
+                    resultado["error"] = error_conexion
+                    continue
+
+                for _ in range(2):
+                    try:
+                        if entrada is None:
+                            entrada = _tomar_conexion(app)
+                    except Exception as error:
+                        logger.warning("No fue posible conectar con el servidor SMTP: %s", error)
+                        error_conexion = resultado["error"] = str(error)
+                        break
+                    try:
+                        entrada["conexion"].send(msg)
+                    except (smtplib.SMTPServerDisconnected, ConnectionError) as error:
+                        _cerrar_conexion(entrada)
+                        entrada = None
+                        resultado["error"] = str(error)
+                        continue
+                    except Exception as error:
+                        logger.warning("Fallo el envio a %s: %s", resultado["destinatarios"], error)
+                        resultado["error"] = str(error)
+                        break
+                    resultado["ok"] = True
+                    resultado["error"] = ""
+                    break
+    finally:
+        if entrada is not None:
+            _devolver_conexion(entrada, app)
+    return resultados
@@ -13,6 +13,17 @@ import pandas as pd
 from flask import flash, redirect, session, url_for
 
 
+def anexar_filas_df(df, filas):
+    """
+    Agrega filas (lista de dicts) a un DataFrame conservando df.attrs, donde viaja la
+    copia cargada que guardar_*_df usa como base; pd.concat la descarta al mezclar
+    un DataFrame sin attrs.
+    """
+    resultado = pd.concat([df, pd.DataFrame(filas)], ignore_index=True)
+    resultado.attrs = dict(df.attrs)
+    return resultado
+
+
 def asegurar_columnas_descuento_pagos(pagos):
     if "comprobante_url" not in pagos.columns:
         pagos["comprobante_url"] = ""
@@ -40,12 +51,10 @@ def resolver_promocion_checkout(codigo_promo, promos, total, buscar_promocion_po
     id_producto_promo = pd.to_numeric(promo_aplicada.get("id_producto"), errors="coerce")
     subtotal_aplicable = 0.0
     if carrito is not None and pd.notna(id_producto_promo):
-        id_producto_promo = int(id_producto_promo)
-        for item in carrito if isinstance(carrito, list) else []:
-            item_id = pd.to_numeric(item.get("id_producto", 0), errors="coerce")
-            if pd.isna(item_id) or int(item_id) != id_producto_promo:
-                continue
-            subtotal_aplicable += float(pd.to_numeric(item.get("subtotal", 0), errors="coerce") or 0)
+        lineas = pd.DataFrame(carrito if isinstance(carrito, list) else [], columns=["id_producto", "subtotal"])
+        ids_linea = pd.to_numeric(lineas["id_producto"], errors="coerce")
+        subtotales = pd.to_numeric(lineas["subtotal"], errors="coerce").fillna(0.0)
+        subtotal_aplicable = float(subtotales[ids_linea == int(id_producto_promo)].sum())
     else:
         subtotal_aplicable = float(total)
 
@@ -61,7 +70,7 @@ def aplicar_promociones_carrito(
     productos,
     promos,
     obtener_mejor_promocion_por_producto_fn,
-    calcular_descuento_promocion_fn,
+    evaluar_promociones_lote_fn,
     buscar_promocion_por_codigo_fn,
     codigo_promo="",
 ):
@@ -82,17 +91,15 @@ def aplicar_promociones_carrito(
             return carrito_base, sum(float(pd.to_numeric(i.get("subtotal", 0), errors="coerce") or 0) for i in carrito_base), 0.0, None, 0.0, ("El codigo promocional no es valido o no esta vigente.", "warning")
 
     mejor_auto = obtener_mejor_promocion_por_producto_fn(productos_ref, promos_ref, hoy)
-    total_bruto = 0.0
-    total_descuento = 0.0
-    promo_codigo_aplico = False
-    carrito_actualizado = []
+    catalogo = productos_ref.dropna(subset=["id_producto"]).drop_duplicates(subset=["id_producto"], keep="first")
+    precios_catalogo = dict(zip(catalogo["id_producto"].astype(int), catalogo["precio"].astype(float)))
 
-    for item in carrito_base:
-        item_final = dict(item) if isinstance(item, dict) else {}
+    items = [dict(item) if isinstance(item, dict) else {} for item in carrito_base]
+    posiciones_catalogo, ids, precios, cantidades = [], [], [], []
+    total_bruto = 0.0
+    for posicion, item_final in enumerate(items):
         cantidad_raw = pd.to_numeric(item_final.get("cantidad", 1), errors="coerce")
         cantidad = max(1, int(cantidad_raw) if pd.notna(cantidad_raw) else 1)
-        id_producto_raw = pd.to_numeric(item_final.get("id_producto", 0), errors="coerce")
-        id_producto = int(id_producto_raw) if pd.notna(id_producto_raw) else 0
 
         if item_final.get("personalizado"):
             precio_raw = pd.to_numeric(item_final.get("precio", 0), errors="coerce")
@@ -103,30 +110,29 @@ def aplicar_promociones_carrito(
             item_final["subtotal"] = subtotal_bruto
             item_final["subtotal_bruto"] = subtotal_bruto
             item_final["monto_descuento"] = 0.0
-            carrito_actualizado.append(item_final)
             total_bruto += subtotal_bruto
             continue
 
-        fila = productos_ref[productos_ref["id_producto"] == id_producto]
-        precio_unitario = float(fila.iloc[0]["precio"]) if not fila.empty else float(pd.to_numeric(item_final.get("precio", 0), errors="coerce") or 0)
-        subtotal_bruto = precio_unitario * cantidad
-
-        promo = mejor_auto.get(id_producto)
-        if promo_codigo is not None:
-            id_producto_codigo_raw = pd.to_numeric(promo_codigo.get("id_producto", 0), errors="coerce")
-            id_producto_codigo = int(id_producto_codigo_raw) if pd.notna(id_producto_codigo_raw) else 0
-            if id_producto_codigo == id_producto:
-                promo = promo_codigo
-                promo_codigo_aplico = True
-
-        descuento_unitario = calcular_descuento_promocion_fn(precio_unitario, promo) if promo else 0.0
-        subtotal_descuento = min(subtotal_bruto, descuento_unitario * cantidad)
-        subtotal_final = max(0.0, subtotal_bruto - subtotal_descuento)
-
-        item_final["precio"] = precio_unitario
-        item_final["subtotal"] = subtotal_final
-        item_final["subtotal_bruto"] = subtotal_bruto
-        item_final["monto_descuento"] = subtotal_descuento
+        id_producto_raw = pd.to_numeric(item_final.get("id_producto", 0), errors="coerce")
+        id_producto = int(id_producto_raw) if pd.notna(id_producto_raw) else 0
+        if id_producto in precios_catalogo:
+            precio_unitario = float(precios_catalogo[id_producto])
+        else:
+            precio_unitario = float(pd.to_numeric(item_final.get("precio", 0), errors="coerce") or 0)
+        posiciones_catalogo.append(posicion)
+        ids.append(id_producto)
+        precios.append(precio_unitario)
+        cantidades.append(cantidad)
+
+    lote = evaluar_promociones_lote_fn(ids, precios, cantidades, mejor_auto, promo_codigo)
+
+    for indice, posicion in enumerate(posiciones_catalogo):
+        item_final = items[posicion]
+        promo = lote["promos"][indice]
+        item_final["precio"] = precios[indice]
+        item_final["subtotal"] = float(lote["subtotal"][indice])
+        item_final["subtotal_bruto"] = float(lote["subtotal_bruto"][indice])
+        item_final["monto_descuento"] = float(lote["descuento"][indice])
         item_final["promo_id"] = promo.get("id_promo", "") if promo else ""
         item_final["promo_codigo"] = promo.get("codigo", "") if promo else ""
         item_final["promo_nombre"] = promo.get("nombre", "") if promo else ""
@@ -134,15 +140,14 @@ def aplicar_promociones_carrito(
         item_final["promo_valor_descuento"] = float(pd.to_numeric(promo.get("valor_descuento", 0), errors="coerce") or 0) if promo else 0.0
         item_final["promo_fecha_fin"] = str(promo.get("fecha_fin", "") or "") if promo else ""
 
-        carrito_actualizado.append(item_final)
-        total_bruto += subtotal_bruto
-        total_descuento += subtotal_descuento
+    total_bruto += lote["total_bruto"]
+    total_descuento = lote["total_descuento"]
 
-    if promo_codigo is not None and not promo_codigo_aplico:
+    if promo_codigo is not None and not lote["aplico_codigo"]:
         return carrito_base, total_bruto, 0.0, None, 0.0, ("El codigo promocional no aplica a los productos de tu carrito.", "warning")
 
     total_final = max(0.0, total_bruto - total_descuento)
-    return carrito_actualizado, total_final, total_descuento, promo_codigo, total_bruto, None
+    return items, total_final, total_descuento, promo_codigo, total_bruto, None
 
 
 def obtener_contacto_checkout_predeterminado(normalizar_email, cargar_usuarios_df):
@@ -209,6 +214,14 @@ def guardar_contacto_checkout_usuario(telefono, direccion, normalizar_email, car
     guardar_usuarios_df(usuarios)
 
 
+def mensaje_stock_faltante(motivo, nombre, disponible=0):
+    if motivo == "no_disponible":
+        return f'El producto "{nombre}" ya no esta disponible o fue retirado del catalogo.'
+    if motivo == "agotado":
+        return f'El producto "{nombre}" esta agotado y no se puede procesar el pedido.'
+    return f'Stock insuficiente para "{nombre}". Disponible: {disponible}. Ajusta la cantidad para continuar.'
+
+
 def validar_stock_checkout(productos, carrito):
     for item in carrito:
         if item.get("personalizado"):
@@ -217,20 +230,14 @@ def validar_stock_checkout(productos, carrito):
         cantidad = int(item.get("cantidad", 0))
         fila = productos[(productos["id_producto"] == id_producto) & (productos["eliminado"] == False)]
         if fila.empty:
-            return (
-                f'El producto "{item.get("nombre", id_producto)}" ya no esta disponible o fue retirado del catalogo.',
-                "warning",
-            )
+            return (mensaje_stock_faltante("no_disponible", item.get("nombre", id_producto)), "warning")
         stock_actual = int(fila.iloc[0].get("stock", 0))
         if stock_actual <= 0:
             nombre = str(fila.iloc[0].get("nombre", item.get("nombre", id_producto)))
-            return (f'El producto "{nombre}" esta agotado y no se puede procesar el pedido.', "warning")
+            return (mensaje_stock_faltante("agotado", nombre), "warning")
         if cantidad > stock_actual:
             nombre = str(fila.iloc[0].get("nombre", item.get("nombre", id_producto)))
-            return (
-                f'Stock insuficiente para "{nombre}". Disponible: {stock_actual}. Ajusta la cantidad para continuar.',
-                "warning",
-            )
+            return (mensaje_stock_faltante("insuficiente", nombre, stock_actual), "warning")
     return None
 
 
@@ -250,47 +257,152 @@ def descontar_stock_checkout(productos, carrito):
     return agotados_en_compra
 
 
+def cantidades_stock_por_producto(carrito):
+    """Agrupa las cantidades del carrito por producto (varias tallas descuentan del mismo stock)."""
+    cantidades = {}
+    nombres = {}
+    for item in carrito or []:
+        if item.get("personalizado"):
+            continue
+        id_producto = pd.to_numeric(item.get("id_producto"), errors="coerce")
+        cantidad = pd.to_numeric(item.get("cantidad"), errors="coerce")
+        if pd.isna(id_producto) or pd.isna(cantidad) or int(cantidad) <= 0:
+            continue
+        id_producto = int(id_producto)
+        cantidades[id_producto] = cantidades.get(id_producto, 0) + int(cantidad)
+        nombres.setdefault(id_producto, item.get("nombre", id_producto))
+    return cantidades, nombres
+
+
+def descontar_stock_en_conexion(conn, carrito, sa_module):
+    """
+    Descuenta el stock del carrito con un unico UPDATE condicional (stock >= cantidad).
+    Debe ejecutarse dentro de una transaccion abierta: si hay faltantes el llamador hace rollback.
+    Devuelve (agotados_en_compra, faltantes), donde cada faltante es
+    {id_producto, nombre, solicitado, disponible, motivo}.
+    """
+    cantidades, nombres = cantidades_stock_por_producto(carrito)
+    if not cantidades:
+        return [], []
+
+    ids = sorted(cantidades)
+    filas = conn.execute(
+        sa_module.text(
+            """
+            UPDATE producto AS p
+            SET stock = p.stock - v.cantidad
+            FROM UNNEST(CAST(:ids AS BIGINT[]), CAST(:cantidades AS INT[])) AS v(id_producto, cantidad)
+            WHERE p.id_producto = v.id_producto
+              AND COALESCE(p.eliminado, FALSE) = FALSE
+              AND COALESCE(p.stock, 0) >= v.cantidad
+            RETURNING p.id_producto, p.nombre, p.stock, v.cantidad
+            """
+        ),
+        {"ids": ids, "cantidades": [cantidades[id_producto] for id_producto in ids]},
+    ).mappings().all()
+
+    if filas:
+        # Una venta solo cambia stock: se avisa con version_stock y los workers refrescan esa
+        # columna sin invalidar el catalogo ni el indice de promociones (ver storage_service).
+        conn.execute(sa_module.text("UPDATE catalogo_version SET version_stock = version_stock + 1 WHERE id = 1"))
+
+    agotados_en_compra = [
+        str(fila["nombre"] or "")
+        for fila in filas
+        if int(fila["stock"] or 0) == 0 and int(fila["cantidad"] or 0) > 0
+    ]
+    descontados = {int(fila["id_producto"]) for fila in filas}
+    pendientes = [id_producto for id_producto in ids if id_producto not in descontados]
+    if not pendientes:
+        return agotados_en_compra, []
+
+    actuales = {
+        int(fila["id_producto"]): fila
+        for fila in conn.execute(
+            sa_module.text(
+                "SELECT id_producto, nombre, stock, eliminado FROM producto WHERE id_producto IN :ids"
+            ).bindparams(sa_module.bindparam("ids", expanding=True)),
+            {"ids": pendientes},
+        ).mappings()
+    }
+    faltantes = []
+    for id_producto in pendientes:
+        fila = actuales.get(id_producto)
+        solicitado = cantidades[id_producto]
+        if fila is None or bool(fila["eliminado"]):
+            nombre = nombres.get(id_producto, id_producto) if fila is None else str(fila["nombre"] or "")
+            faltantes.append(
+                {"id_producto": id_producto, "nombre": nombre, "solicitado": solicitado, "disponible": 0, "motivo": "no_disponible"}
+            )
+            continue
+        disponible = max(0, int(fila["stock"] or 0))
+        faltantes.append(
+            {
+                "id_producto": id_producto,
+                "nombre": str(fila["nombre"] or nombres.get(id_producto, id_producto)),
+                "solicitado": solicitado,
+                "disponible": disponible,
+                "motivo": "agotado" if disponible <= 0 else "insuficiente",
+            }
+        )
+    return agotados_en_compra, faltantes
+
+
+def reservar_stock_carrito(carrito, engine, sa_module):
+    """
+    Reserva (descuenta) el stock del carrito de forma atomica: o se descuentan todas
+    las lineas o ninguna. Devuelve {agotados, faltantes, error} donde `error` es la
+    tupla (mensaje, categoria) del primer faltante, o None.
+    """
+    with engine.connect() as conn:
+        transaccion = conn.begin()
+        try:
+            agotados, faltantes = descontar_stock_en_conexion(conn, carrito, sa_module)
+        except Exception:
+            transaccion.rollback()
+            raise
+        if faltantes:
+            transaccion.rollback()
+        else:
+            transaccion.commit()
+
+    error = None
+    if faltantes:
+        primero = faltantes[0]
+        error = (mensaje_stock_faltante(primero["motivo"], primero["nombre"], primero["disponible"]), "warning")
+    return {"agotados": agotados, "faltantes": faltantes, "error": error}
+
+
 def registrar_compra_checkout_usuario(
     carrito,
-    pedidos,
-    detalle_pedido,
-    pagos,
     metodo_pago,
     total_final,
     promo_aplicada,
     descuento_promo,
     construir_items_detalle_desde_carrito,
-    crear_pedido_y_detalle,
     resumen_promocion_desde_promo_aplicada,
-    crear_pago_para_pedido,
+    registrar_orden_fn,
     estado_pedido="confirmado",
     cliente_telefono="",
     cliente_direccion="",
+    descontar_stock=True,
 ):
-    items_detalle = construir_items_detalle_desde_carrito(carrito)
-    nuevo_id_pedido = crear_pedido_y_detalle(
-        pedidos=pedidos,
-        detalle_pedido=detalle_pedido,
-        id_usuario=session.get("id_usuario", session["usuario"]),
-        estado_pedido=estado_pedido,
-        items_detalle=items_detalle,
-        cliente_telefono=cliente_telefono,
-        cliente_direccion=cliente_direccion,
-    )
-
     resumen_promos = resumen_promocion_desde_promo_aplicada(promo_aplicada)
     if not promo_aplicada and float(descuento_promo or 0) > 0:
         resumen_promos = resumen_promocion_pago_desde_carrito(carrito)
-    crear_pago_para_pedido(
-        pagos=pagos,
-        id_pedido=nuevo_id_pedido,
+    return registrar_orden_fn(
+        id_usuario=session.get("id_usuario", session["usuario"]),
+        estado_pedido=estado_pedido,
+        items_detalle=construir_items_detalle_desde_carrito(carrito),
         monto=total_final,
         metodo_pago=metodo_pago,
         resumen_promos=resumen_promos,
         monto_descuento=float(descuento_promo),
         estado_pago="pendiente_comprobante" if str(metodo_pago).strip().lower() == "transferencia" else "aprobado",
+        cliente_telefono=cliente_telefono,
+        cliente_direccion=cliente_direccion,
+        carrito_stock=carrito if descontar_stock else None,
     )
-    return nuevo_id_pedido
 
 
 def iniciar_pago_stripe_desde_carrito(
@@ -901,16 +1013,13 @@ def build_pagination_buttons(total_paginas, pagina_actual):
     return botones
 
 
-def paginar_lista(items, pagina_actual, per_page=5):
-    total = len(items)
+def construir_paginacion(total, pagina_actual, per_page=5):
+    """Datos de paginacion para `total` elementos; la pagina pedida se acota al rango valido."""
     total_paginas = max(1, (total + per_page - 1) // per_page)
     pagina_actual = min(max(1, pagina_actual), total_paginas)
-
     inicio = (pagina_actual - 1) * per_page
     fin = inicio + per_page
-    vista = items[inicio:fin]
-
-    paginacion = {
+    return {
         "page": pagina_actual,
         "per_page": per_page,
         "total": total,
@@ -919,7 +1028,12 @@ def paginar_lista(items, pagina_actual, per_page=5):
         "hasta": min(fin, total),
         "botones": build_pagination_buttons(total_paginas, pagina_actual),
     }
-    return vista, paginacion
+
+
+def paginar_lista(items, pagina_actual, per_page=5):
+    paginacion = construir_paginacion(len(items), pagina_actual, per_page)
+    inicio = (paginacion["page"] - 1) * per_page
+    return items[inicio : inicio + per_page], paginacion
 
 
 def estado_pedido_ui(estado, pedido_status_alias):
@@ -1435,6 +1549,7 @@ def crear_pedido_y_detalle(
     guardar_detalle_pedido_df_fn,
     cliente_telefono="",
     cliente_direccion="",
+    reserve_ids_fn=None,
 ):
     nuevo_id_pedido = next_id_fn("pedidos", "id_pedido")
     nuevo_pedido = {
@@ -1445,15 +1560,18 @@ def crear_pedido_y_detalle(
         "cliente_telefono": str(cliente_telefono or "").strip(),
         "cliente_direccion": str(cliente_direccion or "").strip(),
     }
-    pedidos = pd.concat([pedidos, pd.DataFrame([nuevo_pedido])], ignore_index=True)
+    pedidos = anexar_filas_df(pedidos, [nuevo_pedido])
     guardar_pedidos_df_fn(pedidos)
 
-    next_detalle_id = next_id_fn("detalle_pedido", "id_detalle")
+    if reserve_ids_fn is not None:
+        ids_detalle = reserve_ids_fn("detalle_pedido", "id_detalle", len(items_detalle))
+    else:
+        ids_detalle = [next_id_fn("detalle_pedido", "id_detalle") for _ in items_detalle]
     nuevos_detalles = []
-    for item in items_detalle:
+    for item, id_detalle in zip(items_detalle, ids_detalle):
         nuevos_detalles.append(
             {
-                "id_detalle": next_detalle_id,
+                "id_detalle": id_detalle,
                 "id_pedido": nuevo_id_pedido,
                 "id_producto": item["id_producto"],
                 "cantidad": item["cantidad"],
@@ -1461,8 +1579,7 @@ def crear_pedido_y_detalle(
                 "talla": str(item.get("talla", "")).strip(),
             }
         )
-        next_detalle_id += 1
-    detalle_pedido = pd.concat([detalle_pedido, pd.DataFrame(nuevos_detalles)], ignore_index=True)
+    detalle_pedido = anexar_filas_df(detalle_pedido, nuevos_detalles)
     guardar_detalle_pedido_df_fn(detalle_pedido)
     return nuevo_id_pedido
 
@@ -1494,41 +1611,165 @@ def crear_pago_para_pedido(
         "valor_descuento": resumen.get("valor_descuento", 0.0),
         "monto_descuento": monto_descuento,
     }
-    pagos = pd.concat([pagos, pd.DataFrame([nuevo_pago])], ignore_index=True)
+    pagos = anexar_filas_df(pagos, [nuevo_pago])
     guardar_pagos_df_fn(pagos)
     return nuevo_id_pago
 
 
+def _valor_id_usuario(id_usuario):
+    id_num = pd.to_numeric(id_usuario, errors="coerce")
+    if pd.notna(id_num):
+        return int(id_num)
+    texto = str(id_usuario or "").strip()
+    return texto or None
+
+
+def registrar_orden(
+    id_usuario,
+    estado_pedido,
+    items_detalle,
+    monto,
+    metodo_pago,
+    resumen_promos,
+    monto_descuento,
+    engine,
+    sa_module,
+    reserve_ids_fn,
+    estado_pago="aprobado",
+    cliente_telefono="",
+    cliente_direccion="",
+    carrito_stock=None,
+):
+    """
+    Registra pedido, detalle, pago y descuento de stock en una sola transaccion.
+    Si se entrega `carrito_stock`, su stock se descuenta con el UPDATE condicional de
+    descontar_stock_en_conexion; ante un faltante se revierte todo y no se crea el pedido.
+    Devuelve {id_pedido, ids_detalle, id_pago, agotados, faltantes, error}.
+    """
+    resumen = resumen_promos or {"id_promo": "", "codigo_promo": "", "tipo_descuento": "", "valor_descuento": 0.0}
+    id_promo = pd.to_numeric(resumen.get("id_promo"), errors="coerce")
+    ahora = datetime.now()
+    resultado = {"id_pedido": None, "ids_detalle": [], "id_pago": None, "agotados": [], "faltantes": [], "error": None}
+
+    with engine.connect() as conn:
+        transaccion = conn.begin()
+        try:
+            if carrito_stock is not None:
+                agotados, faltantes = descontar_stock_en_conexion(conn, carrito_stock, sa_module)
+                if faltantes:
+                    transaccion.rollback()
+                    primero = faltantes[0]
+                    resultado["faltantes"] = faltantes
+                    resultado["error"] = (
+                        mensaje_stock_faltante(primero["motivo"], primero["nombre"], primero["disponible"]),
+                        "warning",
+                    )
+                    return resultado
+                resultado["agotados"] = agotados
+
+            # Los ids salen de las secuencias y no del DEFAULT de la columna, como en detalle_pedido.
+            id_pedido = reserve_ids_fn("pedidos", "id_pedido", 1, conn=conn)[0]
+            conn.execute(
+                sa_module.text(
+                    """
+                    INSERT INTO pedidos (id_pedido, id_usuario, fecha_pedido, estado, cliente_telefono, cliente_direccion)
+                    VALUES (:id_pedido, :id_usuario, :fecha_pedido, :estado, :cliente_telefono, :cliente_direccion)
+                    """
+                ),
+                {
+                    "id_pedido": id_pedido,
+                    "id_usuario": _valor_id_usuario(id_usuario),
+                    "fecha_pedido": ahora,
+                    "estado": estado_pedido,
+                    "cliente_telefono": str(cliente_telefono or "").strip(),
+                    "cliente_direccion": str(cliente_direccion or "").strip(),
+                },
+            )
+
+            if items_detalle:
+                ids_detalle = reserve_ids_fn("detalle_pedido", "id_detalle", len(items_detalle), conn=conn)
+                conn.execute(
+                    sa_module.text(
+                        """
+                        INSERT INTO detalle_pedido (id_detalle, id_pedido, id_producto, cantidad, subtotal, talla)
+                        VALUES (:id_detalle, :id_pedido, :id_producto, :cantidad, :subtotal, :talla)
+                        """
+                    ),
+                    [
+                        {
+                            "id_detalle": id_detalle,
+                            "id_pedido": id_pedido,
+                            "id_producto": int(item["id_producto"]),
+                            "cantidad": int(item["cantidad"]),
+                            "subtotal": float(item["subtotal"]),
+                            "talla": str(item.get("talla", "")).strip(),
+                        }
+                        for item, id_detalle in zip(items_detalle, ids_detalle)
+                    ],
+                )
+                resultado["ids_detalle"] = ids_detalle
+
+            id_pago = reserve_ids_fn("pagos", "id_pago", 1, conn=conn)[0]
+            conn.execute(
+                sa_module.text(
+                    """
+                    INSERT INTO pagos (
+                        id_pago, id_pedido, monto, metodo_pago, fecha_pago, estado_pago, comprobante_url,
+                        id_promo, codigo_promo, tipo_descuento, valor_descuento, monto_descuento
+                    )
+                    VALUES (
+                        :id_pago, :id_pedido, :monto, :metodo_pago, :fecha_pago, :estado_pago, '',
+                        :id_promo, :codigo_promo, :tipo_descuento, :valor_descuento, :monto_descuento
+                    )
+                    """
+                ),
+                {
+                    "id_pago": id_pago,
+                    "id_pedido": id_pedido,
+                    "monto": float(monto or 0),
+                    "metodo_pago": metodo_pago,
+                    "fecha_pago": ahora,
+                    "estado_pago": str(estado_pago or "aprobado").strip().lower() or "aprobado",
+                    "id_promo": int(id_promo) if pd.notna(id_promo) else None,
+                    "codigo_promo": str(resumen.get("codigo_promo", "") or ""),
+                    "tipo_descuento": str(resumen.get("tipo_descuento", "") or ""),
+                    "valor_descuento": float(pd.to_numeric(resumen.get("valor_descuento", 0), errors="coerce") or 0.0),
+                    "monto_descuento": float(monto_descuento or 0),
+                },
+            )
+            transaccion.commit()
+        except Exception:
+            transaccion.rollback()
+            raise
+
+    resultado["id_pedido"] = int(id_pedido)
+    resultado["id_pago"] = int(id_pago)
+    return resultado
+
+
+def actualizar_comprobante_pago(id_pago, comprobante_url, engine, sa_module):
+    with engine.begin() as conn:
+        conn.execute(
+            sa_module.text("UPDATE pagos SET comprobante_url = :comprobante_url WHERE id_pago = :id_pago"),
+            {"comprobante_url": str(comprobante_url or ""), "id_pago": int(id_pago)},
+        )
+
+
 def registrar_venta_pos_admin(
     carrito_validado,
     metodo_pago,
     total,
     total_descuento,
-    cargar_pedidos_df_fn,
-    cargar_detalle_pedido_df_fn,
-    cargar_pagos_df_fn,
     session_usuario,
     construir_items_detalle_fn,
-    crear_pedido_y_detalle_fn,
     resumen_promocion_pago_fn,
-    crear_pago_para_pedido_fn,
+    registrar_orden_fn,
 ):
-    pedidos = cargar_pedidos_df_fn()
-    detalle_pedido = cargar_detalle_pedido_df_fn()
-    pagos = cargar_pagos_df_fn()
-    items_detalle = construir_items_detalle_fn(carrito_validado)
-    next_pedido_id = crear_pedido_y_detalle_fn(
-        pedidos=pedidos,
-        detalle_pedido=detalle_pedido,
+    resumen_promos = resumen_promocion_pago_fn(carrito_validado)
+    return registrar_orden_fn(
         id_usuario=session_usuario,
         estado_pedido="completado",
-        items_detalle=items_detalle,
-    )
-
-    resumen_promos = resumen_promocion_pago_fn(carrito_validado)
-    crear_pago_para_pedido_fn(
-        pagos=pagos,
-        id_pedido=next_pedido_id,
+        items_detalle=construir_items_detalle_fn(carrito_validado),
         monto=round(total, 2),
         metodo_pago=metodo_pago,
         resumen_promos={
@@ -1538,5 +1779,5 @@ def registrar_venta_pos_admin(
             "valor_descuento": round(float(pd.to_numeric(resumen_promos["valor_descuento"], errors="coerce") or 0.0), 2),
         },
         monto_descuento=round(total_descuento, 2),
+        carrito_stock=carrito_validado,
     )
-    return next_pedido_id
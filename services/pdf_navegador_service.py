@@ -0,0 +1,302 @@
+"""
+Pool de navegadores headless (Edge/Chromium) controlados por el protocolo DevTools para
+convertir HTML a PDF en memoria. Cada navegador queda abierto con una pestana lista, de
+modo que un recibo solo paga setDocumentContent + printToPDF y no un arranque en frio.
+Solo usa la biblioteca estandar (cliente WebSocket minimo para CDP).
+"""
+
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_NAVEGADOR_SEGUNDOS = 30
+_ESPERA_RECURSOS_JS = """
+Promise.all([
+    document.fonts ? document.fonts.ready : Promise.resolve(),
+    ...Array.from(document.images).map((img) => img.complete ? null : new Promise((resolve) => {
+        img.onload = img.onerror = resolve;
+    })),
+]).then(() => true)
+"""
+
+
+class _ConexionWebSocket:
+    """Cliente WebSocket (RFC 6455) minimo: mensajes de texto, ping/pong y cierre."""
+
+    def __init__(self, host, puerto, ruta, timeout):
+        self._sock = socket.create_connection((host, puerto), timeout=timeout)
+        self._buffer = b""
+        clave = base64.b64encode(os.urandom(16)).decode("ascii")
+        solicitud = (
+            f"GET {ruta} HTTP/1.1\r\n"
+            f"Host: {host}:{puerto}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {clave}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        )
+        self._sock.sendall(solicitud.encode("ascii"))
+        while b"\r\n\r\n" not in self._buffer:
+            self._recibir()
+        cabeceras, self._buffer = self._buffer.split(b"\r\n\r\n", 1)
+        if b" 101 " not in cabeceras.split(b"\r\n", 1)[0]:
+            raise ConnectionError("El navegador rechazo la conexion DevTools.")
+
+    def _recibir(self):
+        datos = self._sock.recv(65536)
+        if not datos:
+            raise ConnectionError("El navegador cerro la conexion DevTools.")
+        self._buffer += datos
+
+    def _leer(self, cantidad):
+        while len(self._buffer) < cantidad:
+            self._recibir()
+        datos, self._buffer = self._buffer[:cantidad], self._buffer[cantidad:]
+        return datos
+
+    def _enviar_trama(self, opcode, datos):
+        cabecera = bytearray([0x80 | opcode])
+        longitud = len(datos)
+        if longitud < 126:
+            cabecera.append(0x80 | longitud)
+        elif longitud < 65536:
+            cabecera.append(0x80 | 126)
+            cabecera += struct.pack("!H", longitud)
+        else:
+            cabecera.append(0x80 | 127)
+            cabecera += struct.pack("!Q", longitud)
+        mascara = os.urandom(4)
+        cabecera += mascara
+        relleno = (mascara * (longitud // 4 + 1))[:longitud]
+        enmascarado = (int.from_bytes(datos, "big") ^ int.from_bytes(relleno, "big")).to_bytes(longitud, "big")
+        self._sock.sendall(bytes(cabecera) + enmascarado)
+
+    def enviar_texto(self, texto):
+        self._enviar_trama(0x1, texto.encode("utf-8"))
+
+    def recibir_texto(self):
+        fragmentos = []
+        while True:
+            primero, segundo = self._leer(2)
+            opcode = primero & 0x0F
+            longitud = segundo & 0x7F
+            if longitud == 126:
+                longitud = struct.unpack("!H", self._leer(2))[0]
+            elif longitud == 127:
+                longitud = struct.unpack("!Q", self._leer(8))[0]
+            mascara = self._leer(4) if segundo & 0x80 else b""
+            datos = self._leer(longitud)
+            if mascara:
+                datos = bytes(b ^ mascara[i % 4] for i, b in enumerate(datos))
+
+            if opcode == 0x8:
+                raise ConnectionError("El navegador cerro la conexion DevTools.")
+            if opcode == 0x9:
+                self._enviar_trama(0xA, datos)
+                continue
+            if opcode == 0xA:
+                continue
+            fragmentos.append(datos)
+            if primero & 0x80:
+                return b"".join(fragmentos).decode("utf-8")
+
+    def cerrar(self):
+        try:
+            self._enviar_trama(0x8, b"")
+        except OSError:
+            pass
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class NavegadorCDP:
+    """Un proceso de navegador headless con una pestana abierta sobre `url_base`."""
+
+    def __init__(self, ruta_navegador, url_base, timeout=TIMEOUT_NAVEGADOR_SEGUNDOS):
+        self._timeout = timeout
+        self._siguiente_id = 0
+        self._conexion = None
+        self._directorio = tempfile.mkdtemp(prefix="recibo_cdp_")
+        self._proceso = subprocess.Popen(
+            [
+                ruta_navegador,
+                "--headless",
+                "--disable-gpu",
+                "--no-sandbox",
+                "--disable-breakpad",
+                "--no-first-run",
+                "--no-default-browser-check",
+                "--allow-file-access-from-files",
+                "--remote-debugging-port=0",
+                f"--user-data-dir={self._directorio}",
+                "about:blank",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            puerto, ruta_ws = self._esperar_puerto_devtools()
+            self._conexion = _ConexionWebSocket("127.0.0.1", puerto, ruta_ws, timeout)
+            id_pestana = self.comando("Target.createTarget", {"url": url_base})["targetId"]
+            self._sesion = self.comando("Target.attachToTarget", {"targetId": id_pestana, "flatten": True})["sessionId"]
+            self._esperar_documento_listo()
+            self._id_frame = self.comando("Page.getFrameTree", sesion=True)["frameTree"]["frame"]["id"]
+        except Exception:
+            self.cerrar()
+            raise
+
+    def _esperar_puerto_devtools(self):
+        archivo = os.path.join(self._directorio, "DevToolsActivePort")
+        limite = time.monotonic() + self._timeout
+        while time.monotonic() < limite:
+            if self._proceso.poll() is not None:
+                raise RuntimeError("El navegador termino antes de abrir el puerto DevTools.")
+            try:
+                with open(archivo, "r", encoding="utf-8") as f_puerto:
+                    lineas = f_puerto.read().splitlines()
+                if len(lineas) >= 2:
+                    return int(lineas[0]), lineas[1]
+            except (OSError, ValueError):
+                pass
+            time.sleep(0.05)
+        raise TimeoutError("El navegador no abrio el puerto DevTools a tiempo.")
+
+    def _esperar_documento_listo(self):
+        limite = time.monotonic() + self._timeout
+        while time.monotonic() < limite:
+            estado = self.evaluar("document.readyState")
+            if estado == "complete":
+                return
+            time.sleep(0.05)
+        raise TimeoutError("La pestana del navegador no termino de cargar.")
+
+    def comando(self, metodo, parametros=None, sesion=False):
+        self._siguiente_id += 1
+        mensaje = {"id": self._siguiente_id, "method": metodo, "params": parametros or {}}
+        if sesion:
+            mensaje["sessionId"] = self._sesion
+        self._conexion.enviar_texto(json.dumps(mensaje))
+        while True:
+            respuesta = json.loads(self._conexion.recibir_texto())
+            if respuesta.get("id") != self._siguiente_id:
+                continue
+            if "error" in respuesta:
+                raise RuntimeError(f"{metodo}: {respuesta['error'].get('message', respuesta['error'])}")
+            return respuesta.get("result", {})
+
+    def evaluar(self, expresion, esperar_promesa=False):
+        resultado = self.comando(
+            "Runtime.evaluate",
+            {"expression": expresion, "awaitPromise": esperar_promesa, "returnByValue": True},
+            sesion=True,
+        )
+        return resultado.get("result", {}).get("value")
+
+    def imprimir_pdf(self, html):
+        self.comando("Page.setDocumentContent", {"frameId": self._id_frame, "html": html}, sesion=True)
+        self.evaluar(_ESPERA_RECURSOS_JS, esperar_promesa=True)
+        resultado = self.comando(
+            "Page.printToPDF",
+            {"printBackground": True, "preferCSSPageSize": True, "displayHeaderFooter": False},
+            sesion=True,
+        )
+        return base64.b64decode(resultado["data"])
+
+    def vivo(self):
+        return self._proceso.poll() is None
+
+    def cerrar(self):
+        if self._conexion is not None:
+            self._conexion.cerrar()
+        if self._proceso.poll() is None:
+            self._proceso.terminate()
+            try:
+                self._proceso.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._proceso.kill()
+        shutil.rmtree(self._directorio, ignore_errors=True)
+
+
+class PoolNavegadoresPDF:
+    """
+    Mantiene hasta `max_navegadores` navegadores calientes; cada uno atiende un PDF a la
+    vez, asi que la concurrencia queda acotada por el tamano del pool.
+    """
+
+    def __init__(self, buscar_navegador_fn, url_base, max_navegadores=2, timeout=TIMEOUT_NAVEGADOR_SEGUNDOS):
+        self._buscar_navegador_fn = buscar_navegador_fn
+        self._url_base = url_base
+        self._timeout = timeout
+        self._libres = queue.LifoQueue()
+        self._cupos = threading.BoundedSemaphore(max(1, int(max_navegadores)))
+        self._lock = threading.Lock()
+        self._navegadores = []
+        self._sin_navegador = False
+        atexit.register(self.cerrar)
+
+    def disponible(self):
+        if self._sin_navegador:
+            return False
+        if not self._buscar_navegador_fn():
+            self._sin_navegador = True
+            return False
+        return True
+
+    def _tomar(self):
+        while True:
+            try:
+                navegador = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            if navegador.vivo():
+                return navegador
+            self._descartar(navegador)
+        navegador = NavegadorCDP(self._buscar_navegador_fn(), self._url_base, timeout=self._timeout)
+        with self._lock:
+            self._navegadores.append(navegador)
+        return navegador
+
+    def _descartar(self, navegador):
+        with self._lock:
+            if navegador in self._navegadores:
+                self._navegadores.remove(navegador)
+        navegador.cerrar()
+
+    def imprimir_pdf(self, html):
+        if not self._cupos.acquire(timeout=self._timeout * 2):
+            raise TimeoutError("Todos los navegadores del pool estan ocupados.")
+        try:
+            for intento in range(2):
+                navegador = self._tomar()
+                try:
+                    pdf = navegador.imprimir_pdf(html)
+                except (OSError, ConnectionError, RuntimeError) as error:
+                    self._descartar(navegador)
+                    if intento:
+                        raise
+                    logger.warning("Reiniciando navegador del pool de recibos: %s", error)
+                    continue
+                self._libres.put(navegador)
+                return pdf
+        finally:
+            self._cupos.release()
+
+    def cerrar(self):
+        with self._lock:
+            navegadores, self._navegadores = self._navegadores, []
+        for navegador in navegadores:
+            navegador.cerrar()
@@ -0,0 +1,753 @@
+"""
+Motor PDF nativo para el recibo POS (sin navegador).
+
+Dibuja el mismo diseno de `recibo_pos_pdf.html` directamente en PDF usando las fuentes
+estandar Times (no requieren incrustarse) y las medidas de `admin_pos_recibo.css`.
+Lo costoso se prepara una sola vez por proceso y se reutiliza mientras los archivos
+no cambien: las metricas leidas del CSS, la marca de agua como XObject de imagen
+(los datos IDAT del PNG se incrustan tal cual, sin decodificar) y la plantilla de
+pagina (fondo, marca de agua, borde y encabezado) como Form XObject. Cada recibo solo
+escribe el contenido variable de sus paginas, directamente sobre el flujo de salida.
+"""
+
+from io import BytesIO
+import os
+import re
+import struct
+import threading
+import unicodedata
+import zlib
+
+from models.constants import RECIBO_POS_TEXTOS
+
+MM = 72 / 25.4
+PX = 0.75
+ANCHO_A4 = 210 * MM
+ALTO_A4 = 297 * MM
+
+# Metricas verticales de Times (ascendente/descendente) y line-height "normal".
+ASCENDENTE = 0.891
+DESCENDENTE = 0.216
+LINEA_NORMAL = 1.15
+
+# Anchos (1/1000 em) de Times-Roman y Times-Bold para los codigos 32..255 de WinAnsiEncoding.
+_ANCHOS_TIMES = (
+    250, 333, 408, 500, 500, 833, 778, 180, 333, 333, 500, 564, 250, 333, 250, 278,
+    500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+    921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+    556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+    333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+    500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541, 350,
+    500, 350, 333, 500, 444, 1000, 500, 500, 333, 1000, 556, 333, 889, 350, 611, 350,
+    350, 333, 333, 444, 444, 350, 500, 1000, 333, 980, 389, 333, 722, 350, 444, 722,
+    250, 333, 500, 500, 500, 500, 200, 500, 333, 760, 276, 500, 564, 333, 760, 333,
+    400, 564, 300, 300, 333, 500, 453, 250, 333, 300, 310, 500, 750, 750, 750, 444,
+    722, 722, 722, 722, 722, 722, 889, 667, 611, 611, 611, 611, 333, 333, 333, 333,
+    722, 722, 722, 722, 722, 722, 722, 564, 722, 722, 722, 722, 722, 722, 556, 500,
+    444, 444, 444, 444, 444, 444, 667, 444, 444, 444, 444, 444, 278, 278, 278, 278,
+    500, 500, 500, 500, 500, 500, 500, 564, 500, 500, 500, 500, 500, 500, 500, 500,
+)
+_ANCHOS_TIMES_NEGRITA = (
+    250, 333, 555, 500, 500, 1000, 833, 278, 333, 333, 500, 570, 250, 333, 250, 278,
+    500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 333, 333, 570, 570, 570, 500,
+    930, 722, 667, 722, 722, 667, 611, 778, 778, 389, 500, 778, 667, 944, 722, 778,
+    611, 778, 722, 556, 667, 722, 722, 1000, 722, 722, 667, 333, 278, 333, 581, 500,
+    333, 500, 556, 444, 556, 444, 333, 500, 556, 278, 333, 556, 278, 833, 556, 500,
+    556, 556, 444, 389, 333, 556, 500, 722, 500, 500, 444, 394, 220, 394, 520, 350,
+    500, 350, 333, 500, 500, 1000, 500, 500, 333, 1000, 556, 333, 1000, 350, 667, 350,
+    350, 333, 333, 500, 500, 350, 500, 1000, 333, 1000, 389, 333, 722, 350, 444, 722,
+    250, 333, 500, 500, 500, 500, 220, 500, 333, 747, 300, 500, 570, 333, 747, 333,
+    400, 570, 300, 300, 333, 556, 540, 250, 333, 300, 330, 500, 750, 750, 750, 500,
+    722, 722, 722, 722, 722, 722, 1000, 722, 667, 667, 667, 667, 389, 389, 389, 389,
+    722, 722, 778, 778, 778, 778, 778, 570, 778, 722, 722, 722, 722, 722, 611, 556,
+    500, 500, 500, 500, 500, 500, 722, 444, 444, 444, 444, 444, 278, 278, 278, 278,
+    500, 556, 500, 500, 500, 500, 500, 570, 500, 556, 556, 556, 556, 500, 556, 500,
+)
+
+# Los textos fijos salen de RECIBO_POS_TEXTOS (models.constants), el mismo origen que usa
+# la plantilla HTML; aqui solo quedan la clave, el selector CSS y la alineacion.
+T = RECIBO_POS_TEXTOS
+DATOS_EMPRESA_IZQUIERDA = (
+    ("ubicacion", T["empresa_ubicacion"]),
+    ("columna", T["empresa_ciudad"]),
+)
+DATOS_EMPRESA_DERECHA = (T["empresa_telefono"], T["empresa_correo"])
+COLUMNAS_DETALLE = (
+    ("cantidad", T["columnas"]["cantidad"], ".col-cantidad", "center"),
+    ("talla", T["columnas"]["talla"], ".col-talla", "center"),
+    ("descripcion", T["columnas"]["descripcion"], ".col-descripcion", "left"),
+    ("valor_unitario", T["columnas"]["valor_unitario"], ".col-unitario", "right"),
+    ("total", T["columnas"]["total"], ".col-total", "right"),
+)
+
+
+class TextoNoRepresentable(RuntimeError):
+    """El contexto tiene caracteres que las fuentes estandar (WinAnsi) no pueden mostrar."""
+
+_recursos_lock = threading.Lock()
+_recursos_cache = {}
+
+
+# --- Texto -------------------------------------------------------------------------------
+
+def _codificar(texto):
+    """
+    Texto en WinAnsi (cp1252). Los caracteres fuera de cp1252 se aproximan por su forma
+    descompuesta (p. ej. 'ő' -> 'o'); los que no tienen aproximacion quedan como '?'.
+    """
+    texto = str(texto or "")
+    try:
+        return texto.encode("cp1252")
+    except UnicodeEncodeError:
+        pass
+    partes = []
+    for caracter in texto:
+        try:
+            partes.append(caracter.encode("cp1252"))
+        except UnicodeEncodeError:
+            aproximado = unicodedata.normalize("NFKD", caracter).encode("cp1252", errors="ignore")
+            partes.append(aproximado or b"?")
+    return b"".join(partes)
+
+
+def _textos_contexto(valor):
+    if isinstance(valor, dict):
+        for item in valor.values():
+            yield from _textos_contexto(item)
+    elif isinstance(valor, (list, tuple)):
+        for item in valor:
+            yield from _textos_contexto(item)
+    elif isinstance(valor, str):
+        yield valor
+
+
+def caracteres_no_representables(contexto):
+    """Caracteres del contexto que _codificar tendria que cambiar por '?'."""
+    faltantes = set()
+    for texto in _textos_contexto(contexto):
+        if texto.isascii():
+            continue
+        for caracter in texto:
+            try:
+                caracter.encode("cp1252")
+            except UnicodeEncodeError:
+                if not unicodedata.normalize("NFKD", caracter).encode("cp1252", errors="ignore"):
+                    faltantes.add(caracter)
+    return faltantes
+
+
+def ancho_texto(texto, tamano, negrita=False):
+    anchos = _ANCHOS_TIMES_NEGRITA if negrita else _ANCHOS_TIMES
+    return sum(anchos[b - 32] if b >= 32 else 0 for b in _codificar(texto)) * tamano / 1000
+
+
+def partir_lineas(texto, ancho_max, tamano, negrita=False):
+    """Ajuste por palabras; una palabra mas ancha que la linea se corta por caracteres."""
+    lineas = []
+    actual = ""
+    for palabra in str(texto or "").split():
+        candidata = f"{actual} {palabra}" if actual else palabra
+        if ancho_texto(candidata, tamano, negrita) <= ancho_max:
+            actual = candidata
+            continue
+        if actual:
+            lineas.append(actual)
+        actual = ""
+        while ancho_texto(palabra, tamano, negrita) > ancho_max and len(palabra) > 1:
+            corte = len(palabra) - 1
+            while corte > 1 and ancho_texto(palabra[:corte], tamano, negrita) > ancho_max:
+                corte -= 1
+            lineas.append(palabra[:corte])
+            palabra = palabra[corte:]
+        actual = palabra
+    if actual or not lineas:
+        lineas.append(actual)
+    return lineas
+
+
+def _linea_base(arriba, tamano, interlineado=LINEA_NORMAL):
+    return arriba + (interlineado - ASCENDENTE - DESCENDENTE) * tamano / 2 + ASCENDENTE * tamano
+
+
+# --- Metricas del CSS ----------------------------------------------------------------------
+
+def _parsear_css(texto):
+    reglas = {}
+    texto = re.sub(r"/\*.*?\*/", "", texto or "", flags=re.S)
+    for selectores, cuerpo in re.findall(r"([^{}]+)\{([^{}]*)\}", texto):
+        propiedades = {}
+        for declaracion in cuerpo.split(";"):
+            if ":" in declaracion:
+                nombre, valor = declaracion.split(":", 1)
+                propiedades[nombre.strip().lower()] = valor.strip()
+        for selector in selectores.split(","):
+            selector = " ".join(selector.split())
+            if selector:
+                reglas.setdefault(selector, {}).update(propiedades)
+    return reglas
+
+
+def _longitud(valor, defecto):
+    coincidencia = re.match(r"\s*(-?[\d.]+)\s*(pt|mm|px)?", str(valor or ""))
+    if not coincidencia:
+        return defecto
+    numero = float(coincidencia.group(1))
+    return numero * {"pt": 1.0, "mm": MM, "px": PX}.get(coincidencia.group(2) or "px", PX)
+
+
+def _color(valor, defecto):
+    coincidencia = re.search(r"#([0-9a-fA-F]{6})\b", str(valor or ""))
+    if coincidencia:
+        hexa = coincidencia.group(1)
+        return tuple(int(hexa[i : i + 2], 16) / 255 for i in (0, 2, 4))
+    coincidencia = re.search(r"rgba\(\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*,\s*([\d.]+)\s*\)", str(valor or ""))
+    if coincidencia:
+        r, g, b, alfa = (float(v) for v in coincidencia.groups())
+        return (r / 255, g / 255, b / 255, alfa)
+    return defecto
+
+
+def _mezclar(color, fondo):
+    if len(color) < 4:
+        return color
+    alfa = color[3]
+    return tuple(color[i] * alfa + fondo[i] * (1 - alfa) for i in range(3))
+
+
+def metricas_desde_css(texto_css):
+    reglas = _parsear_css(texto_css)
+
+    def valor(selector, propiedad, defecto=""):
+        return reglas.get(selector, {}).get(propiedad, defecto)
+
+    def tamano(selector, defecto):
+        return _longitud(valor(selector, "font-size"), defecto)
+
+    padding_pagina = valor(".receipt-page", "padding", "10mm 11mm").split() or ["10mm"]
+    padding_celda = valor(".detail-table td", "padding", "6px").split() or ["6px"]
+    fondo_pagina = _color(valor(".receipt-page", "background"), (0.973, 0.945, 0.890))
+    try:
+        opacidad = float(valor(".receipt-watermark", "opacity", "0.35"))
+    except ValueError:
+        opacidad = 0.35
+
+    return {
+        "margen": _longitud(valor("@page", "margin"), 10 * MM),
+        "ancho_pagina": _longitud(valor(".receipt-page", "width"), 190 * MM),
+        "alto_pagina": _longitud(valor(".receipt-page", "min-height"), 277 * MM),
+        "padding_v": _longitud(padding_pagina[0], 10 * MM),
+        "padding_h": _longitud(padding_pagina[-1], 11 * MM),
+        "color_texto": _color(valor("html", "color"), (0.129, 0.094, 0.059)),
+        "color_fondo": fondo_pagina,
+        "color_borde": _color(valor(".receipt-page", "border"), (0.478, 0.4, 0.31)),
+        "color_linea": _color(valor(".line-divider", "border-bottom"), (0.435, 0.353, 0.263)),
+        "color_encabezado_tabla": _mezclar(
+            _color(valor(".detail-table th", "background"), (0.745, 0.663, 0.557, 0.14)), fondo_pagina
+        ),
+        "opacidad_marca": opacidad,
+        "titulo": tamano(".receipt-header h1", 17),
+        "marca": tamano(".brand", 12),
+        "lema": tamano(".motto", 11),
+        "meta": tamano(".meta-row", 10.5),
+        "numero_pagina": tamano(".page-number", 9.5),
+        "bloque_titulo": tamano(".block h2", 10.8),
+        "columna": tamano(".left-col p", 10.2),
+        "ubicacion": tamano(".left-col .ubicacion-linea", 9.8),
+        "cliente_etiqueta": tamano(".client-field .label", 10.4),
+        "cliente_valor": tamano(".client-field .value", 10.3),
+        "tabla_th": tamano(".detail-table th", 10.1),
+        "tabla_td": tamano(".detail-table td", 10.2),
+        "tabla_padding": _longitud(padding_celda[0], 6 * PX),
+        "resumen": tamano(".summary-left p", 10.8),
+        "total": tamano(".summary-right .total-line", 12),
+        "observaciones": tamano(".observaciones p", 10.8),
+        "columnas": [_longitud(valor(selector, "width"), 0) for _, _, selector, _ in COLUMNAS_DETALLE],
+    }
+
+
+# --- Marca de agua -------------------------------------------------------------------------
+
+def _imagen_png(datos):
+    if datos[:8] != b"\x89PNG\r\n\x1a\n":
+        return None
+    posicion = 8
+    ancho = alto = None
+    idat = []
+    while posicion + 8 <= len(datos):
+        longitud, tipo = struct.unpack("!I4s", datos[posicion : posicion + 8])
+        contenido = datos[posicion + 8 : posicion + 8 + longitud]
+        if tipo == b"IHDR":
+            ancho, alto, profundidad, tipo_color, _, _, entrelazado = struct.unpack("!IIBBBBB", contenido)
+            # Solo los PNG que el PDF entiende sin decodificar: 8 bits, gris o RGB, sin entrelazar.
+            if profundidad != 8 or tipo_color not in (0, 2) or entrelazado:
+                return None
+            colores = 3 if tipo_color == 2 else 1
+        elif tipo == b"IDAT":
+            idat.append(contenido)
+        elif tipo == b"IEND":
+            break
+        posicion += 12 + longitud
+    if not ancho or not idat:
+        return None
+    diccionario = (
+        f"/Type /XObject /Subtype /Image /Width {ancho} /Height {alto} "
+        f"/ColorSpace /{'DeviceRGB' if colores == 3 else 'DeviceGray'} /BitsPerComponent 8 "
+        f"/Filter /FlateDecode /DecodeParms << /Predictor 15 /Colors {colores} /BitsPerComponent 8 /Columns {ancho} >>"
+    )
+    return {"ancho": ancho, "alto": alto, "diccionario": diccionario, "datos": b"".join(idat)}
+
+
+def _imagen_jpeg(datos):
+    if datos[:2] != b"\xff\xd8":
+        return None
+    posicion = 2
+    while posicion + 4 <= len(datos):
+        if datos[posicion] != 0xFF:
+            posicion += 1
+            continue
+        marcador = datos[posicion + 1]
+        if marcador in (0xD8, 0x01) or 0xD0 <= marcador <= 0xD7:
+            posicion += 2
+            continue
+        longitud = struct.unpack("!H", datos[posicion + 2 : posicion + 4])[0]
+        if marcador in (0xC0, 0xC1, 0xC2):
+            alto, ancho = struct.unpack("!HH", datos[posicion + 5 : posicion + 9])
+            componentes = datos[posicion + 9]
+            espacio = {1: "DeviceGray", 3: "DeviceRGB", 4: "DeviceCMYK"}.get(componentes)
+            if not espacio:
+                return None
+            diccionario = (
+                f"/Type /XObject /Subtype /Image /Width {ancho} /Height {alto} "
+                f"/ColorSpace /{espacio} /BitsPerComponent 8 /Filter /DCTDecode"
+            )
+            return {"ancho": ancho, "alto": alto, "diccionario": diccionario, "datos": datos}
+        posicion += 2 + longitud
+    return None
+
+
+def cargar_imagen_marca_agua(ruta):
+    try:
+        with open(ruta, "rb") as f_img:
+            datos = f_img.read()
+    except OSError:
+        return None
+    return _imagen_png(datos) or _imagen_jpeg(datos)
+
+
+# --- Dibujo --------------------------------------------------------------------------------
+
+def _num(valor):
+    texto = f"{valor:.2f}".rstrip("0").rstrip(".")
+    return "0" if texto in ("", "-0") else texto
+
+
+class _Lienzo:
+    """Operadores de contenido PDF con coordenadas medidas desde el borde superior."""
+
+    def __init__(self, alto):
+        self._alto = alto
+        self._ops = []
+
+    def texto(self, x, y_base, cadena, tamano, negrita=False, color=(0, 0, 0)):
+        escapado = _codificar(cadena).replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+        self._ops.append(
+            f"BT /{'F2' if negrita else 'F1'} {_num(tamano)} Tf {' '.join(_num(c) for c in color[:3])} rg "
+            f"1 0 0 1 {_num(x)} {_num(self._alto - y_base)} Tm (".encode("ascii")
+            + escapado
+            + b") Tj ET"
+        )
+
+    def texto_alineado(self, x, ancho, y_base, cadena, tamano, negrita=False, color=(0, 0, 0), alineacion="left"):
+        if alineacion != "left":
+            sobrante = ancho - ancho_texto(cadena, tamano, negrita)
+            x += sobrante / 2 if alineacion == "center" else sobrante
+        self.texto(x, y_base, cadena, tamano, negrita, color)
+
+    def linea(self, x1, y, x2, color, grosor=PX):
+        self.raw(
+            f"{' '.join(_num(c) for c in color[:3])} RG {_num(grosor)} w "
+            f"{_num(x1)} {_num(self._alto - y)} m {_num(x2)} {_num(self._alto - y)} l S"
+        )
+
+    def rect(self, x, y, ancho, alto, relleno=None, borde=None, grosor=PX):
+        operador = "B" if relleno and borde else ("f" if relleno else "S")
+        partes = []
+        if relleno:
+            partes.append(f"{' '.join(_num(c) for c in relleno[:3])} rg")
+        if borde:
+            partes.append(f"{' '.join(_num(c) for c in borde[:3])} RG {_num(grosor)} w")
+        partes.append(f"{_num(x)} {_num(self._alto - y - alto)} {_num(ancho)} {_num(alto)} re {operador}")
+        self.raw(" ".join(partes))
+
+    def raw(self, operadores):
+        self._ops.append(operadores.encode("ascii") if isinstance(operadores, str) else operadores)
+
+    def contenido(self):
+        return b"\n".join(self._ops)
+
+
+def _caja_pagina(m):
+    x = (ANCHO_A4 - m["ancho_pagina"]) / 2
+    return x, m["margen"], m["ancho_pagina"], m["alto_pagina"]
+
+
+def _dibujar_plantilla(m, imagen):
+    """Fondo, marca de agua, borde y encabezado fijo; devuelve (contenido, y donde sigue la pagina)."""
+    lienzo = _Lienzo(ALTO_A4)
+    x_caja, y_caja, ancho_caja, alto_caja = _caja_pagina(m)
+    lienzo.rect(x_caja, y_caja, ancho_caja, alto_caja, relleno=m["color_fondo"])
+
+    if imagen:
+        # object-fit: cover centrado, recortado a la caja de la pagina.
+        escala = max(ancho_caja / imagen["ancho"], alto_caja / imagen["alto"])
+        ancho_img = imagen["ancho"] * escala
+        alto_img = imagen["alto"] * escala
+        x_img = x_caja + (ancho_caja - ancho_img) / 2
+        y_img = y_caja + (alto_caja - alto_img) / 2
+        lienzo.raw(
+            f"q {_num(x_caja)} {_num(ALTO_A4 - y_caja - alto_caja)} {_num(ancho_caja)} {_num(alto_caja)} re W n "
+            f"/GSMarca gs {_num(ancho_img)} 0 0 {_num(alto_img)} {_num(x_img)} {_num(ALTO_A4 - y_img - alto_img)} cm "
+            "/Marca Do Q"
+        )
+
+    lienzo.rect(x_caja, y_caja, ancho_caja, alto_caja, borde=m["color_borde"])
+
+    x = x_caja + m["padding_h"]
+    ancho = ancho_caja - 2 * m["padding_h"]
+    color = m["color_texto"]
+    y = y_caja + m["padding_v"]
+
+    lienzo.texto_alineado(x, ancho, _linea_base(y, m["titulo"]), T["titulo"], m["titulo"], True, color, "center")
+    y += m["titulo"] * LINEA_NORMAL + 4 * PX
+    ancho_linea = min(320 * PX, ancho * 0.78)
+    lienzo.linea(x + (ancho - ancho_linea) / 2, y, x + (ancho + ancho_linea) / 2, m["color_linea"])
+    y += PX + 6 * PX
+    lienzo.texto_alineado(x, ancho, _linea_base(y, m["marca"]), T["marca"], m["marca"], False, color, "center")
+    y += m["marca"] * LINEA_NORMAL + 2 * PX
+    lienzo.texto_alineado(x, ancho, _linea_base(y, m["lema"]), T["lema"], m["lema"], False, color, "center")
+    y += m["lema"] * LINEA_NORMAL + 6 * PX
+    return lienzo.contenido(), y
+
+
+def _titulo_bloque(lienzo, m, x, ancho, y, titulo):
+    y += 10 * PX
+    lienzo.texto(x, _linea_base(y, m["bloque_titulo"]), titulo, m["bloque_titulo"], True, m["color_texto"])
+    y += m["bloque_titulo"] * LINEA_NORMAL + 4 * PX
+    lienzo.linea(x, y, x + ancho, m["color_linea"])
+    return y + PX
+
+
+def _dibujar_datos_generales(lienzo, m, x, ancho, y, contexto):
+    y = _titulo_bloque(lienzo, m, x, ancho, y, T["datos_generales"]) + 8 * PX
+    color = m["color_texto"]
+    ancho_util = ancho - 14 * PX
+    x_derecha = x + ancho_util * 1.25 / 2.25 + 14 * PX
+
+    y_izq = y
+    for tipo, linea in DATOS_EMPRESA_IZQUIERDA:
+        tamano = m["ubicacion"] if tipo == "ubicacion" else m["columna"]
+        lienzo.texto(x, _linea_base(y_izq, tamano), linea, tamano, False, color)
+        y_izq += tamano * LINEA_NORMAL + 5 * PX
+
+    y_der = y
+    for linea in (*DATOS_EMPRESA_DERECHA, f"{T['hora']}: {contexto.get('hora_txt', '')}"):
+        lienzo.texto(x_derecha, _linea_base(y_der, m["columna"]), linea, m["columna"], False, color)
+        y_der += m["columna"] * LINEA_NORMAL + 5 * PX
+    return max(y_izq, y_der)
+
+
+def _dibujar_cliente(lienzo, m, x, ancho, y, campos):
+    y = _titulo_bloque(lienzo, m, x, ancho, y, T["cliente"]) + 8 * PX
+    color = m["color_texto"]
+    ancho_celda = (ancho - 18 * PX) / 2
+    alto_celda = max(18 * PX, max(m["cliente_etiqueta"], m["cliente_valor"]) * LINEA_NORMAL + 2 * PX)
+    for indice, campo in enumerate(campos):
+        fila, columna = divmod(indice, 2)
+        x_celda = x + columna * (ancho_celda + 18 * PX)
+        y_celda = y + fila * (alto_celda + 8 * PX)
+        etiqueta = f"{campo.get('label', '')}:"
+        base = _linea_base(y_celda, max(m["cliente_etiqueta"], m["cliente_valor"]))
+        lienzo.texto(x_celda, base, etiqueta, m["cliente_etiqueta"], True, color)
+        x_valor = x_celda + ancho_texto(etiqueta, m["cliente_etiqueta"], True) + 4 * PX + ancho_texto(" ", m["cliente_valor"])
+        lienzo.texto(x_valor, base, campo.get("valor", ""), m["cliente_valor"], False, color)
+        lienzo.linea(x_celda, y_celda + alto_celda, x_celda + ancho_celda, m["color_linea"])
+    filas = (len(campos) + 1) // 2
+    return y + filas * alto_celda + max(0, filas - 1) * 8 * PX
+
+
+def _anchos_columnas(m, ancho):
+    anchos = [a if a > 0 else ancho / len(COLUMNAS_DETALLE) for a in m["columnas"]]
+    escala = ancho / sum(anchos)
+    return [a * escala for a in anchos]
+
+
+def _fila_tabla(lienzo, m, x, y, anchos, celdas, encabezado=False):
+    padding = m["tabla_padding"]
+    tamano = m["tabla_th"] if encabezado else m["tabla_td"]
+    lineas_por_celda = []
+    for (clave, _, _, alineacion), ancho, valor in zip(COLUMNAS_DETALLE, anchos, celdas):
+        if encabezado or clave == "descripcion":
+            interlineado = 1.15 if encabezado else 1.2
+            lineas = partir_lineas(valor, ancho - 2 * padding, tamano, encabezado)
+        else:
+            interlineado = LINEA_NORMAL
+            lineas = [str(valor)]
+        lineas_por_celda.append((lineas, interlineado, "center" if encabezado else alineacion))
+    alto = max(len(lineas) * interlineado * tamano for lineas, interlineado, _ in lineas_por_celda) + 2 * padding
+
+    x_celda = x
+    for ancho, (lineas, interlineado, alineacion) in zip(anchos, lineas_por_celda):
+        lienzo.rect(
+            x_celda,
+            y,
+            ancho,
+            alto,
+            relleno=m["color_encabezado_tabla"] if encabezado else None,
+            borde=m["color_linea"],
+        )
+        # vertical-align: middle
+        y_texto = y + (alto - len(lineas) * interlineado * tamano) / 2
+        for linea in lineas:
+            lienzo.texto_alineado(
+                x_celda + padding,
+                ancho - 2 * padding,
+                _linea_base(y_texto, tamano, interlineado),
+                linea,
+                tamano,
+                encabezado,
+                m["color_texto"],
+                alineacion,
+            )
+            y_texto += interlineado * tamano
+        x_celda += ancho
+    return y + alto
+
+
+def _dibujar_detalle(lienzo, m, x, ancho, y, items):
+    y = _titulo_bloque(lienzo, m, x, ancho, y, T["detalle"]) + 8 * PX
+    anchos = _anchos_columnas(m, ancho)
+    y = _fila_tabla(lienzo, m, x, y, anchos, [titulo for _, titulo, _, _ in COLUMNAS_DETALLE], encabezado=True)
+    if not items:
+        return _fila_tabla(lienzo, m, x, y, anchos, ["-", "-", T["sin_productos"], "COP 0,00", "COP 0,00"])
+    for item in items:
+        y = _fila_tabla(lienzo, m, x, y, anchos, [item.get(clave, "") for clave, _, _, _ in COLUMNAS_DETALLE])
+    return y
+
+
+def _dibujar_resumen(lienzo, m, x, ancho, y, contexto):
+    y = _titulo_bloque(lienzo, m, x, ancho, y, T["resumen"]) + 8 * PX
+    color = m["color_texto"]
+    ancho_columna = (ancho - 26 * PX) / 2
+    x_derecha = x + ancho_columna + 26 * PX
+
+    y_izq = y
+    for linea in (
+        f"{T['cantidad_items']}: {contexto.get('cantidad_items', 0)}",
+        f"{T['metodo_pago']}: {contexto.get('metodo_pago', '')}",
+    ):
+        lienzo.texto(x, _linea_base(y_izq, m["resumen"]), linea, m["resumen"], False, color)
+        y_izq += m["resumen"] * LINEA_NORMAL + 7 * PX
+
+    y_der = y
+    for etiqueta, valor, tamano, negrita in (
+        (f"{T['subtotal']}:", contexto.get("subtotal_txt", ""), m["resumen"], False),
+        (f"{T['descuento']}:", contexto.get("descuento_txt", ""), m["resumen"], False),
+        (f"{T['total_pagar']}:", contexto.get("total_txt", ""), m["total"], True),
+    ):
+        base = _linea_base(y_der, tamano)
+        lienzo.texto(x_derecha, base, etiqueta, tamano, negrita, color)
+        lienzo.texto_alineado(x_derecha, ancho_columna, base, valor, tamano, True, color, "right")
+        y_der += tamano * LINEA_NORMAL + 7 * PX
+    return max(y_izq, y_der)
+
+
+def _dibujar_observaciones(lienzo, m, x, ancho, y, texto):
+    y = _titulo_bloque(lienzo, m, x, ancho, y, T["observaciones"]) + 8 * PX
+    for linea in partir_lineas(texto, ancho, m["observaciones"]):
+        lienzo.texto(x, _linea_base(y, m["observaciones"], 1.45), linea, m["observaciones"], False, m["color_texto"])
+        y += m["observaciones"] * 1.45
+    return y
+
+
+def _contenido_pagina(contexto, pagina, m, y_inicio):
+    lienzo = _Lienzo(ALTO_A4)
+    lienzo.raw("/Plantilla Do")
+    x_caja, _, ancho_caja, _ = _caja_pagina(m)
+    x = x_caja + m["padding_h"]
+    ancho = ancho_caja - 2 * m["padding_h"]
+    color = m["color_texto"]
+
+    y = y_inicio + 3 * PX
+    base = _linea_base(y, m["meta"])
+    lienzo.texto(x, base, f"{T['recibo']}: {contexto.get('codigo_recibo', '')}", m["meta"], False, color)
+    lienzo.texto_alineado(x, ancho, base, f"{T['fecha']}: {contexto.get('fecha_txt', '')}", m["meta"], False, color, "right")
+    y += m["meta"] * LINEA_NORMAL
+
+    total_paginas = int(contexto.get("total_paginas", 1) or 1)
+    if total_paginas > 1:
+        y += 4 * PX
+        texto = f"{T['pagina']} {pagina.get('numero', 1)}/{total_paginas}"
+        lienzo.texto_alineado(x, ancho, _linea_base(y, m["numero_pagina"]), texto, m["numero_pagina"], False, color, "right")
+        y += m["numero_pagina"] * LINEA_NORMAL
+
+    if pagina.get("numero") == 1:
+        y = _dibujar_datos_generales(lienzo, m, x, ancho, y, contexto)
+        if contexto.get("cliente_campos"):
+            y = _dibujar_cliente(lienzo, m, x, ancho, y, contexto["cliente_campos"])
+
+    y = _dibujar_detalle(lienzo, m, x, ancho, y, pagina.get("detalle_items", []))
+
+    if pagina.get("es_ultima"):
+        y = _dibujar_resumen(lienzo, m, x, ancho, y, contexto)
+        _dibujar_observaciones(lienzo, m, x, ancho, y, contexto.get("observaciones", ""))
+    return lienzo.contenido()
+
+
+# --- Recursos cacheados ------------------------------------------------------------------
+
+def _firma_archivo(ruta):
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    return (ruta, estado.st_mtime_ns, estado.st_size)
+
+
+def _preparar_recursos(ruta_css, ruta_marca_agua):
+    try:
+        with open(ruta_css, "r", encoding="utf-8") as f_css:
+            texto_css = f_css.read()
+    except UnicodeDecodeError:
+        with open(ruta_css, "r", encoding="latin-1") as f_css:
+            texto_css = f_css.read()
+    except OSError:
+        texto_css = ""
+
+    metricas = metricas_desde_css(texto_css)
+    imagen = cargar_imagen_marca_agua(ruta_marca_agua) if ruta_marca_agua else None
+    plantilla, y_contenido = _dibujar_plantilla(metricas, imagen)
+    return {
+        "metricas": metricas,
+        "imagen": imagen,
+        "plantilla": zlib.compress(plantilla, 6),
+        "y_contenido": y_contenido,
+    }
+
+
+def obtener_recursos_recibo(ruta_css, ruta_marca_agua):
+    """Metricas, marca de agua y plantilla; se reconstruyen solo si cambia el CSS o la imagen."""
+    clave = (_firma_archivo(ruta_css), _firma_archivo(ruta_marca_agua) if ruta_marca_agua else None)
+    with _recursos_lock:
+        recursos = _recursos_cache.get(clave)
+        if recursos is None:
+            recursos = _preparar_recursos(ruta_css, ruta_marca_agua)
+            _recursos_cache.clear()
+            _recursos_cache[clave] = recursos
+    return recursos
+
+
+# --- Escritura del PDF -------------------------------------------------------------------
+
+class _EscritorPDF:
+    def __init__(self, salida):
+        self._salida = salida
+        self._posicion = 0
+        self._desplazamientos = {}
+        self._siguiente = 1
+        self._escribir(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _escribir(self, datos):
+        self._salida.write(datos)
+        self._posicion += len(datos)
+
+    def reservar(self):
+        numero = self._siguiente
+        self._siguiente += 1
+        return numero
+
+    def objeto(self, numero, cuerpo):
+        self._desplazamientos[numero] = self._posicion
+        self._escribir(f"{numero} 0 obj\n".encode("ascii") + cuerpo.encode("ascii") + b"\nendobj\n")
+
+    def objeto_stream(self, numero, diccionario, datos):
+        self._desplazamientos[numero] = self._posicion
+        self._escribir(f"{numero} 0 obj\n<< {diccionario} /Length {len(datos)} >>\nstream\n".encode("ascii"))
+        self._escribir(datos)
+        self._escribir(b"\nendstream\nendobj\n")
+
+    def cerrar(self, raiz):
+        inicio_xref = self._posicion
+        total = self._siguiente
+        lineas = [f"xref\n0 {total}\n", "0000000000 65535 f \n"]
+        for numero in range(1, total):
+            lineas.append(f"{self._desplazamientos.get(numero, 0):010d} 00000 n \n")
+        lineas.append(f"trailer\n<< /Size {total} /Root {raiz} 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n")
+        self._escribir("".join(lineas).encode("ascii"))
+
+
+def escribir_pdf_recibo(contexto, salida, recursos):
+    """Escribe el PDF del recibo en `salida` (archivo binario) pagina por pagina."""
+    m = recursos["metricas"]
+    imagen = recursos["imagen"]
+    pdf = _EscritorPDF(salida)
+
+    catalogo = pdf.reservar()
+    paginas = pdf.reservar()
+    fuente_normal = pdf.reservar()
+    fuente_negrita = pdf.reservar()
+    plantilla = pdf.reservar()
+    pdf.objeto(catalogo, f"<< /Type /Catalog /Pages {paginas} 0 R >>")
+    for numero, nombre in ((fuente_normal, "Times-Roman"), (fuente_negrita, "Times-Bold")):
+        pdf.objeto(numero, f"<< /Type /Font /Subtype /Type1 /BaseFont /{nombre} /Encoding /WinAnsiEncoding >>")
+
+    recursos_plantilla = ""
+    if imagen:
+        marca = pdf.reservar()
+        estado_grafico = pdf.reservar()
+        pdf.objeto_stream(marca, imagen["diccionario"], imagen["datos"])
+        opacidad = _num(m["opacidad_marca"])
+        pdf.objeto(estado_grafico, f"<< /Type /ExtGState /ca {opacidad} /CA {opacidad} >>")
+        recursos_plantilla = f"/XObject << /Marca {marca} 0 R >> /ExtGState << /GSMarca {estado_grafico} 0 R >>"
+    fuentes = f"/Font << /F1 {fuente_normal} 0 R /F2 {fuente_negrita} 0 R >>"
+    pdf.objeto_stream(
+        plantilla,
+        f"/Type /XObject /Subtype /Form /BBox [0 0 {_num(ANCHO_A4)} {_num(ALTO_A4)}] "
+        f"/Resources << {fuentes} {recursos_plantilla} >> /Filter /FlateDecode",
+        recursos["plantilla"],
+    )
+
+    recursos_pagina = pdf.reservar()
+    pdf.objeto(recursos_pagina, f"<< {fuentes} /XObject << /Plantilla {plantilla} 0 R >> >>")
+
+    hijos = []
+    for pagina in contexto.get("paginas") or [{"numero": 1, "detalle_items": [], "es_ultima": True}]:
+        contenido = pdf.reservar()
+        pdf.objeto_stream(
+            contenido,
+            "/Filter /FlateDecode",
+            zlib.compress(_contenido_pagina(contexto, pagina, m, recursos["y_contenido"]), 6),
+        )
+        numero_pagina = pdf.reservar()
+        pdf.objeto(
+            numero_pagina,
+            f"<< /Type /Page /Parent {paginas} 0 R /MediaBox [0 0 {_num(ANCHO_A4)} {_num(ALTO_A4)}] "
+            f"/Resources {recursos_pagina} 0 R /Contents {contenido} 0 R >>",
+        )
+        hijos.append(f"{numero_pagina} 0 R")
+
+    pdf.objeto(paginas, f"<< /Type /Pages /Kids [{' '.join(hijos)}] /Count {len(hijos)} >>")
+    pdf.cerrar(catalogo)
+
+
+def generar_pdf_recibo(contexto, ruta_css, ruta_marca_agua, estricto=True):
+    """
+    Bytes del PDF. Con `estricto` se rechaza (TextoNoRepresentable) un contexto con
+    caracteres que saldrian como '?', para que el llamador use el motor de navegador.
+    """
+    if estricto:
+        faltantes = caracteres_no_representables(contexto)
+        if faltantes:
+            raise TextoNoRepresentable(f"Caracteres sin soporte en el motor nativo: {''.join(sorted(faltantes))}")
+    salida = BytesIO()
+    escribir_pdf_recibo(contexto, salida, obtener_recursos_recibo(ruta_css, ruta_marca_agua))
+    return salida.getvalue()
@@ -1,8 +1,10 @@
 ﻿"""Servicio de promociones y descuentos."""
 
 from datetime import date, datetime
+import threading
 from typing import Any, Mapping, Optional
 
+import numpy as np
 import pandas as pd
 
 
@@ -117,3 +119,215 @@ def buscar_promocion_por_codigo(promos_df, codigo, fecha_ref=None):
         if promocion_esta_aplicable(promo, fecha_ref):
             return promo
     return None
+
+
+# Indice de promociones del catalogo: se arma una vez por (version de catalogo, dia) y guarda,
+# por producto, el precio de catalogo, la mejor promocion automatica y el precio final.
+_INDICES_MAX = 8
+_indice_lock = threading.Lock()
+_indice_cache = {}
+
+
+def construir_indice_promociones(productos_df: pd.DataFrame, promos_df: pd.DataFrame, fecha_ref: Optional[date] = None):
+    """
+    Precalcula, para el dia `fecha_ref`, la mejor promocion automatica de cada producto del
+    catalogo junto con el precio con el que se eligio y el precio final, y el mapa
+    codigo -> promocion aplicable.
+    """
+    if fecha_ref is None:
+        fecha_ref = datetime.now().date()
+
+    mejor_por_producto = obtener_mejor_promocion_por_producto(productos_df, promos_df, fecha_ref)
+    por_producto = {}
+    if 'id_producto' in productos_df.columns and not productos_df.empty:
+        ids = pd.to_numeric(productos_df['id_producto'], errors='coerce')
+        precios = pd.to_numeric(productos_df.get('precio', 0.0), errors='coerce').fillna(0.0)
+        for pid, precio in zip(ids, precios):
+            if pd.isna(pid):
+                continue
+            promo = mejor_por_producto.get(int(pid))
+            descuento = calcular_descuento_promocion(float(precio), promo) if promo else 0.0
+            por_producto[int(pid)] = {
+                'precio': float(precio),
+                'promo': promo,
+                'precio_final': max(0.0, float(precio) - descuento),
+            }
+
+    por_codigo = {}
+    for promo in promos_df.to_dict(orient='records'):
+        codigo = str(promo.get('codigo', '') or '').strip().upper()
+        if codigo and codigo not in por_codigo and promocion_esta_aplicable(promo, fecha_ref):
+            por_codigo[codigo] = promo
+
+    return {'fecha': fecha_ref, 'por_producto': por_producto, 'por_codigo': por_codigo}
+
+
+def obtener_indice_promociones(version_catalogo, cargar_productos_df_fn, promos_df, fecha_ref: Optional[date] = None, *, version_catalogo_df_fn):
+    """
+    Devuelve el indice de la version `version_catalogo` para el dia, armandolo con
+    `promos_df` (que debe ser de esa version) y los productos del catalogo. Si el snapshot
+    de productos ya es de otra version devuelve None y el llamador resuelve sin indice.
+    """
+    if fecha_ref is None:
+        fecha_ref = datetime.now().date()
+    clave = (version_catalogo, fecha_ref)
+    with _indice_lock:
+        indice = _indice_cache.get(clave)
+        if indice is not None:
+            return indice
+    productos_df = cargar_productos_df_fn()
+    if version_catalogo_df_fn(productos_df) != version_catalogo:
+        return None
+    indice = construir_indice_promociones(productos_df, promos_df, fecha_ref)
+    with _indice_lock:
+        if len(_indice_cache) >= _INDICES_MAX:
+            _indice_cache.pop(next(iter(_indice_cache)))
+        _indice_cache[clave] = indice
+    return indice
+
+
+def mejor_promocion_desde_indice(indice, productos_df: pd.DataFrame, promos_df: pd.DataFrame, fecha_ref: Optional[date] = None):
+    """
+    Equivalente a obtener_mejor_promocion_por_producto para los productos del DataFrame.
+    Los productos cuyo precio no coincide con el del indice se recalculan contra `promos_df`.
+    """
+    if 'id_producto' not in productos_df.columns or productos_df.empty:
+        return {}
+    ids = pd.to_numeric(productos_df['id_producto'], errors='coerce')
+    precios = pd.to_numeric(productos_df.get('precio', 0.0), errors='coerce').fillna(0.0)
+
+    por_producto = indice['por_producto']
+    mejor_por_producto = {}
+    pendientes = []
+    for posicion, (pid, precio) in enumerate(zip(ids, precios)):
+        if pd.isna(pid):
+            continue
+        entrada = por_producto.get(int(pid))
+        if entrada is None or entrada['precio'] != float(precio):
+            pendientes.append(posicion)
+        elif entrada['promo'] is not None:
+            mejor_por_producto[int(pid)] = dict(entrada['promo'])
+    if pendientes:
+        mejor_por_producto.update(
+            obtener_mejor_promocion_por_producto(productos_df.iloc[pendientes], promos_df, fecha_ref)
+        )
+    return mejor_por_producto
+
+
+def buscar_promocion_por_codigo_indice(indice, codigo):
+    codigo_norm = str(codigo or '').strip().upper()
+    if not codigo_norm:
+        return None
+    promo = indice['por_codigo'].get(codigo_norm)
+    return dict(promo) if promo is not None else None
+
+
+def _indice_para(promos_df, fecha_ref, cargar_productos_df_fn, version_catalogo_df_fn):
+    """Indice de la version de catalogo de `promos_df`, o None si no viene del snapshot del catalogo."""
+    version = version_catalogo_df_fn(promos_df)
+    if version is None:
+        return None
+    return obtener_indice_promociones(
+        version, cargar_productos_df_fn, promos_df, fecha_ref, version_catalogo_df_fn=version_catalogo_df_fn
+    )
+
+
+def obtener_mejor_promocion_por_producto_indexada(
+    productos_df,
+    promos_df=None,
+    fecha_ref=None,
+    *,
+    cargar_productos_df_fn,
+    cargar_promociones_df_fn,
+    version_catalogo_df_fn,
+):
+    """
+    Misma firma y resultado que obtener_mejor_promocion_por_producto. Con las promociones del
+    catalogo cacheado (o sin `promos_df`) responde desde el indice de su version; con un
+    DataFrame leido de otra forma calcula directo sobre el.
+    """
+    if promos_df is None:
+        promos_df = cargar_promociones_df_fn()
+    indice = _indice_para(promos_df, fecha_ref, cargar_productos_df_fn, version_catalogo_df_fn)
+    if indice is None:
+        return obtener_mejor_promocion_por_producto(productos_df, promos_df, fecha_ref)
+    return mejor_promocion_desde_indice(indice, productos_df, promos_df, fecha_ref)
+
+
+def buscar_promocion_por_codigo_indexada(
+    promos_df,
+    codigo,
+    fecha_ref=None,
+    *,
+    cargar_productos_df_fn,
+    cargar_promociones_df_fn,
+    version_catalogo_df_fn,
+):
+    """Busqueda O(1) por codigo con la misma firma que buscar_promocion_por_codigo."""
+    if promos_df is None:
+        promos_df = cargar_promociones_df_fn()
+    indice = _indice_para(promos_df, fecha_ref, cargar_productos_df_fn, version_catalogo_df_fn)
+    if indice is None:
+        return buscar_promocion_por_codigo(promos_df, codigo, fecha_ref)
+    return buscar_promocion_por_codigo_indice(indice, codigo)
+
+
+def evaluar_promociones_lote(ids_producto, precios, cantidades, mejor_por_producto, promo_codigo=None):
+    """
+    Evalua en una sola pasada columnar los descuentos de muchas lineas (carrito, POS o
+    catalogo). `mejor_por_producto` es el mapa id_producto -> promocion automatica y
+    `promo_codigo`, si se indica, reemplaza la automatica en las lineas de su producto.
+
+    Devuelve arreglos por linea ('descuento_unitario', 'descuento', 'subtotal_bruto',
+    'subtotal', 'id_promo', 'promos') y los totales ('total_bruto', 'total_descuento',
+    'total', 'aplico_codigo'). Cada linea se calcula igual que calcular_descuento_promocion.
+    """
+    ids = pd.to_numeric(pd.Series(list(ids_producto), dtype=object), errors='coerce').fillna(0).astype('int64').to_numpy()
+    precios_arr = pd.to_numeric(pd.Series(list(precios), dtype=object), errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    cantidades_arr = pd.to_numeric(pd.Series(list(cantidades), dtype=object), errors='coerce').fillna(1).clip(lower=1).astype('int64').to_numpy()
+
+    columnas = ['id_promo', 'tipo_descuento', 'valor_descuento']
+    mejor_por_producto = mejor_por_producto or {}
+    tabla = pd.DataFrame.from_dict(mejor_por_producto, orient='index').reindex(columns=columnas)
+    lineas = tabla.reindex(ids).reset_index(drop=True)
+    tiene_promo = np.isin(ids, np.fromiter(mejor_por_producto.keys(), dtype='int64', count=len(mejor_por_producto)))
+
+    usa_codigo = np.zeros(len(ids), dtype=bool)
+    if promo_codigo is not None:
+        id_codigo = pd.to_numeric(promo_codigo.get('id_producto'), errors='coerce')
+        if pd.notna(id_codigo):
+            usa_codigo = ids == int(id_codigo)
+            if usa_codigo.any():
+                for col in columnas:
+                    lineas[col] = lineas[col].astype(object)
+                    lineas.loc[usa_codigo, col] = promo_codigo.get(col)
+                tiene_promo = tiene_promo | usa_codigo
+
+    tipo = lineas['tipo_descuento'].fillna('porcentaje').astype(str).str.strip().str.lower().to_numpy()
+    valor = pd.to_numeric(lineas['valor_descuento'], errors='coerce').fillna(0.0).clip(lower=0.0).to_numpy(dtype=float)
+    base = np.maximum(precios_arr, 0.0)
+    descuento_unitario = np.where(tipo == 'valor_fijo', valor, base * valor / 100.0)
+    descuento_unitario = np.where(tiene_promo, np.minimum(descuento_unitario, base), 0.0)
+
+    subtotal_bruto = precios_arr * cantidades_arr
+    descuento = np.minimum(subtotal_bruto, descuento_unitario * cantidades_arr)
+    subtotal = np.maximum(0.0, subtotal_bruto - descuento)
+
+    promos = [
+        (promo_codigo if codigo else mejor_por_producto.get(int(pid))) if con_promo else None
+        for pid, con_promo, codigo in zip(ids, tiene_promo, usa_codigo)
+    ]
+    total_bruto = float(subtotal_bruto.sum())
+    total_descuento = float(descuento.sum())
+    return {
+        'descuento_unitario': descuento_unitario,
+        'descuento': descuento,
+        'subtotal_bruto': subtotal_bruto,
+        'subtotal': subtotal,
+        'id_promo': [promo.get('id_promo', '') if promo else '' for promo in promos],
+        'promos': promos,
+        'total_bruto': total_bruto,
+        'total_descuento': total_descuento,
+        'total': max(0.0, total_bruto - total_descuento),
+        'aplico_codigo': bool(usa_codigo.any()),
+    }
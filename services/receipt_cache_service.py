@@ -0,0 +1,96 @@
+"""
+Cache en disco de recibos POS ya generados (PDF y HTML).
+
+Cada archivo se nombra `<id_pedido>_<huella>.<tipo>`, donde la huella resume el detalle
+del pedido, su ultimo pago y la version de la plantilla; si algo cambia la huella es otra
+y el recibo viejo simplemente deja de usarse. El directorio se mantiene por debajo de
+`max_bytes` expulsando los archivos menos usados (mtime se actualiza en cada acierto),
+asi que el limite se respeta aunque varios workers compartan la carpeta.
+"""
+
+import os
+import tempfile
+import threading
+
+
+class CacheRecibos:
+    def __init__(self, directorio, max_bytes):
+        self._directorio = directorio
+        self._max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        self._bytes_estimados = None
+
+    def _ruta(self, id_pedido, huella, tipo):
+        return os.path.join(self._directorio, f"{int(id_pedido)}_{huella}.{tipo}")
+
+    def _entradas(self):
+        try:
+            with os.scandir(self._directorio) as it:
+                return [
+                    (entrada.stat().st_mtime, entrada.stat().st_size, entrada.path)
+                    for entrada in it
+                    if entrada.is_file() and not entrada.name.startswith(".")
+                ]
+        except OSError:
+            return []
+
+    def obtener(self, id_pedido, huella, tipo):
+        ruta = self._ruta(id_pedido, huella, tipo)
+        try:
+            with open(ruta, "rb") as f_recibo:
+                contenido = f_recibo.read()
+            os.utime(ruta)
+        except OSError:
+            return None
+        return contenido
+
+    def guardar(self, id_pedido, huella, tipo, contenido):
+        if not self._max_bytes or len(contenido) > self._max_bytes:
+            return
+        try:
+            os.makedirs(self._directorio, exist_ok=True)
+            descriptor, temporal = tempfile.mkstemp(dir=self._directorio, prefix=".tmp_")
+            with os.fdopen(descriptor, "wb") as f_recibo:
+                f_recibo.write(contenido)
+            os.replace(temporal, self._ruta(id_pedido, huella, tipo))
+        except OSError:
+            return
+        self._descartar(id_pedido, tipo, conservar=huella)
+
+        with self._lock:
+            if self._bytes_estimados is None:
+                self._bytes_estimados = sum(tamano for _, tamano, _ in self._entradas())
+            else:
+                self._bytes_estimados += len(contenido)
+            if self._bytes_estimados > self._max_bytes:
+                self._bytes_estimados = self._expulsar()
+
+    def _expulsar(self):
+        entradas = sorted(self._entradas())
+        total = sum(tamano for _, tamano, _ in entradas)
+        for _, tamano, ruta in entradas:
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(ruta)
+            except OSError:
+                continue
+            total -= tamano
+        return total
+
+    def _descartar(self, id_pedido, tipo=None, conservar=None):
+        prefijo = f"{int(id_pedido)}_"
+        for _, _, ruta in self._entradas():
+            nombre = os.path.basename(ruta)
+            if not nombre.startswith(prefijo):
+                continue
+            huella, _, extension = nombre[len(prefijo):].partition(".")
+            if (tipo is None or extension == tipo) and huella != conservar:
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+
+    def invalidar(self, id_pedido):
+        """Elimina todas las versiones cacheadas (PDF y HTML) del pedido."""
+        self._descartar(id_pedido)
@@ -5,23 +5,21 @@ def build_receipt_legacy_bindings(
     *,
     app_receipt_service,
     session_obj,
-    cargar_detalle_pedido_df_fn,
-    cargar_productos_df_fn,
-    cargar_pagos_df_fn,
-    cargar_pedidos_df_fn,
+    obtener_datos_recibo_pedido_fn,
     tallas_opciones,
     formatear_cop_fn,
     app_root_path,
     render_template_fn,
     edge_path_env,
+    pdf_navegadores_max=2,
+    pdf_motor="nativo",
+    cache_recibos_dir=None,
+    cache_recibos_max_mb=64,
 ):
     def _construir_datos_recibo_pos(id_pedido):
         return app_receipt_service.construir_datos_recibo_pos(
             id_pedido,
-            cargar_detalle_pedido_df_fn=cargar_detalle_pedido_df_fn,
-            cargar_productos_df_fn=cargar_productos_df_fn,
-            cargar_pagos_df_fn=cargar_pagos_df_fn,
-            cargar_pedidos_df_fn=cargar_pedidos_df_fn,
+            obtener_datos_recibo_pedido_fn=obtener_datos_recibo_pedido_fn,
             tallas_opciones=tallas_opciones,
             ultimo_recibo_pos=session_obj.get('ultimo_recibo_pos', {}),
         )
@@ -55,14 +53,60 @@ def build_receipt_legacy_bindings(
     def _buscar_msedge():
         return app_receipt_service.buscar_msedge(edge_path_env=edge_path_env)
 
+    def _buscar_navegador_pdf():
+        return app_receipt_service.buscar_navegador_pdf(edge_path_env=edge_path_env)
+
+    _pool_navegadores_pdf = app_receipt_service.crear_pool_navegadores_pdf(
+        app_root_path,
+        _buscar_navegador_pdf,
+        max_navegadores=pdf_navegadores_max,
+    )
+
+    def _generar_pdf_recibo_pos_nativo(id_pedido, estricto=True):
+        return app_receipt_service.generar_pdf_recibo_pos_nativo(
+            id_pedido,
+            construir_contexto_recibo_pos_fn=_construir_contexto_recibo_pos,
+            app_root_path=app_root_path,
+            estricto=estricto,
+        )
+
     def generar_pdf_recibo_pos(id_pedido):
         return app_receipt_service.generar_pdf_recibo_pos(
             id_pedido,
             render_html_recibo_pos_fn=render_html_recibo_pos,
             buscar_msedge_fn=_buscar_msedge,
             app_root_path=app_root_path,
+            pool_navegadores=_pool_navegadores_pdf,
+            generar_pdf_nativo_fn=_generar_pdf_recibo_pos_nativo if pdf_motor == "nativo" else None,
+        )
+
+    _cache_recibos_pos = (
+        app_receipt_service.crear_cache_recibos(cache_recibos_dir, cache_recibos_max_mb)
+        if cache_recibos_dir
+        else None
+    )
+
+    def huella_recibo_pos(id_pedido):
+        return app_receipt_service.huella_recibo_pos(
+            id_pedido,
+            obtener_datos_recibo_pedido_fn=obtener_datos_recibo_pedido_fn,
+            ultimo_recibo_pos=session_obj.get('ultimo_recibo_pos', {}),
+            version_plantilla=[pdf_motor, *app_receipt_service.version_plantilla_recibo_pos(app_root_path)],
         )
 
+    def recibo_pos_cacheado(id_pedido, tipo, huella=None):
+        return app_receipt_service.obtener_recibo_pos_cacheado(
+            id_pedido,
+            tipo,
+            huella=huella or huella_recibo_pos(id_pedido),
+            cache=_cache_recibos_pos,
+            generar_fn=generar_pdf_recibo_pos if tipo == 'pdf' else render_html_recibo_pos,
+        )
+
+    def invalidar_recibo_pos(id_pedido):
+        if _cache_recibos_pos is not None:
+            _cache_recibos_pos.invalidar(id_pedido)
+
     return {
         '_construir_datos_recibo_pos': _construir_datos_recibo_pos,
         '_particionar_items_recibo': _particionar_items_recibo,
@@ -71,5 +115,11 @@ def build_receipt_legacy_bindings(
         '_cargar_marca_agua_recibo_src': _cargar_marca_agua_recibo_src,
         'render_html_recibo_pos': render_html_recibo_pos,
         '_buscar_msedge': _buscar_msedge,
+        '_pool_navegadores_pdf': _pool_navegadores_pdf,
+        '_generar_pdf_recibo_pos_nativo': _generar_pdf_recibo_pos_nativo,
         'generar_pdf_recibo_pos': generar_pdf_recibo_pos,
+        '_cache_recibos_pos': _cache_recibos_pos,
+        'huella_recibo_pos': huella_recibo_pos,
+        'recibo_pos_cacheado': recibo_pos_cacheado,
+        'invalidar_recibo_pos': invalidar_recibo_pos,
     }
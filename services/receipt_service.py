@@ -1,55 +1,49 @@
 from datetime import datetime
 import base64
+import hashlib
+import json
+import logging
 import os
 from pathlib import Path
 import shutil
 import subprocess
+import threading
 
 import pandas as pd
 
+from models.constants import RECIBO_POS_TEXTOS
+from services import pdf_recibo_service
+from services.receipt_cache_service import CacheRecibos
+from services.pdf_navegador_service import PoolNavegadoresPDF
+
+logger = logging.getLogger(__name__)
+
 
 def construir_datos_recibo_pos(
     id_pedido,
     *,
-    cargar_detalle_pedido_df_fn,
-    cargar_productos_df_fn,
-    cargar_pagos_df_fn,
-    cargar_pedidos_df_fn,
+    obtener_datos_recibo_pedido_fn,
     tallas_opciones,
     ultimo_recibo_pos=None,
 ):
-    detalle = cargar_detalle_pedido_df_fn()
-    if detalle.empty:
+    datos_pedido = obtener_datos_recibo_pedido_fn(id_pedido)
+    if not datos_pedido or not datos_pedido.get("lineas"):
         raise ValueError(f"No existe detalle para el pedido #{id_pedido}.")
 
-    detalle = detalle.copy()
-    detalle["id_pedido"] = pd.to_numeric(detalle["id_pedido"], errors="coerce")
-    detalle = detalle[detalle["id_pedido"] == int(id_pedido)]
-    if detalle.empty:
-        raise ValueError(f"No existe detalle para el pedido #{id_pedido}.")
-
-    if "id_detalle" in detalle.columns:
-        detalle = detalle.sort_values(by="id_detalle", ascending=True, na_position="last")
-
-    productos_df = cargar_productos_df_fn()
-    productos_df["id_producto"] = pd.to_numeric(productos_df["id_producto"], errors="coerce")
-    productos_map = {}
-    for _, row in productos_df.iterrows():
-        if pd.notna(row.get("id_producto")):
-            productos_map[int(row["id_producto"])] = str(row.get("nombre", "")).strip()
-
     items = []
-    for _, row in detalle.iterrows():
-        id_producto = int(pd.to_numeric(row.get("id_producto"), errors="coerce") or 0)
-        cantidad = int(pd.to_numeric(row.get("cantidad", 0), errors="coerce") or 0)
-        subtotal = float(pd.to_numeric(row.get("subtotal", 0), errors="coerce") or 0)
-        talla = str(row.get("talla", "") or "").strip().upper()
+    for linea in datos_pedido["lineas"]:
+        id_producto = int(linea.get("id_producto") or 0)
+        cantidad = int(linea.get("cantidad") or 0)
+        subtotal = float(linea.get("subtotal") or 0)
+        talla = str(linea.get("talla", "") or "").strip().upper()
         if talla not in tallas_opciones:
             talla = "-"
         if cantidad <= 0:
             cantidad = 1
         valor_unitario = subtotal / cantidad if cantidad else subtotal
-        descripcion = productos_map.get(id_producto, f"Producto #{id_producto}")
+        descripcion = linea.get("nombre")
+        if descripcion is None:
+            descripcion = f"Producto #{id_producto}"
         items.append(
             {
                 "cantidad": cantidad,
@@ -60,22 +54,15 @@ def construir_datos_recibo_pos(
             }
         )
 
-    pagos = cargar_pagos_df_fn()
-    pagos["id_pedido"] = pd.to_numeric(pagos["id_pedido"], errors="coerce")
-    pago_pedido = pagos[pagos["id_pedido"] == int(id_pedido)].copy()
-    pago_row = None
-    if not pago_pedido.empty:
-        pago_pedido["id_pago"] = pd.to_numeric(pago_pedido["id_pago"], errors="coerce")
-        pago_pedido = pago_pedido.sort_values(by="id_pago", ascending=False, na_position="last")
-        pago_row = pago_pedido.iloc[0]
-
+    pago = datos_pedido.get("pago")
     metodo_pago = ""
     monto_total = float(sum(item["total"] for item in items))
     descuento_total = 0.0
-    if pago_row is not None:
-        metodo_pago = str(pago_row.get("metodo_pago", "")).strip().lower()
-        monto_total = float(pd.to_numeric(pago_row.get("monto", monto_total), errors="coerce") or monto_total)
-        descuento_total = float(pd.to_numeric(pago_row.get("monto_descuento", 0), errors="coerce") or 0)
+    if pago is not None:
+        metodo_pago = str(pago.get("metodo_pago", "")).strip().lower()
+        if pago.get("monto") is not None:
+            monto_total = float(pago["monto"]) or monto_total
+        descuento_total = float(pago.get("monto_descuento") or 0)
 
     metodo_label = {
         "efectivo": "Efectivo",
@@ -84,15 +71,10 @@ def construir_datos_recibo_pos(
         "qr": "QR",
     }.get(metodo_pago, metodo_pago.title() if metodo_pago else "No especificado")
 
-    pedidos = cargar_pedidos_df_fn()
-    pedidos["id_pedido"] = pd.to_numeric(pedidos["id_pedido"], errors="coerce")
-    pedido_row = pedidos[pedidos["id_pedido"] == int(id_pedido)]
     fecha_compra = datetime.now()
-    if not pedido_row.empty:
-        fecha_raw = pedido_row.iloc[0].get("fecha_pedido", "")
-        fecha_parseada = pd.to_datetime(fecha_raw, errors="coerce")
-        if pd.notna(fecha_parseada):
-            fecha_compra = fecha_parseada.to_pydatetime()
+    fecha_parseada = pd.to_datetime(datos_pedido.get("fecha_pedido"), errors="coerce")
+    if pd.notna(fecha_parseada):
+        fecha_compra = fecha_parseada.to_pydatetime()
 
     ultimo_recibo = ultimo_recibo_pos or {}
     cliente_nombre = ""
@@ -128,6 +110,81 @@ def particionar_items_recibo(items, max_items_por_pagina=8):
     return [items[i : i + max_items_por_pagina] for i in range(0, len(items), max_items_por_pagina)]
 
 
+def version_plantilla_recibo_pos(app_root_path):
+    """Firma de los archivos que definen el aspecto del recibo (plantilla, CSS y marca de agua)."""
+    rutas = (
+        os.path.join(app_root_path, "templates", "Administrador", "Sistema POS", "recibo_pos_pdf.html"),
+        ruta_css_recibo_pos(app_root_path),
+        ruta_marca_agua_recibo(app_root_path) or "",
+    )
+    # Los textos fijos viven en codigo (RECIBO_POS_TEXTOS), no en la plantilla: tambien
+    # forman parte de la firma para que un cambio invalide los recibos ya generados.
+    firma = [["textos", RECIBO_POS_TEXTOS]]
+    for ruta in rutas:
+        try:
+            estado = os.stat(ruta)
+            firma.append([ruta, estado.st_mtime_ns, estado.st_size])
+        except OSError:
+            firma.append([ruta, None, None])
+    return firma
+
+
+def huella_recibo_pos(
+    id_pedido,
+    *,
+    obtener_datos_recibo_pedido_fn,
+    ultimo_recibo_pos=None,
+    version_plantilla=None,
+):
+    """
+    Huella del contenido del recibo: lineas del pedido, ultimo pago, datos del cliente de
+    la venta POS en sesion y version de la plantilla. Sirve como llave de cache y ETag.
+    """
+    datos_pedido = obtener_datos_recibo_pedido_fn(id_pedido)
+    if not datos_pedido or not datos_pedido.get("lineas"):
+        raise ValueError(f"No existe detalle para el pedido #{id_pedido}.")
+
+    ultimo_recibo = ultimo_recibo_pos or {}
+    cliente = {}
+    if str(ultimo_recibo.get("id_pedido", "")) == str(id_pedido):
+        cliente = {
+            campo: str(ultimo_recibo.get(campo, "")).strip()
+            for campo in ("cliente_nombre", "cliente_correo", "cliente_documento", "cliente_telefono")
+        }
+    contenido = json.dumps(
+        {
+            "id_pedido": int(id_pedido),
+            "fecha_pedido": str(datos_pedido.get("fecha_pedido") or ""),
+            "lineas": datos_pedido["lineas"],
+            "pago": datos_pedido.get("pago"),
+            "cliente": cliente,
+            "plantilla": version_plantilla,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:32]
+
+
+def crear_cache_recibos(directorio, max_mb=64):
+    return CacheRecibos(directorio, int(float(max_mb) * 1024 * 1024))
+
+
+def obtener_recibo_pos_cacheado(id_pedido, tipo, *, huella, cache, generar_fn):
+    """Devuelve los bytes del recibo (`tipo` 'pdf' o 'html') desde la cache o generandolos."""
+    if cache is not None:
+        contenido = cache.obtener(id_pedido, huella, tipo)
+        if contenido is not None:
+            return contenido
+
+    contenido = generar_fn(id_pedido)
+    if isinstance(contenido, str):
+        contenido = contenido.encode("utf-8")
+    if cache is not None:
+        cache.guardar(id_pedido, huella, tipo, contenido)
+    return contenido
+
+
 def construir_contexto_recibo_pos(
     id_pedido,
     *,
@@ -172,6 +229,7 @@ def construir_contexto_recibo_pos(
         cliente_campos.append({"label": "Correo", "valor": cliente_mail})
 
     return {
+        "textos": RECIBO_POS_TEXTOS,
         "id_pedido": int(datos["id_pedido"]),
         "codigo_recibo": f"POS-{int(datos['id_pedido']):06d}",
         "fecha_txt": fecha_txt,
@@ -191,10 +249,32 @@ def construir_contexto_recibo_pos(
     }
 
 
-def cargar_css_recibo_pos(app_root_path):
-    ruta_css = os.path.join(app_root_path, "static", "css", "administrador", "admin_pos_recibo.css")
-    if not os.path.exists(ruta_css):
-        return ""
+_archivos_recibo_lock = threading.Lock()
+_archivos_recibo_cache = {}
+
+
+def _leer_archivo_recibo_cacheado(ruta, lector):
+    """Devuelve lector(ruta) y lo reutiliza mientras el archivo no cambie (mtime/tamano)."""
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    firma = (estado.st_mtime_ns, estado.st_size)
+    with _archivos_recibo_lock:
+        cacheado = _archivos_recibo_cache.get((ruta, lector))
+        if cacheado is not None and cacheado[0] == firma:
+            return cacheado[1]
+    valor = lector(ruta)
+    with _archivos_recibo_lock:
+        _archivos_recibo_cache[(ruta, lector)] = (firma, valor)
+    return valor
+
+
+def ruta_css_recibo_pos(app_root_path):
+    return os.path.join(app_root_path, "static", "css", "administrador", "admin_pos_recibo.css")
+
+
+def _leer_css(ruta_css):
     try:
         with open(ruta_css, "r", encoding="utf-8") as f_css:
             return f_css.read()
@@ -203,30 +283,41 @@ def cargar_css_recibo_pos(app_root_path):
             return f_css.read()
 
 
-def cargar_marca_agua_recibo_src(app_root_path):
+def cargar_css_recibo_pos(app_root_path):
+    return _leer_archivo_recibo_cacheado(ruta_css_recibo_pos(app_root_path), _leer_css) or ""
+
+
+def ruta_marca_agua_recibo(app_root_path):
     carpeta = os.path.join(app_root_path, "static", "img", "Pagina")
-    candidatos = ("recibo.png", "nachoher_fondo_logo.jpg", "logo.jpeg")
-    mime_por_ext = {
+    for nombre in ("recibo.png", "nachoher_fondo_logo.jpg", "logo.jpeg"):
+        ruta = os.path.join(carpeta, nombre)
+        if os.path.exists(ruta):
+            return ruta
+    return None
+
+
+def _src_marca_agua(ruta_imagen):
+    ruta = Path(ruta_imagen)
+    try:
+        return ruta.resolve().as_uri()
+    except ValueError:
+        pass
+
+    mime = {
         ".png": "image/png",
         ".jpg": "image/jpeg",
         ".jpeg": "image/jpeg",
-    }
+    }.get(ruta.suffix.lower(), "application/octet-stream")
+    with open(ruta, "rb") as f_img:
+        contenido_b64 = base64.b64encode(f_img.read()).decode("ascii")
+    return f"data:{mime};base64,{contenido_b64}"
 
-    for nombre in candidatos:
-        ruta = Path(carpeta) / nombre
-        if not ruta.exists():
-            continue
-        try:
-            return ruta.resolve().as_uri()
-        except ValueError:
-            pass
 
-        ext = ruta.suffix.lower()
-        mime = mime_por_ext.get(ext, "application/octet-stream")
-        with open(ruta, "rb") as f_img:
-            contenido_b64 = base64.b64encode(f_img.read()).decode("ascii")
-        return f"data:{mime};base64,{contenido_b64}"
-    return ""
+def cargar_marca_agua_recibo_src(app_root_path):
+    ruta = ruta_marca_agua_recibo(app_root_path)
+    if not ruta:
+        return ""
+    return _leer_archivo_recibo_cacheado(ruta, _src_marca_agua) or ""
 
 
 def render_html_recibo_pos(
@@ -272,16 +363,69 @@ def buscar_msedge(edge_path_env=""):
     return None
 
 
+def buscar_navegador_pdf(edge_path_env=""):
+    """Edge (o EDGE_PATH) y, si no esta, Chromium/Chrome para el pool DevTools."""
+    ruta_edge = buscar_msedge(edge_path_env=edge_path_env)
+    if ruta_edge:
+        return ruta_edge
+    for exe in ("chromium", "chromium-browser", "google-chrome", "google-chrome-stable", "chrome"):
+        encontrado = shutil.which(exe)
+        if encontrado:
+            return encontrado
+    return None
+
+
+def crear_pool_navegadores_pdf(app_root_path, buscar_navegador_fn, max_navegadores=2):
+    # La pestana se abre sobre la raiz de la app (origen file://) para que la marca de agua,
+    # referenciada como file://, cargue igual que en la conversion por linea de comandos.
+    url_base = Path(app_root_path).resolve().as_uri() + "/"
+    return PoolNavegadoresPDF(buscar_navegador_fn, url_base, max_navegadores=max_navegadores)
+
+
+def generar_pdf_recibo_pos_nativo(id_pedido, *, construir_contexto_recibo_pos_fn, app_root_path, estricto=True):
+    """Recibo dibujado por el motor PDF propio (sin navegador); mismo contexto que la plantilla HTML."""
+    return pdf_recibo_service.generar_pdf_recibo(
+        construir_contexto_recibo_pos_fn(id_pedido),
+        ruta_css_recibo_pos(app_root_path),
+        ruta_marca_agua_recibo(app_root_path),
+        estricto=estricto,
+    )
+
+
 def generar_pdf_recibo_pos(
     id_pedido,
     *,
     render_html_recibo_pos_fn,
     buscar_msedge_fn,
     app_root_path,
+    pool_navegadores=None,
+    generar_pdf_nativo_fn=None,
 ):
+    texto_no_representable = False
+    if generar_pdf_nativo_fn is not None:
+        try:
+            return generar_pdf_nativo_fn(id_pedido)
+        except ValueError:
+            raise
+        except pdf_recibo_service.TextoNoRepresentable as exc:
+            texto_no_representable = True
+            logger.info("Recibo #%s con texto fuera de WinAnsi; se usa el navegador: %s", id_pedido, exc)
+        except Exception as exc:
+            logger.warning("El motor PDF nativo no pudo generar el recibo #%s: %s", id_pedido, exc)
+
     html = render_html_recibo_pos_fn(id_pedido)
+    if pool_navegadores is not None and pool_navegadores.disponible():
+        try:
+            return pool_navegadores.imprimir_pdf(html)
+        except Exception as exc:
+            logger.warning("El pool de navegadores no pudo generar el recibo #%s: %s", id_pedido, exc)
+
     ruta_edge = buscar_msedge_fn()
     if not ruta_edge:
+        if texto_no_representable:
+            # Sin navegador, un recibo con algun '?' es mejor que ninguno.
+            logger.warning("Recibo #%s generado con el motor nativo y caracteres sustituidos por '?'", id_pedido)
+            return generar_pdf_nativo_fn(id_pedido, estricto=False)
         raise RuntimeError(
             "No se encontro Microsoft Edge para convertir el recibo a PDF. "
             "Configura EDGE_PATH o instala Edge."
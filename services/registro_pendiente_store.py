@@ -0,0 +1,120 @@
+"""
+Almacenes de registros pendientes de verificacion (codigo enviado por correo).
+
+- RegistrosPendientesMemoria: diccionario del proceso con un min-heap de expiraciones;
+  limpiar solo revisa los registros vencidos, no todo el diccionario.
+- RegistrosPendientesPostgres: tabla registro_pendiente compartida por todos los workers;
+  las consultas filtran por expiracion y la limpieza usa el indice de expira_en.
+
+Ambos exponen guardar / obtener / eliminar / limpiar_expirados con la misma forma de datos
+que el antiguo PENDING_REGISTRATIONS: {'code', 'expiry_at', 'nombre', 'password'}.
+"""
+
+from datetime import datetime, timedelta
+import heapq
+import threading
+
+import sqlalchemy as sa
+
+
+class RegistrosPendientesMemoria:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._registros = {}
+        self._expiraciones = []
+
+    def guardar(self, email, datos, minutos_expiracion):
+        expiry_at = datetime.now() + timedelta(minutes=minutos_expiracion)
+        with self._lock:
+            self._limpiar_expirados_sin_lock(datetime.now())
+            self._registros[email] = dict(datos, expiry_at=expiry_at)
+            heapq.heappush(self._expiraciones, (expiry_at, email))
+        return expiry_at
+
+    def obtener(self, email):
+        ahora = datetime.now()
+        with self._lock:
+            self._limpiar_expirados_sin_lock(ahora)
+            registro = self._registros.get(email)
+            if registro is None or ahora > registro["expiry_at"]:
+                return None
+            return dict(registro)
+
+    def eliminar(self, email):
+        with self._lock:
+            self._registros.pop(email, None)
+
+    def limpiar_expirados(self):
+        with self._lock:
+            self._limpiar_expirados_sin_lock(datetime.now())
+
+    def _limpiar_expirados_sin_lock(self, ahora):
+        while self._expiraciones and self._expiraciones[0][0] < ahora:
+            expiry_at, email = heapq.heappop(self._expiraciones)
+            registro = self._registros.get(email)
+            # Un reenvio de codigo deja entradas viejas en el heap; solo cuenta la vigente.
+            if registro is not None and registro["expiry_at"] == expiry_at:
+                del self._registros[email]
+
+
+class RegistrosPendientesPostgres:
+    def __init__(self, engine):
+        self._engine = engine
+
+    def guardar(self, email, datos, minutos_expiracion):
+        expiry_at = datetime.now() + timedelta(minutes=minutos_expiracion)
+        with self._engine.begin() as conn:
+            conn.execute(
+                sa.text("""
+                    INSERT INTO registro_pendiente (email, codigo, nombre, password, expira_en)
+                    VALUES (:email, :codigo, :nombre, :password, NOW() + make_interval(mins => :minutos))
+                    ON CONFLICT (email) DO UPDATE
+                    SET codigo = EXCLUDED.codigo,
+                        nombre = EXCLUDED.nombre,
+                        password = EXCLUDED.password,
+                        expira_en = EXCLUDED.expira_en
+                """),
+                {
+                    "email": email,
+                    "codigo": datos.get("code", ""),
+                    "nombre": datos.get("nombre", ""),
+                    "password": datos.get("password", ""),
+                    "minutos": int(minutos_expiracion),
+                },
+            )
+            conn.execute(sa.text("DELETE FROM registro_pendiente WHERE expira_en <= NOW()"))
+        return expiry_at
+
+    def obtener(self, email):
+        with self._engine.connect() as conn:
+            fila = conn.execute(
+                sa.text("""
+                    SELECT codigo, nombre, password, expira_en
+                    FROM registro_pendiente
+                    WHERE email = :email AND expira_en > NOW()
+                """),
+                {"email": email},
+            ).mappings().first()
+        if not fila:
+            return None
+        return {
+            "code": fila["codigo"],
+            "expiry_at": fila["expira_en"].astimezone().replace(tzinfo=None),
+            "nombre": fila["nombre"],
+            "password": fila["password"],
+        }
+
+    def eliminar(self, email):
+        with self._engine.begin() as conn:
+            conn.execute(sa.text("DELETE FROM registro_pendiente WHERE email = :email"), {"email": email})
+
+    def limpiar_expirados(self):
+        with self._engine.begin() as conn:
+            conn.execute(sa.text("DELETE FROM registro_pendiente WHERE expira_en <= NOW()"))
+
+
+def crear_almacen_registros_pendientes(backend, engine=None):
+    """Devuelve el almacen configurado: 'postgres' (compartido entre workers) o 'memoria'."""
+    if str(backend or "").strip().lower() == "memoria":
+        return RegistrosPendientesMemoria()
+    return RegistrosPendientesPostgres(engine)
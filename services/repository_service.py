@@ -0,0 +1,238 @@
+"""
+Consultas puntuales por llave para las rutas de alto trafico.
+Evitan cargar tablas completas en DataFrames cuando solo se necesita una fila.
+"""
+
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from core.db_utils import engine
+from models.constants import *
+from services import image_service as app_image_service
+
+
+def _texto(valor, default=''):
+    return default if valor is None else str(valor)
+
+
+def _normalizar_usuario(fila):
+    usuario = {col: fila.get(col) for col in USUARIO_COLUMNS}
+    for col in USUARIO_COLUMNS:
+        if col in {'id_usuario', 'email_verified', 'terminos_identidad_aceptados'}:
+            continue
+        usuario[col] = _texto(usuario[col])
+    usuario['email_verified'] = bool(usuario['email_verified'])
+    usuario['terminos_identidad_aceptados'] = bool(usuario['terminos_identidad_aceptados'])
+    estado = usuario['estado'].strip().lower()
+    usuario['estado'] = estado if estado in {'activo', 'inactivo'} else 'activo'
+    return usuario
+
+
+def _normalizar_producto(fila):
+    producto = {col: fila.get(col) for col in PRODUCTO_COLUMNS}
+    producto['precio'] = float(producto['precio'] or 0)
+    producto['stock'] = int(producto['stock'] or 0)
+    producto['id_categoria'] = int(producto['id_categoria'] or 0)
+    producto['eliminado'] = bool(producto['eliminado'])
+    producto['destacado_dashboard'] = bool(producto['destacado_dashboard'])
+    for col in ['nombre', 'descripcion', 'fuerza', 'intendencia']:
+        producto[col] = _texto(producto[col])
+    producto['imagen_url'] = app_image_service.normalizar_imagen_url(_texto(producto['imagen_url']))
+    return producto
+
+
+def _normalizar_pago(fila):
+    pago = {col: fila.get(col) for col in PAGO_COLUMNS}
+    for col in ['monto', 'valor_descuento', 'monto_descuento']:
+        pago[col] = float(pago[col] or 0)
+    for col in ['metodo_pago', 'fecha_pago', 'estado_pago', 'comprobante_url', 'codigo_promo', 'tipo_descuento']:
+        pago[col] = _texto(pago[col])
+    return pago
+
+
+def obtener_usuario_por_email(email):
+    """Devuelve el usuario (dict) cuyo email coincide sin distinguir mayusculas, o None."""
+    email_norm = str(email or '').strip().lower()
+    if not email_norm:
+        return None
+    with engine.connect() as conn:
+        fila = conn.execute(
+            sa.text("""
+                SELECT *
+                FROM usuarios
+                WHERE LOWER(TRIM(email)) = :email
+                ORDER BY id_usuario
+                LIMIT 1
+            """),
+            {'email': email_norm},
+        ).mappings().first()
+    return _normalizar_usuario(fila) if fila else None
+
+
+def registrar_inicio_sesion_usuario(id_usuario, password_hash_nuevo=None):
+    """
+    Marca en un solo UPDATE la aceptacion de terminos del usuario que inicia sesion y,
+    si se indica, reemplaza su password_hash (migracion de contrasenas sin hash).
+    """
+    with engine.begin() as conn:
+        resultado = conn.execute(
+            sa.text("""
+                UPDATE usuarios
+                SET terminos_identidad_aceptados = TRUE,
+                    terminos_identidad_fecha = :fecha,
+                    password_hash = COALESCE(:password_hash, password_hash)
+                WHERE id_usuario = :id_usuario
+            """),
+            {
+                'id_usuario': int(id_usuario),
+                'fecha': datetime.now().replace(microsecond=0),
+                'password_hash': password_hash_nuevo,
+            },
+        )
+    return resultado.rowcount > 0
+
+
+def obtener_producto(id_producto, incluir_eliminados=False):
+    """Devuelve el producto (dict) por id; por defecto ignora los enviados a la papelera."""
+    with engine.connect() as conn:
+        fila = conn.execute(
+            sa.text("""
+                SELECT *
+                FROM producto
+                WHERE id_producto = :id_producto
+                  AND (:incluir_eliminados OR COALESCE(eliminado, FALSE) = FALSE)
+            """),
+            {'id_producto': int(id_producto), 'incluir_eliminados': bool(incluir_eliminados)},
+        ).mappings().first()
+    return _normalizar_producto(fila) if fila else None
+
+
+def obtener_pedido_con_detalle(id_pedido, id_usuario=None):
+    """
+    Devuelve {'pedido': dict, 'detalles': [dict]} o None.
+    Si se indica id_usuario solo retorna el pedido cuando le pertenece. El pedido
+    incluye `numero_pedido_usuario` (posicion del pedido entre los del mismo usuario)
+    y cada detalle trae `nombre` y `precio` del producto.
+    """
+    filtro_usuario = "AND p.id_usuario = :id_usuario" if id_usuario is not None else ""
+    params = {'id_pedido': int(id_pedido)}
+    if id_usuario is not None:
+        params['id_usuario'] = int(id_usuario)
+
+    with engine.connect() as conn:
+        pedido = conn.execute(
+            sa.text(f"""
+                SELECT p.*,
+                       (
+                           SELECT COUNT(*)
+                           FROM pedidos p2
+                           WHERE p2.id_usuario = p.id_usuario AND p2.id_pedido <= p.id_pedido
+                       ) AS numero_pedido_usuario
+                FROM pedidos p
+                WHERE p.id_pedido = :id_pedido {filtro_usuario}
+            """),
+            params,
+        ).mappings().first()
+        if not pedido:
+            return None
+        detalles = conn.execute(
+            sa.text("""
+                SELECT d.id_detalle, d.id_pedido, d.id_producto, d.cantidad, d.subtotal,
+                       COALESCE(d.talla, '') AS talla, pr.nombre, pr.precio
+                FROM detalle_pedido d
+                JOIN producto pr ON pr.id_producto = d.id_producto
+                WHERE d.id_pedido = :id_pedido
+                ORDER BY d.id_detalle
+            """),
+            {'id_pedido': int(id_pedido)},
+        ).mappings().all()
+
+    pedido_dict = {col: pedido.get(col) for col in PEDIDO_COLUMNS}
+    pedido_dict['id_usuario'] = _texto(pedido_dict['id_usuario'])
+    pedido_dict['fecha_pedido'] = _texto(pedido_dict['fecha_pedido'])
+    pedido_dict['estado'] = _texto(pedido_dict['estado'], 'confirmado')
+    pedido_dict['cliente_telefono'] = _texto(pedido_dict['cliente_telefono'])
+    pedido_dict['cliente_direccion'] = _texto(pedido_dict['cliente_direccion'])
+    pedido_dict['numero_pedido_usuario'] = int(pedido['numero_pedido_usuario'] or 0) or ''
+
+    lista_detalles = []
+    for detalle in detalles:
+        item = dict(detalle)
+        item['cantidad'] = int(item['cantidad'] or 0)
+        item['subtotal'] = float(item['subtotal'] or 0)
+        item['precio'] = float(item['precio'] or 0)
+        item['nombre'] = _texto(item['nombre'])
+        lista_detalles.append(item)
+    return {'pedido': pedido_dict, 'detalles': lista_detalles}
+
+
+def ultimo_pago_de_pedido(id_pedido):
+    """Devuelve el pago mas reciente (mayor id_pago) del pedido, o None."""
+    with engine.connect() as conn:
+        fila = conn.execute(
+            sa.text("""
+                SELECT *
+                FROM pagos
+                WHERE id_pedido = :id_pedido
+                ORDER BY id_pago DESC
+                LIMIT 1
+            """),
+            {'id_pedido': int(id_pedido)},
+        ).mappings().first()
+    return _normalizar_pago(fila) if fila else None
+
+
+def obtener_datos_recibo_pedido(id_pedido):
+    """
+    Lineas del pedido (con el nombre del producto), fecha del pedido y ultimo pago en
+    una sola consulta. Devuelve {'fecha_pedido', 'lineas': [dict], 'pago': dict|None}
+    o None si el pedido no tiene detalle.
+    """
+    with engine.connect() as conn:
+        filas = conn.execute(
+            sa.text("""
+                SELECT d.id_detalle, d.id_producto, d.cantidad, d.subtotal,
+                       COALESCE(d.talla, '') AS talla,
+                       pr.id_producto AS producto_existe, pr.nombre,
+                       p.fecha_pedido,
+                       pg.id_pago, pg.metodo_pago, pg.monto, pg.monto_descuento, pg.estado_pago
+                FROM detalle_pedido d
+                LEFT JOIN producto pr ON pr.id_producto = d.id_producto
+                LEFT JOIN pedidos p ON p.id_pedido = d.id_pedido
+                LEFT JOIN LATERAL (
+                    SELECT id_pago, metodo_pago, monto, monto_descuento, estado_pago
+                    FROM pagos
+                    WHERE pagos.id_pedido = d.id_pedido
+                    ORDER BY id_pago DESC
+                    LIMIT 1
+                ) pg ON TRUE
+                WHERE d.id_pedido = :id_pedido
+                ORDER BY d.id_detalle
+            """),
+            {'id_pedido': int(id_pedido)},
+        ).mappings().all()
+    if not filas:
+        return None
+
+    primera = filas[0]
+    pago = None
+    if primera['id_pago'] is not None:
+        pago = {
+            'id_pago': int(primera['id_pago']),
+            'metodo_pago': _texto(primera['metodo_pago']),
+            'monto': None if primera['monto'] is None else float(primera['monto']),
+            'monto_descuento': float(primera['monto_descuento'] or 0),
+            'estado_pago': _texto(primera['estado_pago']),
+        }
+    lineas = [
+        {
+            'id_producto': int(fila['id_producto'] or 0),
+            'cantidad': int(fila['cantidad'] or 0),
+            'subtotal': float(fila['subtotal'] or 0),
+            'talla': _texto(fila['talla']),
+            'nombre': None if fila['producto_existe'] is None else _texto(fila['nombre']).strip(),
+        }
+        for fila in filas
+    ]
+    return {'fecha_pedido': primera['fecha_pedido'], 'lineas': lineas, 'pago': pago}
@@ -1,15 +1,10 @@
 ﻿"""Fachada de helpers runtime legacy usados por app.py."""
 
-from datetime import datetime
-
-import pandas as pd
-
 
 def build_runtime_bindings(
     *,
     session_obj,
-    cargar_registros_df_fn,
-    guardar_registros_df_fn,
+    anexar_actividad_fn,
     cargar_usuarios_df_fn,
     currency_code,
     currency_name,
@@ -19,17 +14,7 @@ def build_runtime_bindings(
         if not forzar and rol_actual != 'admin':
             return False
 
-        registros = cargar_registros_df_fn()
-        nuevo_id = int(pd.to_numeric(registros['id_registro'], errors='coerce').max() + 1) if not registros.empty else 1
-        actor = session_obj.get('usuario', 'admin')
-        nuevo_registro = {
-            'id_registro': nuevo_id,
-            'id_usuario': actor,
-            'accion': accion,
-            'fecha_accion': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        }
-        registros = pd.concat([registros, pd.DataFrame([nuevo_registro])], ignore_index=True)
-        guardar_registros_df_fn(registros)
+        anexar_actividad_fn(session_obj.get('usuario', 'admin'), accion)
         return True
 
     def obtener_nombre_sesion():
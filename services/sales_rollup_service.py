@@ -0,0 +1,92 @@
+"""
+Agregado diario de ventas (tabla ventas_diarias) para los informes del panel.
+
+Cada dia guarda tres niveles de agregacion, distinguidos por la columna `nivel`:
+- 'dia': pedidos del dia, unidades, subtotal del detalle, monto y cantidad de pagos.
+- 'producto': unidades y subtotal por id_producto.
+- 'metodo': monto y cantidad de pagos por metodo_pago.
+
+Los triggers de pedidos, detalle_pedido y pagos (ver core.db_utils) marcan en
+ventas_diarias_pendiente los dias afectados por cada escritura. Antes de leer el agregado
+se recalculan solo esos dias, asi que los informes nunca recorren el historial completo.
+"""
+
+import sqlalchemy as sa
+
+from core.db_utils import engine, fecha_hora_sql
+
+# Mismo criterio que los triggers: pedidos con fecha no reconocible no suman a ningun dia.
+_FECHA_PEDIDO_SQL = fecha_hora_sql("p.fecha_pedido")
+
+_RECALCULAR_DIAS_SQL = f"""
+    WITH pedidos_dia AS (
+        SELECT p.id_pedido, d.dia
+        FROM unnest(CAST(:dias AS DATE[])) AS d(dia)
+        JOIN pedidos p
+          ON {_FECHA_PEDIDO_SQL} >= d.dia
+         AND {_FECHA_PEDIDO_SQL} < d.dia + 1
+    ),
+    detalle_dia AS (
+        SELECT pd.dia, dp.id_producto,
+               COALESCE(dp.cantidad, 0) AS cantidad,
+               COALESCE(dp.subtotal, 0) AS subtotal
+        FROM pedidos_dia pd
+        JOIN detalle_pedido dp ON dp.id_pedido = pd.id_pedido
+    ),
+    pagos_dia AS (
+        SELECT pd.dia, COALESCE(pg.metodo_pago, '') AS metodo_pago, COALESCE(pg.monto, 0) AS monto
+        FROM pedidos_dia pd
+        JOIN pagos pg ON pg.id_pedido = pd.id_pedido
+    )
+    INSERT INTO ventas_diarias (dia, nivel, id_producto, metodo_pago, pedidos, unidades, subtotal, monto, pagos)
+    SELECT pd.dia, 'dia', NULL, NULL, COUNT(*),
+           COALESCE((SELECT SUM(cantidad) FROM detalle_dia dd WHERE dd.dia = pd.dia), 0),
+           COALESCE((SELECT SUM(subtotal) FROM detalle_dia dd WHERE dd.dia = pd.dia), 0),
+           COALESCE((SELECT SUM(monto) FROM pagos_dia pg WHERE pg.dia = pd.dia), 0),
+           (SELECT COUNT(*) FROM pagos_dia pg WHERE pg.dia = pd.dia)
+    FROM pedidos_dia pd
+    GROUP BY pd.dia
+    UNION ALL
+    SELECT dia, 'producto', id_producto, NULL, 0, SUM(cantidad), SUM(subtotal), 0, 0
+    FROM detalle_dia
+    GROUP BY dia, id_producto
+    UNION ALL
+    SELECT dia, 'metodo', NULL, metodo_pago, 0, 0, 0, SUM(monto), COUNT(*)
+    FROM pagos_dia
+    GROUP BY dia, metodo_pago
+"""
+
+
+# Clave de pg_try_advisory_xact_lock: un solo proceso recalcula a la vez.
+_CLAVE_BLOQUEO_REFRESCO = 2205001
+
+
+def refrescar_ventas_diarias():
+    """
+    Recalcula los dias marcados como pendientes y devuelve cuantos se actualizaron.
+    Sin dias pendientes solo cuesta una lectura. Si otro proceso ya esta recalculando no
+    se espera: se devuelve 0 y el lector usa el agregado tal como esta.
+    """
+    with engine.connect() as conn:
+        hay_pendientes = conn.execute(sa.text("SELECT EXISTS (SELECT 1 FROM ventas_diarias_pendiente)")).scalar()
+    if not hay_pendientes:
+        return 0
+
+    with engine.begin() as conn:
+        if not conn.execute(
+            sa.text("SELECT pg_try_advisory_xact_lock(:clave)"), {"clave": _CLAVE_BLOQUEO_REFRESCO}
+        ).scalar():
+            return 0
+        dias = conn.execute(sa.text("DELETE FROM ventas_diarias_pendiente RETURNING dia")).scalars().all()
+        if not dias:
+            return 0
+        conn.execute(sa.text("DELETE FROM ventas_diarias WHERE dia = ANY(:dias)"), {"dias": dias})
+        conn.execute(sa.text(_RECALCULAR_DIAS_SQL), {"dias": dias})
+        conn.execute(sa.text("UPDATE ventas_diarias_version SET version = version + 1 WHERE id = 1"))
+    return len(dias)
+
+
+def version_ventas_diarias():
+    """Contador que sube cada vez que se recalcula algun dia; sirve de marca para caches de informes."""
+    with engine.connect() as conn:
+        return int(conn.execute(sa.text("SELECT version FROM ventas_diarias_version WHERE id = 1")).scalar() or 0)
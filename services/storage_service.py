@@ -2,16 +2,124 @@
 Servicios de almacenamiento y normalizacion de tablas.
 """
 
+import logging
 import re
+import threading
+import time
 from typing import Any
 
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 
-from core.db_utils import engine, read_table_df, replace_table_df
+from core.db_utils import TABLE_PRIMARY_KEYS, engine, read_table_df, sync_table_df
 from models.constants import *
 from services import image_service as app_image_service
 
+logger = logging.getLogger(__name__)
+
+# Cache de catalogo (productos y promociones) compartido por el proceso.
+# La fila catalogo_version se incrementa en cada escritura; cada worker la consulta
+# como maximo una vez cada CATALOGO_VERSION_TTL_SEGUNDOS y reconstruye si cambio. Las ventas
+# solo incrementan version_stock, que refresca la columna stock sin rearmar el catalogo.
+CATALOGO_VERSION_TTL_SEGUNDOS = 2.0
+_catalogo_lock = threading.Lock()
+_catalogo_cache = {
+    'version': None,
+    'version_stock': None,
+    'verificado_en': 0.0,
+    'productos': None,
+    'promociones': None,
+}
+# Los DataFrames del snapshot llevan en attrs la version con la que se leyeron; sus copias
+# la heredan, asi el indice de promociones sabe a que version corresponde lo que recibe.
+_ATTR_VERSION_CATALOGO = 'version_catalogo'
+
+# Los cargar_*_df guardan en df.attrs una huella de las filas tal como se leyeron (llave
+# primaria y un hash por columna, no una copia); los guardar_*_df la usan como base del diff
+# para escribir solo lo que el request cambio y no pisar ni borrar filas que otro worker
+# modifico o inserto despues de la lectura.
+_ATTR_CARGA = 'carga_original'
+
+
+def _huella_columna(serie):
+    """Hash por fila de una columna; los numericos se comparan como float para que 1 y 1.0 coincidan."""
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_numeric_dtype(serie):
+        serie = serie.astype('float64')
+    else:
+        serie = serie.astype(object)
+    return pd.util.hash_pandas_object(serie, index=False).to_numpy()
+
+
+class _CargaOriginal:
+    """
+    Huella de un DataFrame cargado: llaves primarias y una matriz (filas x columnas) de
+    hashes uint64. pandas copia df.attrs en cada operacion; __copy__/__deepcopy__
+    devuelven la misma instancia para no duplicarla.
+    """
+
+    __slots__ = ('pk', 'llaves', 'columnas', 'huellas')
+
+    def __init__(self, df, pk):
+        con_llave = df[df[pk].notna()]
+        self.pk = pk
+        self.llaves = pd.Index(con_llave[pk])
+        self.columnas = list(df.columns)
+        self.huellas = (
+            np.column_stack([_huella_columna(con_llave[columna]) for columna in self.columnas])
+            if len(con_llave) else None
+        )
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def cambios(self, df):
+        """
+        Compara `df` contra la huella. Devuelve {'existentes': llaves cargadas,
+        'cambiadas': {llave: (columnas cuyo valor cambio, ...)}} para sync_table_df.
+        """
+        cambiadas = {}
+        if self.huellas is not None and self.pk in df.columns:
+            posiciones = self.llaves.get_indexer(df[self.pk])
+            presentes = posiciones >= 0
+            columnas = [columna for columna in df.columns if columna != self.pk]
+            distintas = np.zeros((int(presentes.sum()), len(columnas)), dtype=bool)
+            for j, columna in enumerate(columnas):
+                if columna not in self.columnas:
+                    distintas[:, j] = True
+                    continue
+                anteriores = self.huellas[posiciones[presentes], self.columnas.index(columna)]
+                distintas[:, j] = _huella_columna(df[columna])[presentes] != anteriores
+            llaves = df[self.pk].to_numpy()[presentes]
+            for fila in np.flatnonzero(distintas.any(axis=1)):
+                cambiadas[llaves[fila]] = tuple(columnas[j] for j in np.flatnonzero(distintas[fila]))
+        return {'existentes': self.llaves.tolist(), 'cambiadas': cambiadas}
+
+
+def _marcar_carga(df, tabla):
+    pk = TABLE_PRIMARY_KEYS[tabla]
+    if df[pk].dropna().duplicated().any():
+        # Una huella por llave no puede representar filas repetidas; el guardado cae al diff
+        # contra la tabla y sync_table_df rechaza las llaves duplicadas.
+        logger.warning("La tabla %s tiene valores repetidos en %s; se carga sin huella", tabla, pk)
+        df.attrs.pop(_ATTR_CARGA, None)
+        return df
+    df.attrs[_ATTR_CARGA] = _CargaOriginal(df, pk)
+    return df
+
+def _sincronizar_con_carga(tabla, df, preparar):
+    """Sincroniza `df` calculando el diff contra la huella de su carga."""
+    carga = df.attrs.get(_ATTR_CARGA)
+    if carga is None:
+        logger.warning(
+            "guardar %s recibio un DataFrame sin huella de carga; el diff se calcula contra la tabla actual",
+            tabla,
+        )
+        return sync_table_df(tabla, preparar(df))
+    return sync_table_df(tabla, preparar(df), cambios=carga.cambios(df))
 
 def asegurar_columnas_usuarios():
     with engine.begin() as conn:
@@ -63,14 +171,9 @@ def cargar_usuarios_df():
     
     usuarios['estado'] = usuarios['estado'].fillna('activo').astype(str).str.strip().str.lower()
     usuarios.loc[~usuarios['estado'].isin(['activo', 'inactivo']), 'estado'] = 'activo'
-    return usuarios[USUARIO_COLUMNS]
+    return _marcar_carga(usuarios[USUARIO_COLUMNS], 'usuarios')
 
-def guardar_usuarios_df(usuarios):
-    """
-    Persiste el DataFrame de usuarios en PostgreSQL manteniendo tipos correctos
-    para fechas y booleanos, y normalizando los tokens a texto.
-    """
-    asegurar_columnas_usuarios()
+def _preparar_usuarios_guardar(usuarios):
     df = usuarios.copy()
 
     # Normalizar columnas de texto
@@ -90,8 +193,15 @@ def guardar_usuarios_df(usuarios):
         df['email_verified'] = df['email_verified'].fillna(False).astype(bool)
     if 'terminos_identidad_aceptados' in df.columns:
         df['terminos_identidad_aceptados'] = df['terminos_identidad_aceptados'].fillna(False).astype(bool)
+    return df[USUARIO_COLUMNS]
 
-    replace_table_df('usuarios', df[USUARIO_COLUMNS])
+def guardar_usuarios_df(usuarios):
+    """
+    Persiste el DataFrame de usuarios en PostgreSQL manteniendo tipos correctos
+    para fechas y booleanos, y normalizando los tokens a texto.
+    """
+    asegurar_columnas_usuarios()
+    _sincronizar_con_carga('usuarios', usuarios, _preparar_usuarios_guardar)
 
 def cargar_registros_df():
     registros = read_table_df('registros')
@@ -105,13 +215,12 @@ def cargar_registros_df():
     registros['id_usuario'] = registros['id_usuario'].fillna('')
     registros['accion'] = registros['accion'].fillna('')
     registros['fecha_accion'] = registros['fecha_accion'].fillna('')
-    return registros[REGISTRO_COLUMNS]
+    return _marcar_carga(registros[REGISTRO_COLUMNS], 'registros')
 
 def guardar_registros_df(registros):
-    replace_table_df('registros', registros[REGISTRO_COLUMNS])
+    _sincronizar_con_carga('registros', registros, lambda df: df[REGISTRO_COLUMNS])
 
-def cargar_promociones_df():
-    """Carga el DataFrame de promociones desde la tabla SQL."""
+def _leer_promociones_df():
     promos = read_table_df('promociones')
     if promos.empty:
         promos = pd.DataFrame(columns=PROMO_COLUMNS)
@@ -137,11 +246,21 @@ def cargar_promociones_df():
     promos['id_producto'] = pd.to_numeric(promos['id_producto'], errors='coerce')
     promos['codigo'] = promos['codigo'].fillna('').astype(str).str.strip().str.upper()
     promos['activo'] = promos['activo'].astype(bool)
-    return promos[PROMO_COLUMNS]
+    return _marcar_carga(promos[PROMO_COLUMNS], 'promociones')
+
+def cargar_promociones_df(fresco=False):
+    """
+    Carga el DataFrame de promociones. Por defecto es una copia del snapshot cacheado del
+    catalogo; las rutas que van a guardar piden `fresco=True` para partir de la tabla actual.
+    """
+    if fresco:
+        return _leer_promociones_df()
+    return _snapshot_catalogo('promociones').copy()
 
 def guardar_promociones_df(promos):
     """Guarda las promociones en la tabla SQL."""
-    replace_table_df('promociones', promos[PROMO_COLUMNS])
+    _sincronizar_con_carga('promociones', promos, lambda df: df[PROMO_COLUMNS])
+    incrementar_version_catalogo()
 
 def normalizar_producto_personalizado(valor):
     return re.sub(r"\s+", " ", str(valor or "").strip().lower())
@@ -302,7 +421,63 @@ def actualizar_estado_ordenes_personalizadas_carrito(carrito, estado):
         )
 
 
-def cargar_productos_df():
+def incrementar_version_catalogo():
+    """Marca el catalogo como modificado para este y los demas workers."""
+    with engine.begin() as conn:
+        conn.execute(sa.text("UPDATE catalogo_version SET version = version + 1 WHERE id = 1"))
+    with _catalogo_lock:
+        _catalogo_cache['verificado_en'] = 0.0
+
+def _version_catalogo():
+    """Devuelve (version, version_stock) del catalogo."""
+    with engine.connect() as conn:
+        fila = conn.execute(sa.text("SELECT version, version_stock FROM catalogo_version WHERE id = 1")).first()
+    return (fila[0], fila[1]) if fila is not None else (None, None)
+
+def _refrescar_stock_productos(productos):
+    """Copia de `productos` con la columna stock releida de la tabla."""
+    with engine.connect() as conn:
+        stock = pd.read_sql(sa.text("SELECT id_producto, stock FROM producto"), conn)
+    por_id = pd.Series(
+        pd.to_numeric(stock['stock'], errors='coerce').fillna(0).astype(int).to_numpy(),
+        index=pd.to_numeric(stock['id_producto'], errors='coerce'),
+    )
+    por_id = por_id[~por_id.index.duplicated(keep='first')]
+    productos = productos.copy()
+    productos['stock'] = productos['id_producto'].map(por_id).fillna(productos['stock']).astype(int)
+    return _marcar_carga(productos, 'producto')
+
+def _snapshot_catalogo(clave):
+    """Devuelve el DataFrame cacheado ('productos' o 'promociones'), reconstruyendolo si la version cambio."""
+    with _catalogo_lock:
+        ahora = time.monotonic()
+        if (
+            _catalogo_cache[clave] is not None
+            and ahora - _catalogo_cache['verificado_en'] < CATALOGO_VERSION_TTL_SEGUNDOS
+        ):
+            return _catalogo_cache[clave]
+
+        version, version_stock = _version_catalogo()
+        if version != _catalogo_cache['version'] or _catalogo_cache['productos'] is None:
+            productos = _leer_productos_df()
+            promociones = _leer_promociones_df()
+            productos.attrs[_ATTR_VERSION_CATALOGO] = version
+            promociones.attrs[_ATTR_VERSION_CATALOGO] = version
+            _catalogo_cache['productos'] = productos
+            _catalogo_cache['promociones'] = promociones
+            _catalogo_cache['version'] = version
+            _catalogo_cache['version_stock'] = version_stock
+        elif version_stock != _catalogo_cache['version_stock']:
+            _catalogo_cache['productos'] = _refrescar_stock_productos(_catalogo_cache['productos'])
+            _catalogo_cache['version_stock'] = version_stock
+        _catalogo_cache['verificado_en'] = ahora
+        return _catalogo_cache[clave]
+
+def version_catalogo_df(df):
+    """Version de catalogo de un DataFrame copiado del snapshot (None si se leyo de la tabla)."""
+    return df.attrs.get(_ATTR_VERSION_CATALOGO)
+
+def _leer_productos_df():
     productos = read_table_df('producto')
     for column in PRODUCTO_COLUMNS:
         if column not in productos.columns:
@@ -340,9 +515,19 @@ def cargar_productos_df():
     productos['nombre'] = productos['nombre'].fillna('').astype(str)
     productos['descripcion'] = productos['descripcion'].fillna('').astype(str)
     productos['imagen_url'] = productos['imagen_url'].fillna('').astype(str)
-    return productos[PRODUCTO_COLUMNS]
+    return _marcar_carga(productos[PRODUCTO_COLUMNS], 'producto')
 
-def guardar_productos_df(productos):
+def cargar_productos_df(fresco=False):
+    """
+    Devuelve una copia del snapshot cacheado de productos (incluye eliminados), que puede
+    tener hasta CATALOGO_VERSION_TTL_SEGUNDOS de antiguedad. Las rutas que editan y guardan
+    productos piden `fresco=True` para leer la tabla y no escribir un stock viejo.
+    """
+    if fresco:
+        return _leer_productos_df()
+    return _snapshot_catalogo('productos').copy()
+
+def _preparar_productos_guardar(productos):
     productos = productos.copy()
     for column in PRODUCTO_COLUMNS:
         if column not in productos.columns:
@@ -357,7 +542,11 @@ def guardar_productos_df(productos):
 
     productos['eliminado'] = productos['eliminado'].fillna(False).astype(bool)
     productos['destacado_dashboard'] = productos['destacado_dashboard'].fillna(False).astype(bool)
-    replace_table_df('producto', productos[PRODUCTO_COLUMNS])
+    return productos[PRODUCTO_COLUMNS]
+
+def guardar_productos_df(productos):
+    _sincronizar_con_carga('producto', productos, _preparar_productos_guardar)
+    incrementar_version_catalogo()
 
 def cargar_productos_activos_df():
     productos = cargar_productos_df()
@@ -374,14 +563,17 @@ def cargar_pedidos_df():
     pedidos['estado'] = pedidos['estado'].fillna('confirmado')
     pedidos['cliente_telefono'] = pedidos['cliente_telefono'].fillna('').astype(str)
     pedidos['cliente_direccion'] = pedidos['cliente_direccion'].fillna('').astype(str)
-    return pedidos[PEDIDO_COLUMNS]
+    return _marcar_carga(pedidos[PEDIDO_COLUMNS], 'pedidos')
 
-def guardar_pedidos_df(pedidos):
+def _preparar_pedidos_guardar(pedidos):
     pedidos = pedidos.copy()
     for column in PEDIDO_COLUMNS:
         if column not in pedidos.columns:
             pedidos[column] = '' if column in {'id_usuario', 'fecha_pedido', 'estado', 'cliente_telefono', 'cliente_direccion'} else 0
-    replace_table_df('pedidos', pedidos[PEDIDO_COLUMNS])
+    return pedidos[PEDIDO_COLUMNS]
+
+def guardar_pedidos_df(pedidos):
+    _sincronizar_con_carga('pedidos', pedidos, _preparar_pedidos_guardar)
 
 def cargar_detalle_pedido_df():
     detalle = read_table_df('detalle_pedido')
@@ -395,14 +587,17 @@ def cargar_detalle_pedido_df():
     detalle['subtotal'] = pd.to_numeric(detalle['subtotal'], errors='coerce').fillna(0.0)
     if 'talla' in detalle.columns:
         detalle['talla'] = detalle['talla'].fillna('').astype(str)
-    return detalle[DETALLE_PEDIDO_COLUMNS]
+    return _marcar_carga(detalle[DETALLE_PEDIDO_COLUMNS], 'detalle_pedido')
 
-def guardar_detalle_pedido_df(detalle):
+def _preparar_detalle_pedido_guardar(detalle):
     detalle = detalle.copy()
     for column in DETALLE_PEDIDO_COLUMNS:
         if column not in detalle.columns:
             detalle[column] = '' if column == 'talla' else 0
-    replace_table_df('detalle_pedido', detalle[DETALLE_PEDIDO_COLUMNS])
+    return detalle[DETALLE_PEDIDO_COLUMNS]
+
+def guardar_detalle_pedido_df(detalle):
+    _sincronizar_con_carga('detalle_pedido', detalle, _preparar_detalle_pedido_guardar)
 
 def cargar_pagos_df():
     pagos = read_table_df('pagos')
@@ -434,9 +629,9 @@ def cargar_pagos_df():
     pagos['comprobante_url'] = pagos['comprobante_url'].fillna('')
     pagos['codigo_promo'] = pagos['codigo_promo'].fillna('')
     pagos['tipo_descuento'] = pagos['tipo_descuento'].fillna('')
-    return pagos[PAGO_COLUMNS]
+    return _marcar_carga(pagos[PAGO_COLUMNS], 'pagos')
 
-def guardar_pagos_df(pagos):
+def _preparar_pagos_guardar(pagos):
     pagos = pagos.copy()
     defaults = {
         'id_pago': 0,
@@ -455,7 +650,10 @@ def guardar_pagos_df(pagos):
     for column, default_value in defaults.items():
         if column not in pagos.columns:
             pagos[column] = default_value
-    replace_table_df('pagos', pagos[PAGO_COLUMNS])
+    return pagos[PAGO_COLUMNS]
+
+def guardar_pagos_df(pagos):
+    _sincronizar_con_carga('pagos', pagos, _preparar_pagos_guardar)
 
 def cargar_productos_por_fuerza(fuerza):
     productos = cargar_productos_activos_df()
@@ -6,6 +6,7 @@ def build_workflow_legacy_bindings(
     app_dashboard_service,
     app_mail_service,
     order_service,
+    admin_orders_query_service,
     request_obj,
     session_obj,
     app_obj,
@@ -15,6 +16,7 @@ def build_workflow_legacy_bindings(
     cargar_promociones_df_fn,
     obtener_mejor_promocion_por_producto_fn,
     calcular_descuento_promocion_fn,
+    evaluar_promociones_lote_fn,
     formatear_cop_fn,
     obtener_galeria_producto_fn,
     cargar_productos_df_fn,
@@ -35,9 +37,11 @@ def build_workflow_legacy_bindings(
     normalizar_email_fn,
     email_es_valido_fn,
     enviar_actualizacion_pedido_fn,
+    enviar_actualizaciones_pedido_lote_fn,
     enviar_notificacion_pago_personalizado_admin_fn,
     enviar_notificacion_transferencia_admin_fn,
     next_id_fn,
+    reserve_ids_fn,
     guardar_pagos_df_fn,
     guardar_detalle_pedido_df_fn,
     guardar_pedidos_df_fn,
@@ -49,13 +53,15 @@ def build_workflow_legacy_bindings(
     stripe_checkout_guardar_creado_fn,
     logger_obj,
     obtener_items_personalizados_carrito_fn,
+    engine,
+    sa_module,
 ):
     def _construir_contexto_home():
         return app_dashboard_service.construir_contexto_home(
             cargar_productos_activos_df_fn(),
             cargar_promociones_df_fn(),
             obtener_mejor_promocion_por_producto_fn=obtener_mejor_promocion_por_producto_fn,
-            calcular_descuento_promocion_fn=calcular_descuento_promocion_fn,
+            evaluar_promociones_lote_fn=evaluar_promociones_lote_fn,
             formatear_cop_fn=formatear_cop_fn,
             obtener_galeria_producto_fn=obtener_galeria_producto_fn,
         )
@@ -72,7 +78,7 @@ def build_workflow_legacy_bindings(
         )
 
     def _actualizar_destacados_dashboard():
-        productos = cargar_productos_df_fn()
+        productos = cargar_productos_df_fn(fresco=True)
         if productos.empty:
             return None
 
@@ -128,6 +134,7 @@ def build_workflow_legacy_bindings(
     _leer_filtros_admin_pedidos = order_service.leer_filtros_admin_pedidos
     _parse_positive_int = order_service.parse_positive_int
     _paginar_lista = order_service.paginar_lista
+    _construir_paginacion = order_service.construir_paginacion
 
     def _etiqueta_estado_pedido(estado):
         return order_service.etiqueta_estado_pedido(estado, pedido_status_alias, pedido_status_labels)
@@ -151,6 +158,24 @@ def build_workflow_legacy_bindings(
             per_page=per_page,
         )
 
+    def _consultar_pedidos_admin(filtros, per_page=10):
+        return admin_orders_query_service.consultar_pedidos_admin(
+            filtros,
+            pedido_status_flow=pedido_status_flow,
+            pedido_status_alias=pedido_status_alias,
+            pago_status_labels=pago_status_labels,
+            etiqueta_estado_pago_fn=_etiqueta_estado_pago,
+            per_page=per_page,
+        )
+
+    def _consultar_pedidos_en_curso(pagina_actual, per_page=6):
+        return admin_orders_query_service.consultar_pedidos_en_curso(
+            pagina_actual,
+            pedido_status_alias=pedido_status_alias,
+            etiqueta_estado_pago_fn=_etiqueta_estado_pago,
+            per_page=per_page,
+        )
+
     _serializar_pedidos_admin = order_service.serializar_pedidos_admin
     _construir_params_redireccion_admin_pedidos = order_service.construir_params_redireccion_admin_pedidos
 
@@ -200,6 +225,22 @@ def build_workflow_legacy_bindings(
             tipo_actualizacion=tipo_actualizacion,
         )
 
+    def _notificar_actualizaciones_pedidos_clientes(actualizaciones):
+        usuarios = cargar_usuarios_df_fn()
+        return app_mail_service.notificar_actualizaciones_pedidos_clientes(
+            actualizaciones,
+            obtener_contacto_notificacion_pedido_fn=lambda id_usuario: app_mail_service.obtener_contacto_notificacion_pedido(
+                id_usuario=id_usuario,
+                cargar_usuarios_df=lambda: usuarios,
+                normalizar_email=normalizar_email_fn,
+            ),
+            normalizar_email=normalizar_email_fn,
+            email_es_valido=email_es_valido_fn,
+            enviar_actualizaciones_pedido_lote=enviar_actualizaciones_pedido_lote_fn,
+            etiqueta_estado_pedido=_etiqueta_estado_pedido,
+            etiqueta_estado_pago=_etiqueta_estado_pago,
+        )
+
     _flash_resultado_notificacion_pedido = app_mail_service.flash_resultado_notificacion_pedido
 
     def _notificar_pago_personalizado_admin(
@@ -302,6 +343,7 @@ def build_workflow_legacy_bindings(
             guardar_detalle_pedido_df_fn=guardar_detalle_pedido_df_fn,
             cliente_telefono=cliente_telefono,
             cliente_direccion=cliente_direccion,
+            reserve_ids_fn=reserve_ids_fn,
         )
 
     def _crear_pago_para_pedido(
@@ -325,20 +367,54 @@ def build_workflow_legacy_bindings(
             estado_pago=estado_pago,
         )
 
+    def _registrar_orden(
+        id_usuario,
+        estado_pedido,
+        items_detalle,
+        monto,
+        metodo_pago,
+        resumen_promos,
+        monto_descuento,
+        estado_pago='aprobado',
+        cliente_telefono='',
+        cliente_direccion='',
+        carrito_stock=None,
+    ):
+        return order_service.registrar_orden(
+            id_usuario=id_usuario,
+            estado_pedido=estado_pedido,
+            items_detalle=items_detalle,
+            monto=monto,
+            metodo_pago=metodo_pago,
+            resumen_promos=resumen_promos,
+            monto_descuento=monto_descuento,
+            engine=engine,
+            sa_module=sa_module,
+            reserve_ids_fn=reserve_ids_fn,
+            estado_pago=estado_pago,
+            cliente_telefono=cliente_telefono,
+            cliente_direccion=cliente_direccion,
+            carrito_stock=carrito_stock,
+        )
+
+    def _actualizar_comprobante_pago(id_pago, comprobante_url):
+        return order_service.actualizar_comprobante_pago(
+            id_pago,
+            comprobante_url,
+            engine=engine,
+            sa_module=sa_module,
+        )
+
     def _registrar_venta_pos_admin(carrito_validado, metodo_pago, total, total_descuento):
         return order_service.registrar_venta_pos_admin(
             carrito_validado=carrito_validado,
             metodo_pago=metodo_pago,
             total=total,
             total_descuento=total_descuento,
-            cargar_pedidos_df_fn=cargar_pedidos_df_fn,
-            cargar_detalle_pedido_df_fn=cargar_detalle_pedido_df_fn,
-            cargar_pagos_df_fn=cargar_pagos_df_fn,
             session_usuario=session_obj.get('usuario', 'admin_pos'),
             construir_items_detalle_fn=_construir_items_detalle_desde_carrito,
-            crear_pedido_y_detalle_fn=_crear_pedido_y_detalle,
             resumen_promocion_pago_fn=_resumen_promocion_pago_desde_carrito,
-            crear_pago_para_pedido_fn=_crear_pago_para_pedido,
+            registrar_orden_fn=_registrar_orden,
         )
 
     _asegurar_columnas_descuento_pagos = order_service.asegurar_columnas_descuento_pagos
@@ -359,7 +435,7 @@ def build_workflow_legacy_bindings(
             productos,
             promos,
             obtener_mejor_promocion_por_producto_fn=obtener_mejor_promocion_por_producto_fn,
-            calcular_descuento_promocion_fn=calcular_descuento_promocion_fn,
+            evaluar_promociones_lote_fn=evaluar_promociones_lote_fn,
             buscar_promocion_por_codigo_fn=buscar_promocion_por_codigo_fn,
             codigo_promo=codigo_promo,
         )
@@ -386,9 +462,6 @@ def build_workflow_legacy_bindings(
 
     def _registrar_compra_checkout_usuario(
         carrito,
-        pedidos,
-        detalle_pedido,
-        pagos,
         metodo_pago,
         total_final,
         promo_aplicada,
@@ -396,23 +469,21 @@ def build_workflow_legacy_bindings(
         estado_pedido='confirmado',
         cliente_telefono='',
         cliente_direccion='',
+        descontar_stock=True,
     ):
         return order_service.registrar_compra_checkout_usuario(
             carrito=carrito,
-            pedidos=pedidos,
-            detalle_pedido=detalle_pedido,
-            pagos=pagos,
             metodo_pago=metodo_pago,
             total_final=total_final,
             promo_aplicada=promo_aplicada,
             descuento_promo=descuento_promo,
             construir_items_detalle_desde_carrito=_construir_items_detalle_desde_carrito,
-            crear_pedido_y_detalle=_crear_pedido_y_detalle,
             resumen_promocion_desde_promo_aplicada=_resumen_promocion_desde_promo_aplicada,
-            crear_pago_para_pedido=_crear_pago_para_pedido,
+            registrar_orden_fn=_registrar_orden,
             estado_pedido=estado_pedido,
             cliente_telefono=cliente_telefono,
             cliente_direccion=cliente_direccion,
+            descontar_stock=descontar_stock,
         )
 
     def _iniciar_pago_stripe_desde_carrito(carrito, codigo_promo, total_final):
@@ -444,15 +515,19 @@ def build_workflow_legacy_bindings(
         '_leer_filtros_admin_pedidos': _leer_filtros_admin_pedidos,
         '_parse_positive_int': _parse_positive_int,
         '_paginar_lista': _paginar_lista,
+        '_construir_paginacion': _construir_paginacion,
         '_etiqueta_estado_pedido': _etiqueta_estado_pedido,
         '_enriquecer_pedidos_con_tracking': _enriquecer_pedidos_con_tracking,
         '_filtrar_y_paginar_pedidos': _filtrar_y_paginar_pedidos,
+        '_consultar_pedidos_admin': _consultar_pedidos_admin,
+        '_consultar_pedidos_en_curso': _consultar_pedidos_en_curso,
         '_serializar_pedidos_admin': _serializar_pedidos_admin,
         '_construir_params_redireccion_admin_pedidos': _construir_params_redireccion_admin_pedidos,
         '_redirigir_admin_pedidos_con_filtros': _redirigir_admin_pedidos_con_filtros,
         '_redirigir_admin_pedidos_por_origen': _redirigir_admin_pedidos_por_origen,
         '_obtener_contacto_notificacion_pedido': _obtener_contacto_notificacion_pedido,
         '_notificar_actualizacion_pedido_cliente': _notificar_actualizacion_pedido_cliente,
+        '_notificar_actualizaciones_pedidos_clientes': _notificar_actualizaciones_pedidos_clientes,
         '_flash_resultado_notificacion_pedido': _flash_resultado_notificacion_pedido,
         '_notificar_pago_personalizado_admin': _notificar_pago_personalizado_admin,
         '_notificar_transferencia_admin': _notificar_transferencia_admin,
@@ -465,6 +540,8 @@ def build_workflow_legacy_bindings(
         '_construir_items_detalle_desde_carrito': _construir_items_detalle_desde_carrito,
         '_crear_pedido_y_detalle': _crear_pedido_y_detalle,
         '_crear_pago_para_pedido': _crear_pago_para_pedido,
+        '_registrar_orden': _registrar_orden,
+        '_actualizar_comprobante_pago': _actualizar_comprobante_pago,
         '_registrar_venta_pos_admin': _registrar_venta_pos_admin,
         '_asegurar_columnas_descuento_pagos': _asegurar_columnas_descuento_pagos,
         '_resolver_promocion_checkout': _resolver_promocion_checkout,